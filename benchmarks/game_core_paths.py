@@ -0,0 +1,300 @@
+"""
+Timings for the game_core hot paths at realistic sizes, on synthetic tournaments whose
+players and observers are in-memory BasePlayers:
+
+    make_move          per move, over long games (mostly reversible moves, so they run
+                       towards the fifty-move limit) watched by --observers observers
+    send_all           per PLAYER_MOVED broadcast to two players and --observers observers
+    update_pairings    one pass over --players waiting players, with --finished_games
+                       games already played between them
+    get_standings      one call, --players players and --finished_games finished games
+    load_from_history  a --finished_games game history file, without and with its index
+
+Results are written as JSON (--output). Given a previous run's JSON as --baseline, a
+path whose median is more than --threshold (a fraction) slower fails the run.
+
+Usage: python benchmarks/game_core_paths.py [--output results.json] [--baseline old.json --threshold 0.2]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from twisted.internet import task
+
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+
+import chess
+import game_core
+
+
+class MemoryPlayer(game_core.BasePlayer):
+    """A player or observer whose transport is a byte count."""
+    def __init__(self, name=None):
+        super(MemoryPlayer, self).__init__()
+        self.name = name
+        self.messages = 0
+        self.bytes = 0
+
+    def send_message(self, action, message):
+        self.send_broadcast(game_core.Broadcast(action, message))
+
+    def send_broadcast(self, broadcast):
+        self.messages += 1
+        self.bytes += len(broadcast.data)
+
+    def force_disconnect(self):
+        pass
+
+
+class Fixture(object):
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.directory = tempfile.mkdtemp()
+        self.managers = []
+
+    def manager(self, name=None):
+        name = name or "history%s.pgn" % (len(self.managers),)
+        manager = game_core.Manager(os.path.join(self.directory, name), task.Clock(), game_core.FsyncPolicy.NEVER)
+        self.managers.append(manager)
+        return manager
+
+    def close(self):
+        for manager in self.managers:
+            manager.close()
+        shutil.rmtree(self.directory)
+
+    def tournament(self, manager, players, games_per_pair=1000):
+        manager.create_tournament("bench", games_per_pair, 1e6, 0)
+        tournament = manager.tournaments["bench"]
+        rtn = []
+        for i in range(players):
+            player = MemoryPlayer("player%s" % (i,))
+            manager.player_connected(player)
+            manager.message_recieved(player, "JOIN", "bench %s" % (player.name,))
+            rtn.append(player)
+        return tournament, rtn
+
+    def add_finished_games(self, tournament, names, count):
+        # built the way load_from_history builds games it read from the history file
+        for _ in range(count):
+            white, black = self.rng.sample(names, 2)
+            game = game_core.Game(tournament, game_core.PlayerSummary(white), game_core.PlayerSummary(black), history_offset=0)
+            game.state = game_core.GameState.FINISHED
+            game.outcomes = self.rng.choice([[1, 0], [0, 1], [0.5, 0.5]])
+            tournament.add_game(game)
+            tournament.record_pairing(game)
+
+    def long_game_moves(self, plies):
+        """Uci moves for a game that mostly shuffles pieces, ending by rule or at plies."""
+        board = chess.Board()
+        repetitions = game_core.RepetitionTable(board)
+        moves = []
+        while len(moves) < plies:
+            legal = list(board.legal_moves)
+            quiet = [m for m in legal if not board.is_zeroing(m)]
+            move = self.rng.choice(quiet if quiet and self.rng.random() < 0.97 else legal)
+            repetitions.push(board, move)
+            moves.append(move.uci())
+            if board.is_game_over() or repetitions.is_threefold_repetition() or board.halfmove_clock >= 100:
+                break
+        return moves
+
+    def started_game(self, manager, tournament, white, black, observers):
+        tournament.start_game(white, black)
+        game = white.current_game
+        for player in [white, black]:
+            manager.message_recieved(player, "ACK", game.id)
+        for i in range(observers):
+            game.add_observer(MemoryPlayer(), i % 2 == 0)
+        return game
+
+    def history_file(self, games, plies):
+        """Writes (once) a history file of games copies of one game, returns its name."""
+        name = os.path.join(self.directory, "load.pgn")
+        if os.path.exists(name):
+            return name
+
+        manager = self.manager()
+        tournament, (white, black) = self.tournament(manager, 2)
+        game = self.started_game(manager, tournament, white, black, 0)
+        for move in self.long_game_moves(plies):
+            if game.state != game_core.GameState.IN_PROGRESS:
+                break
+            game.make_move(game.current_player(), move)
+        if game.state == game_core.GameState.IN_PROGRESS:
+            game.resign(game.current_player())
+
+        template = str(game.pgn) + "\n\n"
+        with open(name, "w") as f:
+            for i in range(games):
+                f.write(template.replace(game.id, "%032x" % (i,)))
+        return name
+
+
+def bench_make_move(fixture):
+    args = fixture.args
+    moves = [fixture.long_game_moves(args.plies) for _ in range(args.games)]
+    manager = fixture.manager()
+    tournament, players = fixture.tournament(manager, 2 * args.games)
+
+    def run():
+        played = 0
+        games = [fixture.started_game(manager, tournament, players[2 * i], players[2 * i + 1], args.observers) for i in range(args.games)]
+        start = time.time()
+        for game, game_moves in zip(games, moves):
+            for move in game_moves:
+                if game.state != game_core.GameState.IN_PROGRESS:
+                    break
+                game.make_move(game.current_player(), move)
+                played += 1
+        return time.time() - start, played
+    return run
+
+
+def bench_send_all(fixture):
+    args = fixture.args
+    manager = fixture.manager()
+    tournament, (white, black) = fixture.tournament(manager, 2)
+    game = fixture.started_game(manager, tournament, white, black, args.observers)
+    message = "%s %s e2-e4 %s %s 300.00 300.00 %s" % (game.id, white.name, white.name, black.name, game.current_fen())
+    delta = ("MOVED", "%s e2e4 300.00 300.00" % (game.id,))
+    calls = 1000
+
+    def run():
+        start = time.time()
+        for _ in range(calls):
+            game.send_all("PLAYER_MOVED", message, delta)
+        return time.time() - start, calls
+    return run
+
+
+def bench_update_pairings(fixture):
+    args = fixture.args
+
+    def run():
+        manager = fixture.manager()
+        tournament, players = fixture.tournament(manager, args.players, args.games_per_pair)
+        fixture.add_finished_games(tournament, [p.name for p in players], args.finished_games)
+        start = time.time()
+        tournament.update_pairings()
+        return time.time() - start, 1
+    return run
+
+
+def bench_get_standings(fixture):
+    args = fixture.args
+    manager = fixture.manager()
+    tournament, players = fixture.tournament(manager, args.players)
+    fixture.add_finished_games(tournament, [p.name for p in players], args.finished_games)
+
+    def run():
+        start = time.time()
+        tournament.get_standings()
+        return time.time() - start, 1
+    return run
+
+
+def bench_load_from_history(fixture, indexed):
+    args = fixture.args
+    history_file = fixture.history_file(args.finished_games, args.plies)
+    index_file = history_file + ".idx"
+    if indexed and not os.path.exists(index_file):
+        fixture.manager(history_file).close()
+
+    def run():
+        if not indexed and os.path.exists(index_file):
+            os.unlink(index_file)
+        # the history is read by the Manager's constructor
+        start = time.time()
+        manager = game_core.Manager(history_file, task.Clock(), game_core.FsyncPolicy.NEVER)
+        elapsed = time.time() - start
+        manager.close()
+        return elapsed, 1
+    return run
+
+
+BENCHMARKS = [
+    ("make_move", bench_make_move),
+    ("send_all", bench_send_all),
+    ("update_pairings", bench_update_pairings),
+    ("get_standings", bench_get_standings),
+    ("load_from_history", lambda fixture: bench_load_from_history(fixture, False)),
+    ("load_from_history_indexed", lambda fixture: bench_load_from_history(fixture, True)),
+]
+
+
+def measure(run, repeat):
+    """Returns seconds per operation for each of repeat runs."""
+    rtn = []
+    for _ in range(repeat):
+        elapsed, operations = run()
+        rtn.append(elapsed / operations)
+    return sorted(rtn)
+
+
+def compare(results, baseline, threshold):
+    """Returns the names of benchmarks whose median is more than threshold slower than baseline."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+        change = result["median"] / before["median"] - 1
+        print("%-26s %+7.1f%% vs baseline" % (name, change * 100))
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game_core hot paths.")
+    parser.add_argument("--players", type=int, default=200, help="Players in the pairing and standings tournaments")
+    parser.add_argument("--finished_games", type=int, default=5000, help="Finished games in those tournaments, and in the history file")
+    parser.add_argument("--games_per_pair", type=int, default=2, help="For update_pairings")
+    parser.add_argument("--observers", type=int, default=1000, help="Observers of each game for make_move and send_all (half in delta mode)")
+    parser.add_argument("--games", type=int, default=4, help="Games played for make_move")
+    parser.add_argument("--plies", type=int, default=300, help="Maximum plies per game")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", type=str, action="append", default=[], help="Run just this benchmark (may be repeated)")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this file as JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=None, help="With --baseline, exit 1 if a median is slower by more than this fraction")
+    args = parser.parse_args()
+
+    fixture = Fixture(args)
+    results = {}
+    try:
+        for name, bench in BENCHMARKS:
+            if args.only and not name in args.only:
+                continue
+            timings = measure(bench(fixture), args.repeat)
+            results[name] = {"median" : timings[len(timings) // 2], "min" : timings[0], "max" : timings[-1]}
+            print("%-26s median %10.1f us  min %10.1f us" % (name, results[name]["median"] * 1e6, results[name]["min"] * 1e6))
+    finally:
+        fixture.close()
+
+    params = dict((k, v) for k, v in vars(args).items() if not k in ["output", "baseline", "threshold", "only"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"params" : params, "results" : results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print("Warning: baseline was run with different parameters")
+        regressions = compare(results, baseline, args.threshold if args.threshold is not None else float("inf"))
+        if regressions and args.threshold is not None:
+            print("Regressed past %0.0f%%: %s" % (args.threshold * 100, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
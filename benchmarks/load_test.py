@@ -0,0 +1,348 @@
+"""
+Load generator for a running chess server. Drives many simulated players and observers
+from one process, over the line and websocket ports, and reports latency percentiles.
+
+Players JOIN, ACK every GAME_PAIRED and answer each YOUR_MOVE with a random legal move
+after a think time. Observers WATCH games the simulated players are in, moving on to
+another game when theirs ends. Measured:
+
+    move_latency       MOVE sent -> the mover's PLAYER_MOVED
+    observer_latency   MOVE sent -> an observer's PLAYER_MOVED (or MOVED)
+    start_delay        GAME_PAIRED -> GAME_STARTED
+    clock_jitter       how far apart successive CLOCK_UPDATEs for a game are from --clock_period
+
+plus moves and messages per second. Each client is a socket, so large runs need a raised
+file descriptor limit (ulimit -n) on both ends.
+
+Usage: python benchmarks/load_test.py localhost 1234 --websocket_port 81 --http_port 80 \
+           --create --players 2000 --observers 2000 --duration 120 [--json results.json]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from twisted.protocols import basic
+from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from autobahn.twisted.websocket import WebSocketClientProtocol, WebSocketClientFactory
+
+import argparse
+import collections
+import json
+import random
+import time
+import urllib
+import urllib2
+
+import chess
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Recorder(object):
+    def __init__(self):
+        # name -> samples in seconds
+        self.samples = collections.defaultdict(list)
+        self.counts = collections.Counter()
+        self.started_at = time.time()
+
+    def sample(self, name, value):
+        self.samples[name].append(value)
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def results(self):
+        elapsed = time.time() - self.started_at
+        rtn = {"elapsed" : elapsed, "counts" : dict(self.counts), "rates" : {}, "latencies" : {}}
+        for name in ["moves", "messages_received", "bytes_received"]:
+            rtn["rates"][name] = self.counts[name] / elapsed
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            rtn["latencies"][name] = {
+                "count" : len(ordered),
+                "p50" : percentile(ordered, 0.50),
+                "p95" : percentile(ordered, 0.95),
+                "p99" : percentile(ordered, 0.99),
+                "max" : ordered[-1],
+            }
+        return rtn
+
+
+def print_results(results):
+    print("%0.1f seconds" % (results["elapsed"],))
+    for name, count in sorted(results["counts"].items()):
+        print("  %-20s %10d" % (name, count))
+    print("throughput")
+    for name, rate in sorted(results["rates"].items()):
+        print("  %-20s %10.1f /s" % (name, rate))
+    print("latency (ms)            count      p50      p95      p99      max")
+    for name, stats in sorted(results["latencies"].items()):
+        print("  %-18s %9d %8.1f %8.1f %8.1f %8.1f" % (name, stats["count"], stats["p50"] * 1000, stats["p95"] * 1000, stats["p99"] * 1000, stats["max"] * 1000))
+
+
+class LoadTest(object):
+    def __init__(self, args):
+        self.args = args
+        self.recorder = Recorder()
+        self.clients = []
+        # games the simulated players are in (for observers to pick from)
+        self.active_games = collections.OrderedDict()
+        # game id -> when a simulated player last sent a MOVE in it
+        self.moves_sent_at = {}
+        self.rng = random.Random(args.seed)
+
+    def think_time(self):
+        return self.rng.uniform(self.args.think_min, self.args.think_max)
+
+    def game_started(self, game_id):
+        self.active_games[game_id] = True
+
+    def game_over(self, game_id):
+        self.active_games.pop(game_id, None)
+        self.moves_sent_at.pop(game_id, None)
+
+    def random_active_game(self):
+        if not self.active_games:
+            return None
+        return self.rng.choice(self.active_games.keys())
+
+    def connect(self, sim, websocket):
+        args = self.args
+        if websocket:
+            factory = SimWebSocketFactory("ws://%s:%s" % (args.host, args.websocket_port), sim)
+            reactor.connectTCP(args.host, args.websocket_port, factory)
+        else:
+            d = connectProtocol(TCP4ClientEndpoint(reactor, args.host, args.port), SimLineConnection(sim))
+            d.addErrback(lambda failure: self.recorder.count("connect_failures"))
+
+    def start(self):
+        args = self.args
+        total = args.players + args.observers
+        delay = args.ramp / float(total) if total else 0
+        for i in range(total):
+            if i < args.players:
+                tournament = "%s%s" % (args.tournament, "-%s" % (i % args.tournaments,) if args.tournaments > 1 else "")
+                sim = SimPlayer(self, tournament, "load%s_%s" % (os.getpid(), i))
+                websocket = self.rng.random() < args.player_websocket_fraction
+            else:
+                sim = SimObserver(self)
+                websocket = self.rng.random() < args.observer_websocket_fraction
+            self.clients.append(sim)
+            reactor.callLater(i * delay, self.connect, sim, websocket)
+        reactor.callLater(args.ramp + args.duration, self.stop)
+
+    def stop(self):
+        results = self.recorder.results()
+        print_results(results)
+        if self.args.json:
+            with open(self.args.json, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        reactor.stop()
+
+
+class SimClient(object):
+    def __init__(self, load_test):
+        self.load_test = load_test
+        self.recorder = load_test.recorder
+        self.connection = None
+        # game id -> arrival time of the last CLOCK_UPDATE
+        self.clock_updates = {}
+
+    def connected(self, connection):
+        self.connection = connection
+        self.recorder.count("connected")
+
+    def disconnected(self):
+        self.connection = None
+        self.recorder.count("disconnected")
+
+    def send(self, action, message):
+        if self.connection:
+            self.connection.send_line("%s %s" % (action, message))
+
+    def line_received(self, line):
+        self.recorder.count("messages_received")
+        self.recorder.count("bytes_received", len(line) + 1)
+        action, _, message = line.strip().partition(" ")
+        parts = [p for p in message.split(" ") if len(p)]
+        now = time.time()
+        if action == "CLOCK_UPDATE" or action == "CLOCK":
+            last = self.clock_updates.get(parts[0])
+            if last is not None:
+                self.recorder.sample("clock_jitter", abs(now - last - self.load_test.args.clock_period))
+            self.clock_updates[parts[0]] = now
+        elif action == "GAME_OVER":
+            self.clock_updates.pop(parts[0], None)
+        self.handle_message(action, parts, now)
+
+
+class SimPlayer(SimClient):
+    def __init__(self, load_test, tournament, name):
+        super(SimPlayer, self).__init__(load_test)
+        self.tournament = tournament
+        self.name = name
+        # game id -> GAME_PAIRED arrival time
+        self.paired_at = {}
+        # game id -> when our MOVE was sent, until the server echoes it
+        self.pending_moves = {}
+
+    def connected(self, connection):
+        super(SimPlayer, self).connected(connection)
+        self.send("JOIN", "%s %s" % (self.tournament, self.name))
+
+    def handle_message(self, action, parts, now):
+        if action == "GAME_PAIRED":
+            self.paired_at[parts[0]] = now
+            self.send("ACK", parts[0])
+        elif action == "GAME_STARTED":
+            paired_at = self.paired_at.pop(parts[0], None)
+            if paired_at is not None:
+                self.recorder.sample("start_delay", now - paired_at)
+            self.load_test.game_started(parts[0])
+        elif action == "YOUR_MOVE":
+            reactor.callLater(self.load_test.think_time(), self.move, parts[0], " ".join(parts[5:]))
+        elif action == "PLAYER_MOVED":
+            sent_at = self.pending_moves.pop(parts[0], None) if parts[1] == self.name else None
+            if sent_at is not None:
+                self.recorder.sample("move_latency", now - sent_at)
+                self.recorder.count("moves")
+        elif action == "GAME_OVER":
+            self.pending_moves.pop(parts[0], None)
+            self.load_test.game_over(parts[0])
+            self.recorder.count("games_finished")
+
+    def move(self, game_id, fen):
+        if self.connection is None:
+            return
+        move = self.load_test.rng.choice(list(chess.Board(fen).legal_moves))
+        now = time.time()
+        self.pending_moves[game_id] = now
+        self.load_test.moves_sent_at[game_id] = now
+        self.send("MOVE", "%s %s" % (game_id, move.uci()))
+
+
+class SimObserver(SimClient):
+    def __init__(self, load_test):
+        super(SimObserver, self).__init__(load_test)
+        self.game_id = None
+
+    def connected(self, connection):
+        super(SimObserver, self).connected(connection)
+        self.watch_another()
+
+    def watch_another(self):
+        if self.connection is None:
+            return
+        self.game_id = self.load_test.random_active_game()
+        if self.game_id is None:
+            reactor.callLater(1.0, self.watch_another)
+            return
+        self.send("WATCH", self.game_id + (" DELTA" if self.load_test.args.observer_delta else ""))
+
+    def handle_message(self, action, parts, now):
+        if action == "PLAYER_MOVED" or action == "MOVED":
+            sent_at = self.load_test.moves_sent_at.get(parts[0])
+            if sent_at is not None:
+                self.recorder.sample("observer_latency", now - sent_at)
+        elif action == "GAME_OVER" and parts[0] == self.game_id:
+            self.watch_another()
+        elif action == "INFO" and self.game_id and " ".join(parts).startswith("No game found"):
+            # the game finished before the WATCH arrived
+            reactor.callLater(0.1, self.watch_another)
+
+
+class SimLineConnection(basic.LineReceiver):
+    delimiter = '\n'
+    MAX_LENGTH = 1024 * 1024
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def connectionMade(self):
+        self.sim.connected(self)
+
+    def connectionLost(self, reason):
+        self.sim.disconnected()
+
+    def lineReceived(self, line):
+        self.sim.line_received(line)
+
+    def send_line(self, line):
+        self.transport.write(line + "\n")
+
+
+class SimWebSocketConnection(WebSocketClientProtocol):
+    def onOpen(self):
+        self.factory.sim.connected(self)
+
+    def onClose(self, wasClean, code, reason):
+        if self.factory.sim.connection is self:
+            self.factory.sim.disconnected()
+
+    def onMessage(self, payload, isBinary):
+        self.factory.sim.line_received(payload)
+
+    def send_line(self, line):
+        self.sendMessage(line, False)
+
+
+class SimWebSocketFactory(WebSocketClientFactory):
+    protocol = SimWebSocketConnection
+
+    def __init__(self, url, sim):
+        WebSocketClientFactory.__init__(self, url)
+        self.sim = sim
+
+    def clientConnectionFailed(self, connector, reason):
+        self.sim.recorder.count("connect_failures")
+
+
+def create_tournaments(args):
+    names = [args.tournament] if args.tournaments == 1 else ["%s-%s" % (args.tournament, i) for i in range(args.tournaments)]
+    for name in names:
+        data = urllib.urlencode({"name" : name, "time_limit" : args.time_limit, "increment" : args.increment, "games_per_pair" : args.games_per_pair})
+        try:
+            urllib2.urlopen("http://%s:%s/tournaments/new" % (args.host, args.http_port), data)
+        except urllib2.HTTPError, e:
+            print("Could not create %s (%s), using it as it is" % (name, e.code))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running chess server.")
+    parser.add_argument("host", type=str, help="Host to connect to")
+    parser.add_argument("port", type=int, help="Line protocol port")
+    parser.add_argument("--websocket_port", type=int, default=81)
+    parser.add_argument("--http_port", type=int, default=80, help="Used with --create")
+    parser.add_argument("--tournament", type=str, default="load", help="Tournament name (or prefix, with --tournaments)")
+    parser.add_argument("--tournaments", type=int, default=1, help="Spread players over this many tournaments")
+    parser.add_argument("--create", action="store_true", help="Create the tournaments over http first")
+    parser.add_argument("--time_limit", type=float, default=300.0, help="For --create")
+    parser.add_argument("--increment", type=float, default=1.0, help="For --create")
+    parser.add_argument("--games_per_pair", type=int, default=1000, help="For --create")
+    parser.add_argument("--players", type=int, default=100)
+    parser.add_argument("--observers", type=int, default=0)
+    parser.add_argument("--player_websocket_fraction", type=float, default=0.0, help="Share of players connecting over websockets")
+    parser.add_argument("--observer_websocket_fraction", type=float, default=1.0, help="Share of observers connecting over websockets")
+    parser.add_argument("--observer_delta", action="store_true", help="Observers use WATCH ... DELTA")
+    parser.add_argument("--think_min", type=float, default=0.1, help="Seconds")
+    parser.add_argument("--think_max", type=float, default=1.0, help="Seconds")
+    parser.add_argument("--ramp", type=float, default=10.0, help="Seconds over which to open the connections")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run after the ramp")
+    parser.add_argument("--clock_period", type=float, default=5.0, help="Seconds the server waits between CLOCK_UPDATEs")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=str, default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.create:
+        create_tournaments(args)
+    LoadTest(args).start()
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
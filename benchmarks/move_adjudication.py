@@ -0,0 +1,141 @@
+"""
+Per-move cost of validating, playing and adjudicating a move, before and after
+Game.apply_move replaced the separate legality, checkmate and draw checks.
+
+"before" is the old make_move sequence: legal_moves membership, push,
+is_checkmate, then is_stalemate, is_insufficient_material, the move stack
+walk for threefold repetition and can_claim_fifty_moves. Both sides also take
+one FEN of the new position: the old make_move computed it for PLAYER_MOVED
+(and again for YOUR_MOVE), apply_move keeps it in Game.fens.
+
+Usage: python benchmarks/move_adjudication.py [--games N] [--plies N]
+"""
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from twisted.internet import task
+
+import argparse
+import collections
+import random
+import shutil
+import tempfile
+import time
+
+import chess
+import game_core
+
+
+def old_is_threefold_repetition(board):
+    transposition_key = board._transposition_key()
+    transpositions = collections.Counter()
+    transpositions.update((transposition_key, ))
+
+    switchyard = collections.deque()
+    while board.move_stack:
+        move = board.pop()
+        switchyard.append(move)
+
+        if board.is_irreversible(move):
+            break
+
+        transpositions.update((board._transposition_key(), ))
+
+    while switchyard:
+        board.push(switchyard.pop())
+
+    return transpositions[transposition_key] >= 3
+
+
+def old_move(board, move):
+    if not move in board.legal_moves:
+        return "Illegal"
+    board.push(move)
+    board.fen()
+    if board.is_checkmate():
+        return "Checkmate"
+    if board.is_stalemate():
+        return "Stalemate"
+    if board.is_insufficient_material():
+        return "Insufficient material"
+    if old_is_threefold_repetition(board):
+        return "Threefold repetition"
+    if board.can_claim_fifty_moves():
+        return "Fifty moves without capture or pawn push"
+    return None
+
+
+def new_game_factory(manager):
+    tournament = game_core.Tournament(manager, "bench", 1, 60, 0)
+    def new_game():
+        return game_core.Game(tournament, game_core.PlayerSummary("white"), game_core.PlayerSummary("black"))
+    return new_game
+
+
+def new_move(game, move):
+    if not game.board.is_legal(move):
+        return "Illegal"
+    return game.apply_move(move)
+
+
+def random_games(new_game, count, plies, seed):
+    """
+    Move lists for games that mostly shuffle pieces (long reversible tails, like the
+    endgames that made the old repetition check slow), ending by rule or at plies.
+    """
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        game = new_game()
+        moves = []
+        while len(moves) < plies:
+            legal = list(game.board.legal_moves)
+            quiet = [m for m in legal if not game.board.is_zeroing(m)]
+            move = rng.choice(quiet if quiet and rng.random() < 0.97 else legal)
+            moves.append(move)
+            if game.apply_move(move):
+                break
+        games.append(moves)
+    return games
+
+
+def time_games(games, setup, play):
+    results = []
+    start = time.time()
+    for moves in games:
+        state = setup()
+        for move in moves:
+            results.append(play(state, move))
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-move adjudication.")
+    parser.add_argument("--games", type=int, default=20, help="Number of games to replay")
+    parser.add_argument("--plies", type=int, default=300, help="Maximum plies per game")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    history_dir = tempfile.mkdtemp()
+    manager = game_core.Manager(os.path.join(history_dir, "history.pgn"), task.Clock())
+    try:
+        new_game = new_game_factory(manager)
+        games = random_games(new_game, args.games, args.plies, args.seed)
+        moves = sum(len(g) for g in games)
+
+        before, before_results = time_games(games, chess.Board, old_move)
+        after, after_results = time_games(games, new_game, new_move)
+        assert before_results == after_results, "old and new adjudication disagree"
+    finally:
+        manager.close()
+        shutil.rmtree(history_dir)
+
+    print("%s games, %s moves" % (len(games), moves))
+    print("before: %8.1f us/move" % (before / moves * 1e6,))
+    print("after:  %8.1f us/move" % (after / moves * 1e6,))
+    print("speedup: %0.1fx" % (before / after,))
+
+
+if __name__ == "__main__":
+    main()
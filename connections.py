@@ -0,0 +1,147 @@
+"""
+Players for connections on a twisted transport, shared by server.py and gateway.py.
+"""
+from twisted.internet.interfaces import IPushProducer
+from autobahn.twisted.websocket import WebSocketServerProtocol
+from zope.interface import implementer
+
+import logging
+import collections
+import time
+
+import game_core
+import metrics
+
+
+log = logging.getLogger("server")
+
+clients_connected = metrics.Gauge("chess_clients_connected", "Open client connections, by transport", ["transport"])
+bytes_sent = metrics.Counter("chess_bytes_sent_total", "Message bytes written to clients (before any websocket framing), by transport", ["transport"])
+messages_coalesced = metrics.Counter("chess_messages_coalesced_total", "Queued CLOCK_UPDATE, GAME_STATE and CLOCK messages replaced by a newer one before being sent")
+queued_bytes = metrics.Gauge("chess_client_queued_bytes", "Message bytes waiting in the queues of clients that are not reading")
+queued_messages = metrics.Gauge("chess_client_queued_messages", "Messages waiting in the queues of clients that are not reading")
+clients_paused = metrics.Gauge("chess_clients_paused", "Client connections paused because the peer is not reading")
+
+
+def publish_queue_stats(players):
+    """
+    Reports the queues of the BufferedPlayers among players() in the gauges above. They are
+    summed when metrics are scraped, so sending a message costs nothing extra.
+    """
+    def total(stat):
+        return lambda: sum(p.queue_stats()[stat] for p in players() if isinstance(p, BufferedPlayer))
+    queued_bytes.set_function(total("queued_bytes"))
+    queued_messages.set_function(total("queued_messages"))
+    clients_paused.set_function(total("paused"))
+
+
+@implementer(IPushProducer)
+class BufferedPlayer(game_core.BasePlayer):
+    """
+    Base for players on a twisted transport. The player registers as its transport's
+    streaming producer, so twisted pauses it when the peer stops reading and the write
+    buffer fills up. While paused, messages wait in the player's own queue, where a newer
+    CLOCK_UPDATE, GAME_STATE or CLOCK for a game replaces any older one still waiting. Observers
+    whose queue stays over max_queued_bytes for slow_consumer_grace seconds are dropped.
+    """
+    max_queued_bytes = 1024 * 1024
+    slow_consumer_grace = 10.0
+    coalesced_actions = ["CLOCK_UPDATE", "GAME_STATE", "CLOCK"]
+
+    def __init__(self, connection):
+        super(BufferedPlayer, self).__init__()
+        self.connection = connection
+        self.paused = False
+        # (action, game id) for coalesced messages, a sequence number for everything else
+        self.queue = collections.OrderedDict()
+        self.queued_bytes = 0
+        self.next_queue_key = 0
+        self.coalesced = 0
+        self.over_limit_since = None
+
+    def write_broadcast(self, broadcast):
+        raise Exception("Not Implemented")
+
+    def send_message(self, action, message):
+        self.send_broadcast(game_core.Broadcast(action, message))
+
+    def send_broadcast(self, broadcast):
+        if not self.paused and not self.queue:
+            self.write_broadcast(broadcast)
+            return
+
+        if broadcast.action in self.coalesced_actions:
+            key = (broadcast.action, broadcast.message.split(" ", 1)[0])
+            # drop the stale one, the new one goes to the back so it stays after earlier moves
+            stale = self.queue.pop(key, None)
+            if stale:
+                self.queued_bytes -= len(stale.data)
+                self.coalesced += 1
+                messages_coalesced.inc()
+        else:
+            key = self.next_queue_key
+            self.next_queue_key += 1
+        self.queue[key] = broadcast
+        self.queued_bytes += len(broadcast.data)
+        self.check_queue_limit()
+
+    def check_queue_limit(self):
+        if self.queued_bytes <= self.max_queued_bytes:
+            self.over_limit_since = None
+            return
+
+        now = time.time()
+        if self.over_limit_since is None:
+            self.over_limit_since = now
+        elif now - self.over_limit_since > self.slow_consumer_grace and self.tournament_name is None:
+            log.warning("Dropping slow observer %s with %s bytes queued", self.connection.transport.getPeer(), self.queued_bytes)
+            self.stopProducing()
+            # loseConnection would wait for the peer to read what is already buffered
+            self.connection.transport.abortConnection()
+
+    def queue_stats(self):
+        return {"queued_messages" : len(self.queue), "queued_bytes" : self.queued_bytes, "coalesced" : self.coalesced, "paused" : self.paused}
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        while self.queue and not self.paused:
+            _, broadcast = self.queue.popitem(last=False)
+            self.queued_bytes -= len(broadcast.data)
+            self.write_broadcast(broadcast)
+        self.check_queue_limit()
+
+    def stopProducing(self):
+        self.paused = True
+        self.queue.clear()
+        self.queued_bytes = 0
+
+
+class LineReceiverPlayer(BufferedPlayer):
+    bytes_counter = bytes_sent.labels("tcp")
+
+    def write_broadcast(self, broadcast):
+        self.bytes_counter.inc(len(broadcast.data))
+        self.connection.transport.write(broadcast.data)
+
+    def force_disconnect(self):
+        self.connection.transport.loseConnection()
+
+class  WebSocketPlayer(BufferedPlayer):
+    bytes_counter = bytes_sent.labels("websocket")
+
+    def write_broadcast(self, broadcast):
+        # framed once per factory, then the same frame goes to every websocket peer
+        if self.connection.state != WebSocketServerProtocol.STATE_OPEN:
+            return
+        self.bytes_counter.inc(len(broadcast.data))
+        factory = self.connection.factory
+        if factory not in broadcast.prepared:
+            broadcast.prepared[factory] = factory.prepareMessage(broadcast.data, False)
+        self.connection.sendPreparedMessage(broadcast.prepared[factory])
+
+    def force_disconnect(self):
+        self.connection.transport.loseConnection()
+        #manager.player_disconnected(self)
@@ -1,12 +1,21 @@
 import chess
 import chess.pgn
+import chess.polyglot
 
+import bisect
+import math
 import random
 import time
 import uuid
 import logging
 import codecs
 import collections
+import json
+import os
+import threading
+import Queue
+
+import metrics
 
 class PlayerState:
     CONNECTING          = 0
@@ -21,42 +30,161 @@ class GameState:
     FINISHED     = 2
     ABORTED      = 3
 
-WAIT_BEFORE_ABORTING = 20
-WAIT_BETWEEN_GAMES = 5
+    ALL = [NEEDS_ACK, IN_PROGRESS, FINISHED, ABORTED]
 
+class FsyncPolicy:
+    ALWAYS      = "always"      # fsync after every batch of games
+    INTERVAL    = "interval"    # fsync at most once every fsync_interval seconds
+    NEVER       = "never"       # leave it to the OS
 
+log = logging.getLogger("game_core")
+observer_log = logging.getLogger("game_core.observers")
 
-def is_threefold_repetition(self):
+WAIT_BEFORE_ABORTING = 20
+WAIT_BETWEEN_GAMES = 5
+
+# game messages that also go to everyone watching the game's tournament
+TOURNAMENT_WATCH_ACTIONS = ["GAME_PAIRED", "GAME_STARTED", "PLAYER_MOVED", "CLOCK_UPDATE", "GAME_OVER", "GAME_ABORTED"]
+# game messages that are also published to the game's and tournament's event feeds
+FEED_ACTIONS = ["GAME_PAIRED", "GAME_STARTED", "PLAYER_MOVED", "GAME_OVER", "GAME_ABORTED"]
+# events an event feed keeps for subscribers resuming after a reconnect
+FEED_SIZE = 1000
+
+# actions counted by name in messages_received, anything else is counted as OTHER
+ACTIONS = ["JOIN", "WATCH", "UNWATCH", "WATCH_TOURNAMENT", "UNWATCH_TOURNAMENT", "DISCONNECT", "ACK", "MOVE", "RESIGN", "SAY"]
+
+messages_received = metrics.Counter("chess_messages_received_total", "Messages received from clients, by action", ["action"])
+moves_played = metrics.Counter("chess_moves_total", "Legal moves played")
+move_seconds = metrics.Histogram("chess_move_seconds", "Time to process a MOVE message, including sending the results")
+games_started = metrics.Counter("chess_games_started_total", "Games started (acked by both players)", ["tournament"])
+games_finished = metrics.Counter("chess_games_finished_total", "Games played to a result", ["tournament"])
+games_aborted = metrics.Counter("chess_games_aborted_total", "Games aborted before they started", ["tournament"])
+observers_watching = metrics.Gauge("chess_observers", "Observers currently watching a game (counted once per game watched)")
+tournament_watchers = metrics.Gauge("chess_tournament_watchers", "Connections currently watching every game of a tournament (counted once per tournament watched)")
+history_write_failures = metrics.Counter("chess_history_write_failures_total", "Finished games that could not be written to history, and are missing from it")
+history_write_errors = metrics.Counter("chess_history_write_errors_total", "Batches of games whose write to history failed (their games are written again with the next batch)")
+history_queue_depth = metrics.Gauge("chess_history_queue_depth", "Finished games waiting for the history writer")
+history_writers_running = metrics.Gauge("chess_history_writers_running", "History writer threads running (0 means finished games are no longer being saved)")
+history_write_seconds = metrics.Histogram("chess_history_write_seconds", "Time to write, flush and (per the fsync policy) fsync one batch of games to history")
+
+
+
+class RepetitionTable(object):
     """
     We want this server to end a game at the point that a 3-fold repetition occurs.
     The actual rules of chess are more complicated (the game is over after 5-fold
     repetition, or when one of the players claims a draw and the next move would make
-    at least a 3-fold rep). This is a monkey patch to add the behavior we want.
+    at least a 3-fold rep). Rather than walking back through the move stack after every
+    move, we keep a running count of the Zobrist hash of every position reached since
+    the last irreversible move.
+    """
+    hasher = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+
+    def __init__(self, board):
+        self.counts = collections.Counter()
+        self.key = self.position_key(board)
+        self.counts[self.key] += 1
+
+    def position_key(self, board):
+        # Same notion of "same position" as chess.Board._transposition_key: an en passant
+        # square only counts if the capture is actually legal, and promoted pieces are
+        # distinct from original ones.
+        h = self.hasher.hash_board(board) ^ self.hasher.hash_castling(board) ^ self.hasher.hash_turn(board)
+        if board.has_legal_en_passant():
+            h ^= self.hasher.array[772 + chess.square_file(board.ep_square)]
+        return h, board.promoted
+
+    def push(self, board, move):
+        if board.is_irreversible(move):
+            self.counts.clear()
+        board.push(move)
+        self.key = self.position_key(board)
+        self.counts[self.key] += 1
+
+    def is_threefold_repetition(self):
+        return self.counts[self.key] >= 3
+
+
+class Broadcast(object):
     """
-    transposition_key = self._transposition_key()
-    transpositions = collections.Counter()
-    transpositions.update((transposition_key, ))
+    A message going out to many connections at once. It is formatted and utf-8 encoded once,
+    and connection types can keep their own ready-to-send forms of it in self.prepared
+    (e.g. a websocket frame per websocket factory), so each extra recipient costs little more
+    than a write.
+    """
+    def __init__(self, action, message):
+        self.action = action
+        self.message = message
+        self.data = BasePlayer.format_message(action, message).encode('utf-8')
+        self.prepared = {}
 
-    # Count positions.
-    switchyard = collections.deque()
-    while self.move_stack:
-        move = self.pop()
-        switchyard.append(move)
 
-        if self.is_irreversible(move):
-            break
+class FeedEvent(object):
+    __slots__ = ["id", "seq", "broadcast", "prepared"]
 
-        transpositions.update((self._transposition_key(), ))
+    def __init__(self, feed_token, seq, broadcast):
+        self.id = "%s-%s" % (feed_token, seq)
+        self.seq = seq
+        self.broadcast = broadcast
+        # subscriber types' ready-to-send forms of the event, as in Broadcast.prepared
+        self.prepared = {}
 
-    while switchyard:
-        self.push(switchyard.pop())
 
-    # Threefold repetition occured.
-    if transpositions[transposition_key] >= 3:
-        return True
-    return False
+class EventFeed(object):
+    """
+    The recent events of a game or tournament, for subscribers that may disconnect and
+    resume from the last event they saw (the HTTP event streams). Subscribers provide
+    send_event(event) and feed_closed(). Event ids start with a token for the feed, so an
+    id from another feed, or from before a restart, is told apart from one of ours.
+    Subscribers that can't resume (new ones, or ones that fell behind the retained events)
+    start from reset_events(): a RESET, then snapshot()'s broadcasts of the current state.
+    """
+    def __init__(self, snapshot=None, size=FEED_SIZE):
+        self.token = uuid.uuid4().hex[:8]
+        self.events = collections.deque(maxlen=size)
+        self.seq = 0
+        self.snapshot = snapshot
+        # used as an insertion ordered set
+        self.subscribers = collections.OrderedDict()
+
+    def publish(self, broadcast):
+        self.seq += 1
+        event = FeedEvent(self.token, self.seq, broadcast)
+        self.events.append(event)
+        for subscriber in self.subscribers.keys():
+            subscriber.send_event(event)
+
+    def since(self, event_id):
+        """
+        Events after event_id, or None if they aren't all retained (or event_id is None or
+        not from this feed), in which case the subscriber should start from reset_events().
+        """
+        token, _, seq = (event_id or "").partition("-")
+        if token != self.token or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self.seq - len(self.events) + 1
+        if not (oldest - 1 <= seq <= self.seq):
+            return None
+        return list(self.events)[seq - oldest + 1:]
+
+    def reset_events(self):
+        # they take the id of the latest event, so a subscriber resumes after it
+        broadcasts = [Broadcast("RESET", "")] + (self.snapshot() if self.snapshot else [])
+        return [FeedEvent(self.token, self.seq, b) for b in broadcasts]
+
+    def subscribe(self, subscriber):
+        self.subscribers[subscriber] = True
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.pop(subscriber, None)
+
+    def close(self):
+        subscribers = self.subscribers.keys()
+        self.subscribers.clear()
+        for subscriber in subscribers:
+            subscriber.feed_closed()
 
-chess.Board.is_threefold_repetition = is_threefold_repetition
 
 #base class for various types of connections to the server
 class BasePlayer(object):
@@ -65,10 +193,14 @@ class BasePlayer(object):
         self.tournament_name = None
         self.state = PlayerState.CONNECTING
         self.current_game = None
-        self.observing_games = []
+        # used as an insertion ordered set
+        self.observing_games = collections.OrderedDict()
+        # likewise, tournaments watched with WATCH_TOURNAMENT
+        self.watching_tournaments = collections.OrderedDict()
         self.last_game_done = time.time() - WAIT_BETWEEN_GAMES
 
-    def format_message(self, action, message):
+    @staticmethod
+    def format_message(action, message):
         if len(message):
             return "%s %s\n" % (action.upper(), message)
         else:
@@ -85,18 +217,348 @@ class BasePlayer(object):
     def send_message(self, action, message):
         raise Exception("Not Implemented")
 
+    # connection types that can send a Broadcast's pre-encoded form should override this
+    def send_broadcast(self, broadcast):
+        self.send_message(broadcast.action, broadcast.message)
+
     def force_disconnect(self):
         raise Exception("Not Implemented")
 
 
+# what a finished game keeps of its players
+class PlayerSummary(object):
+    __slots__ = ["name"]
+
+    def __init__(self, name):
+        self.name = name
+
+
+def modified_time(previous):
+    """
+    The next modified_at for a page last modified at previous: whole seconds, as in the
+    Last-Modified header, and always later than previous, so that a client whose copy is from
+    the same second as a change never takes its copy to be current.
+    """
+    return max(int(math.ceil(time.time())), previous + 1)
+
+
+def index_headers(headers):
+    # headers in the history index are always unicode, whatever type the pgn headers held
+    return dict((k, v.decode("utf-8") if isinstance(v, str) else unicode(v)) for k, v in headers.items())
+
+
+class HistoryWriter(object):
+    """
+    Appends finished games to the history file and its index from a background thread, so
+    serializing and writing pgn never happens on the reactor. Games that finish close together
+    are written as one batch and committed with a single flush (and fsync, per fsync_policy).
+    Under FsyncPolicy.INTERVAL, written games are fsynced within fsync_interval even if no
+    more games follow them, and everything is fsynced on close.
+
+    A batch that fails to write is cut back off the files and its games are written again,
+    ahead of newer ones, after retry_interval. Games still failing after close_retries more
+    tries on close, and games that can't be serialized at all, are lost (counted in
+    games_failed).
+    """
+    retry_interval = 1.0
+    close_retries = 3
+
+    def __init__(self, history_file_name, history_index_name, fsync_policy=FsyncPolicy.ALWAYS, fsync_interval=1.0, max_batch=256):
+        assert fsync_policy in [FsyncPolicy.ALWAYS, FsyncPolicy.INTERVAL, FsyncPolicy.NEVER], "Bad fsync policy %s" % (fsync_policy,)
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self.last_fsync = 0.0
+        # written and flushed, but not yet fsynced
+        self.dirty = False
+
+        self.history_file = open(history_file_name, "a")
+        self.history_file.seek(0, 2)
+        self.history_index = open(history_index_name, "a")
+
+        self.games_written = 0
+        self.games_failed = 0
+        self.batches_written = 0
+        self.batches_failed = 0
+        self.last_batch_size = 0
+        # games now readable from the history file, drained by the manager on the reactor thread
+        self.written = collections.deque()
+
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="history-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def save_game(self, game):
+        # game.pgn is handed over directly: it is complete, and the writer must not trigger a lazy load
+        self.queue.put((game, game.pgn))
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {"running" : self.thread.is_alive(), "queue_depth" : self.queue_depth(), "games_written" : self.games_written, "games_failed" : self.games_failed, "batches_written" : self.batches_written, "batches_failed" : self.batches_failed, "last_batch_size" : self.last_batch_size}
+
+    def close(self):
+        # write out whatever is still queued, then stop the thread
+        self.queue.put(None)
+        self.thread.join()
+
+    def next_fsync_wait(self):
+        """Seconds to wait for more games before a pending interval fsync is due, None for no limit."""
+        if not self.dirty or self.fsync_policy != FsyncPolicy.INTERVAL:
+            return None
+        return max(self.last_fsync + self.fsync_interval - time.time(), 0)
+
+    def run(self):
+        history_writers_running.inc()
+        try:
+            # games of a failed batch, to be written again
+            retry = []
+            closing = False
+            # tries left, once closing, for games that still fail
+            close_tries = self.close_retries
+            while not closing or retry:
+                if closing:
+                    time.sleep(self.retry_interval)
+                    batch = []
+                else:
+                    waits = [w for w in [self.next_fsync_wait(), self.retry_interval if retry else None] if w is not None]
+                    try:
+                        batch = [self.queue.get(timeout=min(waits) if waits else None)]
+                    except Queue.Empty:
+                        batch = []
+                    while batch and len(retry) + len(batch) < self.max_batch:
+                        try:
+                            batch.append(self.queue.get_nowait())
+                        except Queue.Empty:
+                            break
+
+                games = retry + [item for item in batch if item is not None]
+                closing = closing or None in batch
+                retry = []
+                if games:
+                    try:
+                        self.write_batch(games)
+                    except Exception:
+                        self.batches_failed += 1
+                        history_write_errors.inc()
+                        if closing and close_tries == 0:
+                            log.exception("Failed to write %s games to history, they are lost", len(games))
+                            self.games_failed += len(games)
+                            history_write_failures.inc(len(games))
+                        else:
+                            # the games stay in memory, unwritten, until a retry succeeds
+                            log.exception("Failed to write %s games to history, retrying", len(games))
+                            retry = games
+                            if closing:
+                                close_tries -= 1
+
+                try:
+                    if closing and not retry and self.fsync_policy != FsyncPolicy.NEVER:
+                        self.fsync()
+                    elif self.next_fsync_wait() == 0:
+                        self.fsync()
+                except Exception:
+                    log.exception("Failed to fsync history")
+        except Exception:
+            log.exception("History writer stopped, finished games will not be saved")
+        finally:
+            history_writers_running.dec()
+
+    def fsync(self):
+        try:
+            os.fsync(self.history_file.fileno())
+            os.fsync(self.history_index.fileno())
+            self.dirty = False
+        finally:
+            # a failed fsync is tried again after fsync_interval, not on every wakeup
+            self.last_fsync = time.time()
+
+    def truncate(self, history_size, index_size):
+        """Cuts both files back to the given sizes, dropping a partly written batch."""
+        for f, size in [(self.history_file, history_size), (self.history_index, index_size)]:
+            try:
+                f.truncate(size)
+                f.seek(0, 2)
+            except Exception:
+                log.exception("Failed to truncate %s after a failed write", f.name)
+
+    def write_batch(self, games):
+        started = time.time()
+        # serialized up front, so a game that can't be serialized is dropped alone
+        entries = []
+        for game, pgn in games:
+            try:
+                entries.append((game, str(pgn) + "\n\n", json.dumps(index_headers(pgn.headers))))
+            except Exception:
+                log.exception("Failed to serialize game %s for history", game.id)
+                self.games_failed += 1
+                history_write_failures.inc()
+        if not entries:
+            return
+
+        offsets = []
+        history_size, index_size = self.history_file.tell(), self.history_index.tell()
+        try:
+            for game, text, headers in entries:
+                offset = self.history_file.tell()
+                self.history_file.write(text)
+                end = self.history_file.tell()
+                self.history_index.write('{"offset": %d, "end": %d, "headers": %s}\n' % (offset, end, headers))
+                offsets.append((offset, end))
+
+            self.history_file.flush()
+            self.history_index.flush()
+        except Exception:
+            # so the retry doesn't follow half a batch
+            self.truncate(history_size, index_size)
+            raise
+        self.dirty = True
+        if self.fsync_policy == FsyncPolicy.ALWAYS or self.next_fsync_wait() == 0:
+            try:
+                self.fsync()
+            except Exception:
+                # the games are written, writing them again would duplicate them
+                log.exception("Failed to fsync history")
+        history_write_seconds.observe(time.time() - started)
+
+        # only now can the game be read back from the file
+        for (game, _, _), (offset, end) in zip(entries, offsets):
+            game.history_end = end
+            game.history_offset = offset
+            self.written.append(game)
+
+        self.games_written += len(entries)
+        self.batches_written += 1
+        self.last_batch_size = len(entries)
+
+
+class HistoryCache(object):
+    """
+    Bounded LRU cache of the pgn and board of finished games, parsed back out of the history
+    file on demand. Finished games don't hold on to these themselves.
+    """
+    def __init__(self, manager, size):
+        assert size > 0, "History cache size must be positive"
+        self.manager = manager
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, game):
+        entry = self.entries.pop(game.id, None)
+        if entry is None:
+            self.misses += 1
+            entry = self.load(game)
+            if len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+        self.entries[game.id] = entry
+        return entry
+
+    def load(self, game):
+        pgn = self.manager.read_history_game(game.history_offset)
+        board = pgn.board()
+        for move in pgn.main_line():
+            board.push(move)
+        return pgn, board
+
+    def stats(self):
+        return {"size" : len(self.entries), "hits" : self.hits, "misses" : self.misses}
+
+
 class Manager(object):
-    def __init__(self, history_file_name):
+    # clock is anything providing callLater and seconds (the twisted reactor, or a task.Clock).
+    # It runs the game timers, and game clocks and ack deadlines are measured on it.
+    # game_id_node is the uuid1 node used for game ids (see sharding.py), None for the host's
+    def __init__(self, history_file_name, clock, fsync_policy=FsyncPolicy.ALWAYS, fsync_interval=1.0, history_cache_size=256, game_id_node=None):
+        self.clock = clock
+        self.game_id_node = game_id_node
         self.tournaments = {}
+        # game id -> game, across all tournaments
+        self.games = {}
+        # every open connection, used as an insertion ordered set
+        self.connected_players = collections.OrderedDict()
+        self.history_file_name = history_file_name
+        self.history_index_name = history_file_name + ".idx"
+        self.history_cache = HistoryCache(self, history_cache_size)
+        # bumped whenever the tournament list page would change (see Tournament.modified)
+        self.version = 0
+        self.modified_at = modified_time(0)
         self.load_from_history(history_file_name)
-        self.history_file = open(history_file_name, "a")
+        self.history_writer = HistoryWriter(history_file_name, self.history_index_name, fsync_policy, fsync_interval)
+        history_queue_depth.set_function(self.history_writer.queue_depth)
 
     def save_game(self, game):
-        self.history_file.write((str(game.pgn)+"\n\n"))
+        self.history_writer.save_game(game)
+
+    def close(self):
+        self.history_writer.close()
+
+    def demote_finished_games(self):
+        # games stay whole until the writer has them on disk, then keep only a summary
+        while self.history_writer.written:
+            self.history_writer.written.popleft().demote()
+
+    def read_history_index(self, inputfile):
+        """
+        Returns one {offset, end, headers} entry per game in the history file. Entries come
+        from the sidecar index when it is present; any games appended to the history file
+        since the index was last written are found by scanning their headers (not their moves)
+        and added to the index.
+        """
+        rebuild = False
+        try:
+            with open(self.history_index_name, "r") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except IOError:
+            entries = []
+        except ValueError:
+            # partially written index, start over
+            entries, rebuild = [], True
+
+        inputfile.seek(0, 2)
+        size = inputfile.tell()
+        indexed_to = entries[-1]["end"] if entries else 0
+        if indexed_to > size or not self.index_matches(inputfile, entries):
+            # history file was truncated or replaced under the index
+            log.warning("History index %s does not match %s, rebuilding it", self.history_index_name, self.history_file_name)
+            entries, indexed_to, rebuild = [], 0, True
+
+        inputfile.seek(indexed_to)
+        scanned = [{"offset" : offset, "headers" : index_headers(headers)} for offset, headers in chess.pgn.scan_headers(inputfile)]
+        for i, entry in enumerate(scanned):
+            entry["end"] = scanned[i + 1]["offset"] if i + 1 < len(scanned) else size
+
+        if rebuild or scanned:
+            with open(self.history_index_name, "w" if rebuild else "a") as f:
+                for entry in (entries + scanned if rebuild else scanned):
+                    f.write(json.dumps(entry) + "\n")
+
+        return entries + scanned
+
+    def index_matches(self, inputfile, entries):
+        """Whether the first and last indexed games are still where the index says they are."""
+        for entry in entries[:1] + entries[-1:]:
+            inputfile.seek(entry["offset"])
+            for offset, headers in chess.pgn.scan_headers(inputfile):
+                if offset != entry["offset"] or index_headers(headers).get("GameID") != entry["headers"].get("GameID"):
+                    return False
+                break
+            else:
+                return False
+        return True
+
+    def read_history_game(self, offset):
+        with open(self.history_file_name, "r") as inputfile:
+            inputfile.seek(offset)
+            pgn = chess.pgn.read_game(inputfile)
+        for h in ['Site', 'Round']:
+            del pgn.headers[h]
+        return pgn
 
     def load_from_history(self, history_file):
         try:
@@ -104,39 +566,36 @@ class Manager(object):
         except IOError:
             return
 
-        pgn = chess.pgn.read_game(inputfile)
-        while pgn:
-            for h in ['Site', 'Round']:
-                del pgn.headers[h]
+        with inputfile:
+            entries = self.read_history_index(inputfile)
 
-            tournament_name = pgn.headers['Event'].decode("utf-8")
+        # Only headers are needed to rebuild tournaments and standings. Moves are parsed
+        # when something asks for a game's board or pgn.
+        for entry in entries:
+            headers = entry["headers"]
+
+            tournament_name = headers['Event']
             if not tournament_name in self.tournaments:
-                games_per_pair = int(pgn.headers['GamesPerPair'])
-                time_limit, increment = pgn.headers['TimeControl'].split("+")
+                games_per_pair = int(headers['GamesPerPair'])
+                time_limit, increment = headers['TimeControl'].split("+")
                 time_limit = float(time_limit)
                 increment = float(increment)
                 self.create_tournament(tournament_name, games_per_pair, time_limit, increment)
             tournament = self.tournaments[tournament_name]
 
-            wp, bp = BasePlayer(), BasePlayer()
-            wp.name = pgn.headers['White'].decode("utf-8")
-            bp.name = pgn.headers['Black'].decode("utf-8")
-            game = Game(tournament, wp, bp)
-            game.board = pgn.board()
-            for move in pgn.main_line():
-                game.board.push(move)
-
-            game.id = pgn.headers['GameID']
-            game.pgn = pgn
+            wp, bp = PlayerSummary(headers['White']), PlayerSummary(headers['Black'])
+            game = Game(tournament, wp, bp, history_offset=entry["offset"])
+            game.history_end = entry["end"]
 
-            game.created_at = float(pgn.headers['Date'])
-            game.status = pgn.headers['Termination']
+            # ids and statuses are byte strings on live games, and pages built from them rely on it
+            game.id = headers['GameID'].encode("utf-8")
+            game.created_at = float(headers['Date'])
+            game.status = headers['Termination'].encode("utf-8")
             game.state = GameState.FINISHED
-            game.outcomes = [0.5 if v == "1/2" else float(v) for v in pgn.headers['Result'].split("-")]
-            tournament.created_at = float(pgn.headers['EventDate'])
-            tournament.games[game.id] = game
-
-            pgn = chess.pgn.read_game(inputfile)
+            game.outcomes = [0.5 if v == "1/2" else float(v) for v in headers['Result'].split("-")]
+            tournament.created_at = float(headers['EventDate'])
+            tournament.add_game(game)
+            tournament.record_pairing(game)
 
 
     def create_tournament(self, tournament_name, games_per_pair, time_limit, increment):
@@ -145,43 +604,63 @@ class Manager(object):
         assert not " " in tournament_name, "Bad tournament name"
         assert not tournament_name in self.tournaments, "Tournament of name %s already exists" % (tournament_name,)
         self.tournaments[tournament_name] = Tournament(self, tournament_name, games_per_pair, time_limit, increment)
+        self.modified()
+
+    def modified(self):
+        self.version += 1
+        self.modified_at = modified_time(self.modified_at)
 
 
     def player_connected(self, player):
         player.state = PlayerState.CONNECTING
+        self.connected_players[player] = True
 
     def player_disconnected(self, player):
+        self.connected_players.pop(player, None)
         if player.tournament_name in self.tournaments:
             tournament = self.tournaments[player.tournament_name]
             tournament.remove_player(player)
 
-        for game in player.observing_games[:]:
+        for game in player.observing_games.keys():
             game.remove_observer(player)
+        for tournament in player.watching_tournaments.keys():
+            tournament.remove_watcher(player)
 
     def game_for_id(self, game_id):
-        for t in self.tournaments.values():
-            g = t.game_for_id(game_id)
-            if g:
-                return g
-        return False
+        return self.games.get(game_id, False)
 
     def message_recieved(self, player, action, message):
+        messages_received.labels(action if action in ACTIONS else "OTHER").inc()
         parts = [s for s in message.split(" ") if len(s)]
         if action == "DISCONNECT":
             player.force_disconnect()
             return
         elif action == "WATCH" or action == "UNWATCH":
-            assert len(parts) == 1, "Bad game id"
+            delta = action == "WATCH" and len(parts) == 2 and parts[1].upper() == "DELTA"
+            assert len(parts) == 1 or delta, "Bad game id"
             game = self.game_for_id(parts[0])
             assert game, "No game found with id %s" % (parts[0],)
             if action == "WATCH":
-                game.add_observer(player)
+                game.add_observer(player, delta)
             else:
                 game.remove_observer(player)
             return
+        elif action == "WATCH_TOURNAMENT" or action == "UNWATCH_TOURNAMENT":
+            delta = action == "WATCH_TOURNAMENT" and len(parts) == 2 and parts[1].upper() == "DELTA"
+            assert len(parts) == 1 or delta, "Bad tournament name"
+            tournament = self.tournaments.get(parts[0])
+            assert tournament, "Tournament %s not found" % (parts[0],)
+            if action == "WATCH_TOURNAMENT":
+                # a player would get its own games' messages twice
+                assert player.state == PlayerState.CONNECTING, "Players can't watch a tournament"
+                tournament.add_watcher(player, delta)
+            else:
+                tournament.remove_watcher(player)
+            return
 
         if player.state == PlayerState.CONNECTING:
             assert action == "JOIN", "First message must be a JOIN or WATCH"
+            assert not player.watching_tournaments, "Tournament watchers can't join a tournament"
             assert len(parts) == 2, "Bad name or tournament"
             assert len(parts[1]) < 50, "Player name too long"
 
@@ -201,10 +680,6 @@ class Manager(object):
         for t in self.tournaments.values():
             t.update_pairings()
 
-    def check_timeouts(self):
-        for t in self.tournaments.values():
-            t.check_timeouts()
-
     def send_clock_updates(self):
         for t in self.tournaments.values():
             t.send_clock_updates()
@@ -219,7 +694,28 @@ class Tournament(object):
         self.increment = increment
         self.players = {}
         self.games = {}
+        # the same games, partitioned by GameState (game id -> game)
+        self.games_by_state = dict((s, collections.OrderedDict()) for s in GameState.ALL)
+        # and their (created_at, id) keys, sorted, for paging through them by age
+        self.game_keys_by_state = dict((s, []) for s in GameState.ALL)
+        # (white name, black name) -> number of finished games between them
+        self.pairing_counts = collections.Counter()
+        # player name -> {played, score}, over finished games
+        self.scores = {}
+        # connection -> whether it watches in delta mode, for everyone watching all of the
+        # tournament's games (WATCH_TOURNAMENT), in the order they started watching
+        self.watchers = collections.OrderedDict()
+        self.feed = EventFeed(self.feed_snapshot)
         self.created_at = time.time()
+        # bumped whenever the tournament's page would change: players joining or leaving,
+        # games starting or ending (moves don't show on it)
+        self.version = 0
+        self.modified_at = modified_time(0)
+
+    def modified(self):
+        self.version += 1
+        self.modified_at = modified_time(self.modified_at)
+        self.manager.modified()
 
     def message_recieved(self, player, action, message):
         parts = message.strip().split(" ")
@@ -230,11 +726,12 @@ class Tournament(object):
             if not recipient in self.players:
                 player.send_message("INFO", "Player %s not in tournament" % (recipient,))
             else:
+                said = Broadcast("SAID", player.name + " " + " ".join(parts[1:]))
                 for p in [player, self.players[recipient]]:
-                    p.send_message("SAID", player.name + " " + " ".join(parts[1:]))
+                    p.send_broadcast(said)
                 if self.players[recipient].current_game:
                     for p in self.players[recipient].current_game.observers:
-                        p.send_message("SAID", player.name + " " + " ".join(parts[1:]))
+                        p.send_broadcast(said)
 
             return
 
@@ -251,38 +748,63 @@ class Tournament(object):
 
         player.current_game.message_recieved(player, action, message)
 
+    # watchers get a GAME_STATE for each game in progress, then the messages of every game
+    # (see TOURNAMENT_WATCH_ACTIONS) as its observers would
+    def add_watcher(self, watcher, delta=False):
+        observer_log.debug("Adding watcher to tournament %s", self.name)
+        for game in self.games_by_state[GameState.IN_PROGRESS].values():
+            watcher.send_message("GAME_STATE", game.game_state_str())
+        if not watcher in self.watchers:
+            tournament_watchers.inc()
+        self.watchers[watcher] = delta
+        watcher.watching_tournaments[self] = True
+
+    def remove_watcher(self, watcher):
+        observer_log.debug("Removing watcher from tournament %s", self.name)
+        if self.watchers.pop(watcher, None) is not None:
+            tournament_watchers.dec()
+        watcher.watching_tournaments.pop(self, None)
+
+    def send_watchers(self, game, broadcast, delta_broadcast):
+        for w, wants_delta in self.watchers.iteritems():
+            # observers and players of the game already have it
+            if not (w in game.observers or w in game.players):
+                w.send_broadcast(delta_broadcast if wants_delta else broadcast)
+
+    def send_all_players(self, action, message):
+        broadcast = Broadcast(action, message)
+        for p in self.players.values():
+            p.send_broadcast(broadcast)
+
     def add_player(self, player):
         assert not player.name in self.players, "Player with name %s already in tournament" % (player.name,)
 
         m = "Player %s joined tournament (%s active players)" % (player.name, len(self.players) + 1)
-        logging.info(m)
-        for p in self.players.values():
-            p.send_message("INFO", m)
+        log.info(m)
+        self.send_all_players("INFO", m)
 
         player.tournament_name = self.name
         self.players[player.name] = player
+        self.modified()
 
 
     def remove_player(self, player):
         if player.name in self.players:
             del self.players[player.name]
+            self.modified()
 
         m = "Player %s left tournament (%s active players)" % (player.name, len(self.players))
-        logging.info(m)
-        for p in self.players.values():
-            p.send_message("INFO", m)
+        log.info(m)
+        self.send_all_players("INFO", m)
 
         if player.current_game:
             player.current_game.player_disconnected(player)
 
-    def check_timeouts(self):
-        for game in self.games.values():
-            if game.state in [GameState.NEEDS_ACK, GameState.IN_PROGRESS]:
-                game.check_timeout()
+    def record_pairing(self, game):
+        self.pairing_counts[(game.players[0].name, game.players[1].name)] += 1
 
     def get_pairing_count(self, player1, player2):
-        finished = [g for g in self.games.values() if g.state == GameState.FINISHED]
-        return len([g for g in finished if g.players[0].name == player1.name and g.players[1].name == player2.name])
+        return self.pairing_counts[(player1.name, player2.name)]
 
     def update_pairings(self):
         free_players = [p for p in self.players.values() if p.state == PlayerState.WAITING_PAIRING and time.time() - p.last_game_done > WAIT_BETWEEN_GAMES]
@@ -302,52 +824,102 @@ class Tournament(object):
                         self.start_game(p2, p1)
 
     def send_clock_updates(self):
-        for game in self.games.values():
-            if game.state  == GameState.IN_PROGRESS:
-                game.send_clock_updates()
+        for game in self.games_by_state[GameState.IN_PROGRESS].values():
+            game.send_clock_updates()
 
     def start_game(self, white_player, black_player):
         game = Game(self, white_player, black_player)
-        self.games[game.id] = game
+        self.add_game(game)
         white_player.current_game = game
         black_player.current_game = game
         white_player.state = PlayerState.IN_GAME_NEEDS_ACK
         black_player.state = PlayerState.IN_GAME_NEEDS_ACK
         game.send_game_paired_message()
-        logging.info("Starting game between %s and %s with id %s" % (white_player.name, black_player.name, game.id))
+        game.schedule_timeout()
+        log.info("Starting game between %s and %s with id %s", white_player.name, black_player.name, game.id)
 
     def get_standings(self):
         standings = {}
         for p in self.players:
             standings[p] = {"played" : 0, "score" : 0}
-
-        for game in self.games.values():
-            if game.state == GameState.FINISHED:
-                for i,p in enumerate(game.players):
-                    standings[p.name] = standings.get(p.name, {"played" : 0, "score" : 0})
-                    standings[p.name]["played"] += 1
-                    standings[p.name]["score"] += game.outcomes[i]
-
+        for name, score in self.scores.iteritems():
+            standings[name] = dict(score)
         return standings
 
+    def record_result(self, game):
+        for i, p in enumerate(game.players):
+            score = self.scores.setdefault(p.name, {"played" : 0, "score" : 0})
+            score["played"] += 1
+            score["score"] += game.outcomes[i]
+
+    def standings_changed(self, game):
+        # the new standings of the game's players, as name played score pairs
+        message = " ".join("%s %s %s" % (p.name, self.scores[p.name]["played"], self.scores[p.name]["score"]) for p in game.players)
+        self.feed.publish(Broadcast("STANDINGS", message))
+
+    # the tournament's feed's current state: everyone's standings, then each game in progress
+    def feed_snapshot(self):
+        standings = sorted(self.get_standings().iteritems())
+        broadcasts = [Broadcast("STANDINGS", " ".join("%s %s %s" % (p, s["played"], s["score"]) for p, s in standings))]
+        for game in self.games_by_state[GameState.IN_PROGRESS].values():
+            broadcasts.append(Broadcast("GAME_STATE", game.game_state_str()))
+        return broadcasts
+
     def game_for_id(self, game_id):
         if game_id in self.games:
             return self.games[game_id]
         return None
 
+    def add_game(self, game):
+        self.games[game.id] = game
+        self.manager.games[game.id] = game
+        self.games_by_state[game.state][game.id] = game
+        bisect.insort(self.game_keys_by_state[game.state], (game.created_at, game.id))
+        if game.state == GameState.FINISHED:
+            self.record_result(game)
+        self.modified()
+
+    def game_state_changed(self, game, old_state):
+        del self.games_by_state[old_state][game.id]
+        self.games_by_state[game.state][game.id] = game
+        key = (game.created_at, game.id)
+        old_keys = self.game_keys_by_state[old_state]
+        del old_keys[bisect.bisect_left(old_keys, key)]
+        bisect.insort(self.game_keys_by_state[game.state], key)
+        if game.state == GameState.FINISHED and old_state != GameState.FINISHED:
+            self.record_result(game)
+        self.modified()
+
+    def games_before(self, state, before=None, limit=50):
+        """
+        Up to limit games in state, newest first, starting with the newest created before
+        the (created_at, id) key before (or the newest of all when it is None).
+        """
+        keys = self.game_keys_by_state[state]
+        end = len(keys) if before is None else bisect.bisect_left(keys, before)
+        return [self.games[game_id] for _, game_id in reversed(keys[max(0, end - limit):end])]
+
+    def game_count(self, *states):
+        return sum(len(self.games_by_state[s]) for s in states)
+
     def compleated_games(self):
-        return [g for g in self.games.values() if g.state == GameState.FINISHED]
+        return self.games_by_state[GameState.FINISHED].values()
 
     def active_games(self):
-        return [g for g in self.games.values() if g.state == GameState.IN_PROGRESS]
+        return self.games_by_state[GameState.IN_PROGRESS].values()
 
     def all_games(self):
         return self.compleated_games() + self.active_games()
 
+    def all_games_count(self):
+        return self.game_count(GameState.FINISHED, GameState.IN_PROGRESS)
+
 
 
 class Game(object):
-    def __init__(self, tournament, white_player, black_player):
+    # Games read from the history file pass their offset in it. Their board and pgn are
+    # loaded from there (through the manager's history cache) whenever asked for.
+    def __init__(self, tournament, white_player, black_player, history_offset=None):
         self.tournament = tournament
         self.time_limit = tournament.time_limit
         self.increment = tournament.increment
@@ -359,13 +931,37 @@ class Game(object):
         self.cur_move_started_at = 0.0
         self.cur_index = 0
 
-        self.id = uuid.uuid1().hex
+        self.id = uuid.uuid1(tournament.manager.game_id_node).hex
 
         self.state = GameState.NEEDS_ACK
         self.created_at = time.time()
+        # on the manager's clock, for the ack deadline
+        self.paired_at = self.now()
+
+        self.timeout_call = None
+
+        # observer -> whether it watches in delta mode, in the order they started watching
+        self.observers = collections.OrderedDict()
+
+        self.history_offset = history_offset
+        # where the game's pgn ends in the history file, once it is there
+        self.history_end = None
+        self._board = None
+        self._pgn = None
+        self.pgn_node = None
+        self.repetitions = None
+        # fen after each ply, fens[0] being the starting position (only kept while the game is live)
+        self.fens = None
+        # events for the game's HTTP event streams, from pairing until the game ends
+        self.feed = None
+        if history_offset is not None:
+            return
+
+        self.feed = EventFeed(self.feed_snapshot)
 
         self.board = chess.Board()
-        self.observers = []
+        self.repetitions = RepetitionTable(self.board)
+        self.fens = [self.board.fen()]
 
         self.pgn = chess.pgn.Game()
         self.pgn.setup(self.board)
@@ -382,25 +978,95 @@ class Game(object):
 
         self.pgn_node = self.pgn
 
-
+    @property
+    def board(self):
+        if self._board is None:
+            return self.tournament.manager.history_cache.get(self)[1]
+        return self._board
+
+    @board.setter
+    def board(self, board):
+        self._board = board
+
+    @property
+    def pgn(self):
+        if self._pgn is None:
+            return self.tournament.manager.history_cache.get(self)[0]
+        return self._pgn
+
+    @pgn.setter
+    def pgn(self, pgn):
+        self._pgn = pgn
+
+    def pgn_text(self, history_file):
+        """
+        The game's pgn as it is (or will be) written to the history file. Demoted games are
+        copied out of history_file, the open history file, without being parsed.
+        """
+        if self._pgn is None and self.history_end is not None:
+            history_file.seek(self.history_offset)
+            return history_file.read(self.history_end - self.history_offset)
+        return str(self.pgn) + "\n\n"
+
+    def demote(self):
+        """
+        Called once a finished game is in the history file. Drops the board, pgn, and
+        connected players, keeping only what the standings and game lists need.
+        """
+        self._board = None
+        self._pgn = None
+        self.pgn_node = None
+        self.repetitions = None
+        self.fens = None
+        self.players = [PlayerSummary(p.name) for p in self.players]
+        for observer in self.observers:
+            observer.observing_games.pop(self, None)
+        observers_watching.dec(len(self.observers))
+        self.observers.clear()
 
     def other_player(self, player):
         if player == self.players[0]:
             return self.players[1]
         return self.players[0]
 
+    def set_state(self, state):
+        old_state, self.state = self.state, state
+        if self.id in self.tournament.games:
+            self.tournament.game_state_changed(self, old_state)
+
     def current_player(self):
         return self.players[self.cur_index]
 
     def next_player(self):
         return self.players[(self.cur_index + 1)%2]
 
-    def send_all(self, action, message):
+    # delta is the (action, message) sent instead to observers watching in delta mode
+    def send_all(self, action, message, delta=None):
+        broadcast = Broadcast(action, message)
+        delta_broadcast = Broadcast(*delta) if delta else broadcast
         for p in self.players:
-            p.send_message(action, message)
+            p.send_broadcast(broadcast)
 
-        for o in self.observers:
-            o.send_message(action, message)
+        for o, wants_delta in self.observers.iteritems():
+            o.send_broadcast(delta_broadcast if wants_delta else broadcast)
+
+        if action in TOURNAMENT_WATCH_ACTIONS and self.tournament.watchers:
+            self.tournament.send_watchers(self, broadcast, delta_broadcast)
+
+        if action in FEED_ACTIONS:
+            if self.feed:
+                self.feed.publish(broadcast)
+            self.tournament.feed.publish(broadcast)
+
+    def feed_snapshot(self):
+        if self.state == GameState.NEEDS_ACK:
+            return [Broadcast("GAME_PAIRED", self.game_paired_str())]
+        return [Broadcast("GAME_STATE", self.game_state_str())]
+
+    def close_feed(self):
+        if self.feed:
+            self.feed.close()
+            self.feed = None
 
     def message_recieved(self, player, action, message):
         if player.state == PlayerState.IN_GAME_NEEDS_ACK:
@@ -415,15 +1081,43 @@ class Game(object):
             elif action == "MOVE":
                 assert " " in message
                 _, move = message.split(" ", 1)
+                started = time.time()
                 self.make_move(player, move.strip())
+                move_seconds.observe(time.time() - started)
             else:
                 player.send_message("INFO", "ignoring message type %s." % (action))
 
+    # Rather than polling every game, each live game keeps a single timer armed for
+    # its next deadline: the ack deadline, or the current player's flag.
+    def schedule_timeout(self):
+        self.cancel_timeout()
+        if self.state == GameState.NEEDS_ACK:
+            deadline = self.paired_at + WAIT_BEFORE_ABORTING
+        elif self.state == GameState.IN_PROGRESS:
+            deadline = self.cur_move_started_at + self.times[self.cur_index]
+        else:
+            return
+        self.timeout_call = self.tournament.manager.clock.callLater(max(deadline - self.now(), 0), self.timeout_expired)
+
+    def now(self):
+        return self.tournament.manager.clock.seconds()
+
+    def cancel_timeout(self):
+        if self.timeout_call and self.timeout_call.active():
+            self.timeout_call.cancel()
+        self.timeout_call = None
+
+    def timeout_expired(self):
+        self.timeout_call = None
+        if self.check_timeout():
+            # timer fired a hair before the deadline, wait for the rest of it
+            self.schedule_timeout()
+
     def check_timeout(self):
         if self.state == GameState.NEEDS_ACK:
-            if time.time() - self.created_at > WAIT_BEFORE_ABORTING:
+            if self.now() - self.paired_at > WAIT_BEFORE_ABORTING:
                 to_remove = [p for p in self.players if p.state != PlayerState.IN_GAME_ACKED]
-                logging.info("Game %s timed out before ack. Aborting..." % self.id)
+                log.info("Game %s timed out before ack. Aborting...", self.id)
                 self.abort("Not acked by both players within time limit")
 
                 for p in to_remove:
@@ -432,11 +1126,11 @@ class Game(object):
 
                 return False
         elif self.state == GameState.IN_PROGRESS:
-            thinking_time = time.time() - self.cur_move_started_at
+            thinking_time = self.now() - self.cur_move_started_at
             if self.times[self.cur_index] <= thinking_time:
                 # thinking player is out of time!
                 self.times = self.updated_times()
-                self.cur_move_started_at = time.time()
+                self.cur_move_started_at = self.now()
                 self.send_clock_updates()
 
                 self.outcomes[self.cur_index] = 0
@@ -451,20 +1145,29 @@ class Game(object):
             return ""
         return "Game over: %s-%s %s" % (self.outcomes[0], self.outcomes[1], self.status)
 
+    def current_fen(self):
+        if self.fens:
+            return self.fens[-1]
+        return self.board.fen()
+
     def game_state_str(self):
         times = self.updated_times()
-        return "%s %s %s %0.2f %0.2f %s" % (self.id, self.players[0].name, self.players[1].name, times[0], times[1], self.board.fen())
+        return "%s %s %s %0.2f %0.2f %s" % (self.id, self.players[0].name, self.players[1].name, times[0], times[1], self.current_fen())
 
     def send_clock_updates(self):
-        self.send_all("CLOCK_UPDATE", self.game_state_str())
+        times = self.updated_times()
+        self.send_all("CLOCK_UPDATE", self.game_state_str(), ("CLOCK", "%s %0.2f %0.2f" % (self.id, times[0], times[1])))
 
 
     def abort(self, reason):
-        self.state = GameState.ABORTED
+        games_aborted.labels(self.tournament.name).inc()
+        self.set_state(GameState.ABORTED)
+        self.cancel_timeout()
         self.status = "Game aborted"
 
-        self.send_all("GAME_ABORTED", reason)
+        self.send_all("GAME_ABORTED", "%s %s" % (self.id, reason))
         self.send_all("INFO", "Game aborted: %s" % (reason,))
+        self.close_feed()
 
         for p in self.players:
             p.current_game = None
@@ -480,8 +1183,10 @@ class Game(object):
 
     def send_game_paired_message(self):
         self.send_all("INFO", "Paired with player for game");
-        message = "%s %s %s %0.2f %0.2f" % (self.id, self.players[0].name, self.players[1].name, self.time_limit, self.increment)
-        self.send_all("GAME_PAIRED", message)
+        self.send_all("GAME_PAIRED", self.game_paired_str())
+
+    def game_paired_str(self):
+        return "%s %s %s %0.2f %0.2f" % (self.id, self.players[0].name, self.players[1].name, self.time_limit, self.increment)
 
     def player_disconnected(self, player):
         if player == self.players[0]:
@@ -492,28 +1197,32 @@ class Game(object):
         self.status = "Resignation by disconnect"
         self.game_over()
 
-    def add_observer(self, observer):
-        logging.info("Adding observer to game %s" % (self.id,))
-        times = self.updated_times()
+    # observers in delta mode get MOVED and CLOCK messages in place of PLAYER_MOVED and CLOCK_UPDATE
+    def add_observer(self, observer, delta=False):
+        observer_log.debug("Adding observer to game %s", self.id)
         observer.send_message("GAME_STATE", self.game_state_str())
-        self.observers.append(observer)
-        observer.observing_games.append(self)
+        if not observer in self.observers:
+            observers_watching.inc()
+        self.observers[observer] = delta
+        observer.observing_games[self] = True
 
     def remove_observer(self, observer):
-        logging.info("Removing observer from game %s" % (self.id,))
+        observer_log.debug("Removing observer from game %s", self.id)
 
-        if observer in self.observers:
-            self.observers.remove(observer)
-        if self in observer.observing_games:
-            observer.observing_games.remove(self)
+        if self.observers.pop(observer, None) is not None:
+            observers_watching.dec()
+        observer.observing_games.pop(self, None)
 
     def game_over(self):
-        self.state = GameState.FINISHED
+        games_finished.labels(self.tournament.name).inc()
+        self.set_state(GameState.FINISHED)
+        self.cancel_timeout()
 
 
 
         self.pgn.headers['Result'] = "%s-%s" % tuple(["1/2" if v == 0.5 else str(v) for v in  self.outcomes])
         self.pgn.headers['Termination'] = self.status
+        self.tournament.record_pairing(self)
         self.tournament.manager.save_game(self)
 
         #send message
@@ -522,6 +1231,8 @@ class Game(object):
         self.send_all("INFO", self.outcome_str())
 
         self.send_all("GAME_OVER", message)
+        self.close_feed()
+        self.tournament.standings_changed(self)
         for p in self.players:
             p.current_game = None
             p.last_game_done = time.time()
@@ -537,9 +1248,11 @@ class Game(object):
             for p in self.players:
                 p.state = PlayerState.PLAYING
 
-            self.state = GameState.IN_PROGRESS
+            self.set_state(GameState.IN_PROGRESS)
+            games_started.labels(self.tournament.name).inc()
 
-            self.cur_move_started_at = time.time()
+            self.cur_move_started_at = self.now()
+            self.schedule_timeout()
             self.get_move_from_current_player()
         else:
             player.send_message("INFO", "Waiting for opponent to acknowledged game")
@@ -550,7 +1263,7 @@ class Game(object):
         times = self.times[:]
         if self.state != GameState.IN_PROGRESS:
             return times
-        times[self.cur_index] -= (time.time() - self.cur_move_started_at)
+        times[self.cur_index] -= (self.now() - self.cur_move_started_at)
         times[self.cur_index] = max(times[self.cur_index], 0)
         return times
 
@@ -590,16 +1303,26 @@ class Game(object):
         m = "".join(m.split("="))
         return m.lower()
 
-    def is_draw(self):
-        if self.board.is_stalemate():
-            return True, "Stalemate"
-        if self.board.is_insufficient_material():
-            return True, "Insufficient material"
-        if self.board.is_threefold_repetition():
-            return True, "Threefold repetition"
-        if self.board.can_claim_fifty_moves():
-            return True, "Fifty moves without capture or pawn push"
-        return False, ""
+    def apply_move(self, engine_move):
+        """
+        Plays a legal move and works out whether it ended the game. Returns "Checkmate", the
+        reason for a draw, or None if play goes on. The opponent's legal moves are generated
+        (up to the first one found) once, rather than by each of the end conditions in turn.
+        """
+        self.repetitions.push(self.board, engine_move)
+        self.pgn_node = self.pgn_node.add_main_variation(engine_move)
+        self.fens.append(self.board.fen())
+
+        board = self.board
+        if not any(board.generate_legal_moves()):
+            return "Checkmate" if board.is_check() else "Stalemate"
+        if board.is_insufficient_material():
+            return "Insufficient material"
+        if self.repetitions.is_threefold_repetition():
+            return "Threefold repetition"
+        if board.halfmove_clock >= 100:
+            return "Fifty moves without capture or pawn push"
+        return None
 
     def make_move(self, player, move):
         if player != self.current_player():
@@ -614,37 +1337,38 @@ class Game(object):
         uci_move = self.uci_move(clean_move)
         engine_move = chess.Move.from_uci(uci_move)
 
-        if not engine_move in self.board.legal_moves:
+        if not self.board.is_legal(engine_move):
             player.send_message("INFO", "Move %s is not legal" % (move,))
             self.get_move_from_current_player()
             return
-        else:
-            self.board.push(engine_move)
-            self.pgn_node = self.pgn_node.add_main_variation(engine_move)
+
+        result = self.apply_move(engine_move)
+        moves_played.inc()
 
         self.times = self.updated_times()
-        self.cur_move_started_at = time.time()
+        self.cur_move_started_at = self.now()
         self.times[self.cur_index] += self.increment
 
-        message = "%s %s %s %s" % (self.id, self.current_player().name, clean_move, " ".join(self.game_state_str().split(" ")[1:]))
-        self.send_all("PLAYER_MOVED", message)
+        times = self.updated_times()
+        message = "%s %s %s %s %s %0.2f %0.2f %s" % (self.id, self.current_player().name, clean_move, self.players[0].name, self.players[1].name, times[0], times[1], self.current_fen())
+        self.send_all("PLAYER_MOVED", message, ("MOVED", "%s %s %0.2f %0.2f" % (self.id, engine_move.uci(), times[0], times[1])))
 
-        if self.board.is_checkmate():
-            logging.info("Checkmate on game %s!" % (self.id))
+        if result == "Checkmate":
+            log.info("Checkmate on game %s!", self.id)
             self.outcomes[self.cur_index] = 1
             self.status = "Checkmate"
             self.game_over();
             return;
 
-        draw, reason = self.is_draw()
-        if draw:
-            logging.info("Draw on game %s %s: " % (self.id, reason))
+        if result:
+            log.info("Draw on game %s %s: ", self.id, result)
             self.outcomes = [0.5, 0.5]
-            self.status = reason
+            self.status = result
             self.game_over();
             return;
 
         self.cur_index = (self.cur_index + 1) % 2
+        self.schedule_timeout()
         self.get_move_from_current_player()
 
 
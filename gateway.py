@@ -0,0 +1,188 @@
+"""
+Gateway process for the chess server. Accepts line and websocket clients, does their
+socket I/O, framing and parsing, and passes parsed messages to a core server.py
+started with --gateway_socket. Messages from the core are written to the clients
+through the same buffered players server.py uses, so coalescing and dropping slow
+observers happen here rather than in the core. Several gateways can share one core.
+"""
+from twisted.protocols import basic
+from twisted.internet import protocol
+from twisted.internet import reactor
+from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory
+
+import logging
+import argparse
+
+import connections
+import game_core
+import gateway_ipc
+import server_logging
+
+
+parser = argparse.ArgumentParser(description='Chess server gateway.')
+parser.add_argument("port", type=int, help="Port on which to listen for connections")
+parser.add_argument("--websocket_port", type=int, default=81, help="Accept websocket clients on this port")
+parser.add_argument("--core_socket", type=str, required=True, help="Unix socket the core server was given as --gateway_socket")
+parser.add_argument("--max_queued_kb", type=int, default=1024, help="Outbound data to hold for a client that is not reading before treating it as a slow consumer")
+parser.add_argument("--slow_consumer_grace", type=float, default=10.0, help="Seconds an observer may stay over --max_queued_kb before it is disconnected")
+parser.add_argument("--log_profile", type=str, default="verbose", choices=sorted(server_logging.PROFILES.keys()), help="Logging levels and message sampling to use")
+parser.add_argument("--log_level", type=str, action="append", default=[], help="Override the level of one logger, e.g. gateway=WARNING (may be repeated)")
+
+args = parser.parse_args()
+
+log_listener = server_logging.configure(args.log_profile, args.log_level)
+log = logging.getLogger("gateway")
+reactor.addSystemEventTrigger('after', 'shutdown', log_listener.stop)
+
+connections.BufferedPlayer.max_queued_bytes = args.max_queued_kb * 1024
+connections.BufferedPlayer.slow_consumer_grace = args.slow_consumer_grace
+
+class Gateway(object):
+    def __init__(self):
+        # client id -> player, for every client connected to this gateway
+        self.clients = {}
+        self.next_client_id = 0
+        # the current CoreConnection, None while the core is unreachable
+        self.core = None
+
+    def client_connected(self, player):
+        player.client_id = None
+        if self.core is None:
+            player.send_message("INFO", "Server unavailable")
+            player.force_disconnect()
+            return
+        player.client_id = self.next_client_id
+        self.next_client_id = (self.next_client_id + 1) & 0xffffffff
+        self.clients[player.client_id] = player
+        self.core.sendString(gateway_ipc.client_frame(gateway_ipc.OPEN, player.client_id))
+
+    def client_disconnected(self, player):
+        if self.clients.pop(player.client_id, None) is None:
+            return
+        if self.core is not None:
+            self.core.sendString(gateway_ipc.client_frame(gateway_ipc.CLOSED, player.client_id))
+
+    def message_received(self, player, text):
+        if not player.client_id in self.clients:
+            return
+        action, message = player.parse_message(text)
+        frame = gateway_ipc.message_frame(player.client_id, action, message)
+        if len(frame) > gateway_ipc.MAX_MESSAGE_BYTES:
+            player.send_message("INFO", "Ignoring message over %s bytes" % (gateway_ipc.MAX_MESSAGE_BYTES,))
+            return
+        if action == "JOIN" and player.tournament_name is None:
+            # only the core tracks tournaments; this marks the client as a player rather
+            # than an observer, so it is never dropped as a slow consumer
+            player.tournament_name = message.split(" ", 1)[0]
+        self.core.sendString(frame)
+
+    def core_connected(self, core):
+        log.info("Connected to core at %s", args.core_socket)
+        self.core = core
+
+    def core_disconnected(self):
+        log.warning("Lost connection to core, dropping %s clients", len(self.clients))
+        self.core = None
+        clients = self.clients
+        self.clients = {}
+        for player in clients.values():
+            player.force_disconnect()
+
+    def send(self, client_ids, broadcast):
+        for client_id in client_ids:
+            player = self.clients.get(client_id)
+            if player:
+                player.send_broadcast(broadcast)
+
+    def disconnect(self, client_id):
+        player = self.clients.get(client_id)
+        if player:
+            player.force_disconnect()
+
+gateway = Gateway()
+
+
+class CoreConnection(basic.Int32StringReceiver):
+    MAX_LENGTH = 1024 * 1024
+
+    def connectionMade(self):
+        self.factory.resetDelay()
+        gateway.core_connected(self)
+
+    def connectionLost(self, reason):
+        gateway.core_disconnected()
+
+    def stringReceived(self, frame):
+        if frame[0] == gateway_ipc.SEND:
+            client_ids, data = gateway_ipc.parse_send_frame(frame)
+            action, _, message = data.decode('utf-8').rstrip("\n").partition(" ")
+            # one Broadcast for all of them, so websocket clients share one frame
+            gateway.send(client_ids, game_core.Broadcast(action, message))
+        else:
+            kind, client_id, _ = gateway_ipc.parse_client_frame(frame)
+            if kind == gateway_ipc.DISCONNECT:
+                gateway.disconnect(client_id)
+
+
+class CoreConnectionFactory(protocol.ReconnectingClientFactory):
+    protocol = CoreConnection
+    maxDelay = 5.0
+
+
+class GatewayLineProtocol(basic.LineReceiver):
+
+    delimiter = '\n'
+    # longer lines close the client's connection
+    MAX_LENGTH = gateway_ipc.MAX_MESSAGE_BYTES
+
+    def connectionMade(self):
+        log.info("Client connected: %s", self.transport.getPeer())
+        self.player = connections.LineReceiverPlayer(self)
+        self.transport.registerProducer(self.player, True)
+        gateway.client_connected(self.player)
+
+    def connectionLost(self, reason):
+        log.info("Client disconnected: %s", self.transport.getPeer())
+        gateway.client_disconnected(self.player)
+
+    def lineReceived(self, line):
+        line = line.decode('utf-8').strip()
+        if len(line) != 0:
+            gateway.message_received(self.player, line)
+
+
+class GatewayWebSocketProtocol(WebSocketServerProtocol):
+    player = None
+
+    def onOpen(self):
+        log.info("WebSocket client connected: %s", self.transport.getPeer())
+        self.player = connections.WebSocketPlayer(self)
+        self.registerProducer(self.player, True)
+        gateway.client_connected(self.player)
+
+    def onMessage(self, payload, isBinary):
+        gateway.message_received(self.player, payload.decode('utf-8'))
+
+    def onClose(self, wasClean, code, reason):
+        log.info("WebSocket client disconnected: %s", self.transport.getPeer())
+        if self.player:
+            gateway.client_disconnected(self.player)
+
+
+log.info("Starting chess gateway on port %s", args.port)
+
+reactor.connectUNIX(args.core_socket, CoreConnectionFactory())
+
+# line server
+factory = protocol.Factory()
+factory.protocol = GatewayLineProtocol
+reactor.listenTCP(args.port, factory)
+
+# websocket server
+websocket_factory = WebSocketServerFactory()
+websocket_factory.protocol = GatewayWebSocketProtocol
+# larger messages close the client's connection
+websocket_factory.setProtocolOptions(maxFramePayloadSize=gateway_ipc.MAX_MESSAGE_BYTES, maxMessagePayloadSize=gateway_ipc.MAX_MESSAGE_BYTES)
+reactor.listenTCP(args.websocket_port, websocket_factory)
+
+reactor.run()
@@ -0,0 +1,235 @@
+"""
+The local connection between gateway.py processes and the core server.
+
+Gateways terminate the client connections (TCP, websocket framing, utf-8 decoding,
+parsing) and hand the core already parsed messages. Each gateway has one connection to
+the core, carrying length prefixed frames whose first byte is the frame kind:
+
+    gateway -> core
+        OPEN client                    a client connected
+        MESSAGE client action message  a parsed message from the client
+        CLOSED client                  the client went away
+    core -> gateway
+        SEND count clients... data     formatted message data for each of the clients
+        DISCONNECT client              drop the client
+
+Client ids are chosen by the gateway. A broadcast sent to many of a gateway's clients
+crosses the connection once, in a single SEND. Gateways refuse client messages over
+MAX_MESSAGE_BYTES, so one client can't send a frame the core would reject, which would
+drop the whole gateway. In the other direction, the core stops writing to a gateway that
+isn't keeping up and holds a bounded backlog for it.
+"""
+from twisted.protocols import basic
+from twisted.internet import protocol
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+import collections
+import logging
+import struct
+import time
+
+import connections
+import game_core
+
+
+log = logging.getLogger("server.gateway")
+
+OPEN = "o"
+MESSAGE = "m"
+CLOSED = "c"
+SEND = "s"
+DISCONNECT = "d"
+
+CLIENT = struct.Struct("!I")
+COUNT = struct.Struct("!H")
+MAX_SEND_CLIENTS = 0xffff
+# largest client message (as a MESSAGE frame) a gateway passes on, well under MAX_LENGTH
+MAX_MESSAGE_BYTES = 64 * 1024
+
+
+def client_frame(kind, client_id):
+    return kind + CLIENT.pack(client_id)
+
+def message_frame(client_id, action, message):
+    return MESSAGE + CLIENT.pack(client_id) + ("%s %s" % (action, message)).encode('utf-8')
+
+def send_frames(client_ids, data):
+    for start in range(0, len(client_ids), MAX_SEND_CLIENTS):
+        chunk = client_ids[start:start + MAX_SEND_CLIENTS]
+        yield SEND + COUNT.pack(len(chunk)) + struct.pack("!%sI" % (len(chunk),), *chunk) + data
+
+def parse_client_frame(frame):
+    """Returns (kind, client id, rest of the frame) for every frame but SEND."""
+    return frame[0], CLIENT.unpack_from(frame, 1)[0], frame[1 + CLIENT.size:]
+
+def parse_send_frame(frame):
+    """Returns (client ids, data) for a SEND frame."""
+    count = COUNT.unpack_from(frame, 1)[0]
+    start = 1 + COUNT.size
+    client_ids = struct.unpack_from("!%sI" % (count,), frame, start)
+    return client_ids, frame[start + count * CLIENT.size:]
+
+
+class GatewayPlayer(game_core.BasePlayer):
+    """A client of a gateway, as seen by the core."""
+    def __init__(self, gateway, client_id):
+        super(GatewayPlayer, self).__init__()
+        self.gateway = gateway
+        self.client_id = client_id
+
+    def send_message(self, action, message):
+        self.send_broadcast(game_core.Broadcast(action, message))
+
+    def send_broadcast(self, broadcast):
+        self.gateway.queue_send(broadcast, self.client_id)
+
+    def force_disconnect(self):
+        self.gateway.disconnect_client(self.client_id)
+
+
+@implementer(IPushProducer)
+class GatewayConnection(basic.Int32StringReceiver):
+    """
+    The core's end of a gateway connection. Consecutive sends of the same Broadcast (as from
+    Game.send_all) are collected and written as one SEND frame when the reactor turn ends,
+    or sooner if something else has to be written first.
+
+    The connection is its transport's streaming producer. While the gateway isn't reading,
+    frames wait in a backlog, and a gateway whose backlog stays over max_backlog_bytes for
+    slow_gateway_grace seconds is disconnected (it reconnects, its clients are dropped).
+    """
+    MAX_LENGTH = 1024 * 1024
+    max_backlog_bytes = 64 * 1024 * 1024
+    slow_gateway_grace = 10.0
+
+    def __init__(self, manager, clock):
+        self.manager = manager
+        self.clock = clock
+        # client id -> GatewayPlayer
+        self.players = {}
+        # (broadcast, client ids) waiting to be written
+        self.pending = None
+        self.flush_call = None
+        self.paused = False
+        self.backlog = collections.deque()
+        self.backlog_bytes = 0
+        self.over_limit_since = None
+
+    def connectionMade(self):
+        log.info("Gateway connected")
+        self.transport.registerProducer(self, True)
+
+    def connectionLost(self, reason):
+        log.info("Gateway disconnected, dropping its %s clients", len(self.players))
+        players = self.players
+        self.players = {}
+        self.pending = None
+        self.backlog.clear()
+        self.backlog_bytes = 0
+        connections.clients_connected.labels("gateway").dec(len(players))
+        for player in players.values():
+            self.manager.player_disconnected(player)
+
+    def stringReceived(self, frame):
+        kind, client_id, rest = parse_client_frame(frame)
+        if kind == OPEN:
+            player = GatewayPlayer(self, client_id)
+            self.players[client_id] = player
+            connections.clients_connected.labels("gateway").inc()
+            self.manager.player_connected(player)
+        elif kind == CLOSED:
+            player = self.players.pop(client_id, None)
+            if player:
+                connections.clients_connected.labels("gateway").dec()
+                self.manager.player_disconnected(player)
+        elif kind == MESSAGE:
+            player = self.players.get(client_id)
+            if player is None:
+                return
+            # a bad message only costs its own client the connection, never the gateway's
+            try:
+                action, message = rest.decode('utf-8').split(" ", 1)
+                self.manager.message_recieved(player, action, message)
+            except AssertionError, e:
+                log.warning("Disconnecting gateway client after bad message", exc_info=True)
+                player.send_message("INFO", " ".join(e.message.split("\n")))
+                player.force_disconnect()
+            except Exception:
+                log.exception("Disconnecting gateway client after error handling its message")
+                player.force_disconnect()
+        else:
+            log.warning("Unknown gateway frame kind %r", kind)
+
+    def queue_send(self, broadcast, client_id):
+        if self.pending is not None and self.pending[0] is broadcast:
+            self.pending[1].append(client_id)
+            return
+        self.flush()
+        self.pending = (broadcast, [client_id])
+        if self.flush_call is None:
+            self.flush_call = self.clock.callLater(0, self.scheduled_flush)
+
+    def scheduled_flush(self):
+        self.flush_call = None
+        self.flush()
+
+    def flush(self):
+        if self.pending is None:
+            return
+        broadcast, client_ids = self.pending
+        self.pending = None
+        for frame in send_frames(client_ids, broadcast.data):
+            self.write_frame(frame)
+        connections.bytes_sent.labels("gateway").inc(len(broadcast.data) * len(client_ids))
+
+    def disconnect_client(self, client_id):
+        # whatever was sent to the client before this still has to reach it
+        self.flush()
+        self.write_frame(client_frame(DISCONNECT, client_id))
+
+    def write_frame(self, frame):
+        if not self.paused and not self.backlog:
+            self.sendString(frame)
+            return
+        self.backlog.append(frame)
+        self.backlog_bytes += len(frame)
+        self.check_backlog()
+
+    def check_backlog(self):
+        if self.backlog_bytes <= self.max_backlog_bytes:
+            self.over_limit_since = None
+            return
+
+        now = time.time()
+        if self.over_limit_since is None:
+            self.over_limit_since = now
+        elif now - self.over_limit_since > self.slow_gateway_grace:
+            log.warning("Dropping slow gateway with %s bytes queued", self.backlog_bytes)
+            self.stopProducing()
+            self.transport.abortConnection()
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        while self.backlog and not self.paused:
+            frame = self.backlog.popleft()
+            self.backlog_bytes -= len(frame)
+            self.sendString(frame)
+        self.check_backlog()
+
+    def stopProducing(self):
+        self.paused = True
+
+
+class GatewayFactory(protocol.Factory):
+    def __init__(self, manager, clock):
+        self.manager = manager
+        self.clock = clock
+
+    def buildProtocol(self, addr):
+        connection = GatewayConnection(self.manager, self.clock)
+        connection.factory = self
+        return connection
@@ -0,0 +1,265 @@
+from twisted.web.resource import Resource
+from twisted.web.resource import NoResource
+from twisted.web.server import NOT_DONE_YET
+from twisted.internet import task
+
+import base64
+import bisect
+import json
+
+import game_core
+import util
+
+# JSON API, for dashboards and scripts:
+#
+#   /api/tournaments                                   newest first
+#   /api/tournaments/<name>                            one tournament
+#   /api/tournaments/<name>/standings                  highest score first
+#   /api/tournaments/<name>/games/active               newest first
+#   /api/tournaments/<name>/games/completed            newest first
+#
+# Lists take limit (at most MAX_LIMIT), cursor (the next_cursor of the previous page) and
+# fields (comma separated, see the *_FIELDS below), and return
+# {"items" : [...], "next_cursor" : "..." or null}.
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+# items serialized per write; the rest of a page waits for the next reactor iteration
+ITEMS_PER_WRITE = 100
+
+
+TOURNAMENT_FIELDS = {
+    "name" : lambda t: t.name,
+    "created_at" : lambda t: t.created_at,
+    "time_limit" : lambda t: t.time_limit,
+    "increment" : lambda t: t.increment,
+    "games_per_pair" : lambda t: t.games_per_pair,
+    "players" : lambda t: len(t.players),
+    "games" : lambda t: t.all_games_count(),
+    "active_games" : lambda t: t.game_count(game_core.GameState.IN_PROGRESS),
+}
+TOURNAMENT_DEFAULT_FIELDS = sorted(TOURNAMENT_FIELDS.keys())
+
+STANDING_FIELDS = {
+    "player" : lambda s: s["player"],
+    "played" : lambda s: s["played"],
+    "score" : lambda s: s["score"],
+}
+STANDING_DEFAULT_FIELDS = sorted(STANDING_FIELDS.keys())
+
+GAME_FIELDS = {
+    "id" : lambda g: g.id,
+    "white" : lambda g: g.players[0].name,
+    "black" : lambda g: g.players[1].name,
+    "created_at" : lambda g: g.created_at,
+    "result" : lambda g: g.outcomes if g.state == game_core.GameState.FINISHED else None,
+    "status" : lambda g: g.status,
+    # clocks are only kept up to date while the game is in progress
+    "times" : lambda g: g.updated_times() if g.state == game_core.GameState.IN_PROGRESS else None,
+    # reads the game back from the history file once it has been demoted, so only on request
+    "fen" : lambda g: g.current_fen(),
+}
+ACTIVE_GAME_DEFAULT_FIELDS = ["black", "created_at", "id", "times", "white"]
+COMPLETED_GAME_DEFAULT_FIELDS = ["black", "created_at", "id", "result", "status", "white"]
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)))
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor))
+    except (TypeError, ValueError):
+        raise ValueError("bad cursor")
+    if not isinstance(key, list):
+        raise ValueError("bad cursor")
+    return tuple(key)
+
+
+class ApiError(Exception):
+    pass
+
+def page_args(request, fields, default_fields):
+    """Returns (limit, cursor key or None, [(field name, getter)]) from the request, raising ApiError on bad values."""
+    try:
+        limit = int(request.args.get('limit', [DEFAULT_LIMIT])[0])
+    except ValueError:
+        raise ApiError("limit must be an integer")
+    if not (0 < limit <= MAX_LIMIT):
+        raise ApiError("limit must be between 1 and %s" % (MAX_LIMIT,))
+
+    cursor = request.args.get('cursor', [None])[0]
+    if cursor:
+        try:
+            cursor = decode_cursor(cursor)
+        except ValueError, e:
+            raise ApiError(e.message)
+    else:
+        cursor = None
+
+    return limit, cursor, selected_fields(request, fields, default_fields)
+
+def selected_fields(request, fields, default_fields):
+    names = request.args.get('fields', [None])[0]
+    names = [n for n in names.split(",") if n] if names else default_fields
+    unknown = [n for n in names if not n in fields]
+    if unknown:
+        raise ApiError("unknown fields %s, expected some of %s" % (", ".join(unknown), ", ".join(sorted(fields.keys()))))
+    return [(n, fields[n]) for n in names]
+
+def error(request, message, code=400):
+    request.setResponseCode(code)
+    request.setHeader("Content-Type", "application/json")
+    return json.dumps({"error" : message})
+
+
+def render_item(item, fields):
+    return json.dumps(dict((name, getter(item)) for name, getter in fields))
+
+def stream_page(request, items, fields, next_key):
+    """
+    Writes {"items" : [...], "next_cursor" : ...} a few items at a time, giving the reactor
+    back between writes, so a big page neither blocks other clients nor sits whole in memory.
+    """
+    request.setHeader("Content-Type", "application/json")
+    next_cursor = encode_cursor(next_key) if next_key is not None else None
+
+    def write():
+        for start in range(0, len(items), ITEMS_PER_WRITE):
+            prefix = '{"items":[' if start == 0 else ','
+            request.write(prefix + ",".join(render_item(item, fields) for item in items[start:start + ITEMS_PER_WRITE]))
+            yield
+        request.write(('{"items":[' if not items else '') + '],"next_cursor":%s}' % (json.dumps(next_cursor),))
+        request.finish()
+
+    writer = task.cooperate(write())
+    request.notifyFinish().addErrback(lambda _: writer.stop())
+    return NOT_DONE_YET
+
+def descending_page(keys, before, limit):
+    """
+    keys sorted ascending. Returns (the keys of up to limit items, newest first, that sort
+    before the key before (all of them when None), the key to continue from or None).
+    """
+    end = len(keys) if before is None else bisect.bisect_left(keys, before)
+    page = keys[max(0, end - limit):end][::-1]
+    return page, (page[-1] if end > limit else None)
+
+
+class Api(Resource):
+    def __init__(self, manager):
+        self.children = []
+        self.manager = manager
+
+    def getChild(self, name, request):
+        if name == 'tournaments':
+            return ApiTournamentList(self.manager)
+        return NoResource()
+
+
+class ApiTournamentList(Resource):
+    def __init__(self, manager):
+        self.children = []
+        self.manager = manager
+
+    def getChild(self, name, request):
+        if name == '':
+            return self
+        tournament = self.manager.tournaments.get(util.path_name(name))
+        if tournament is None:
+            return NoResource()
+        return ApiTournament(tournament)
+
+    def render_GET(self, request):
+        try:
+            limit, cursor, fields = page_args(request, TOURNAMENT_FIELDS, TOURNAMENT_DEFAULT_FIELDS)
+        except ApiError, e:
+            return error(request, e.message)
+        # tournaments are few; sorting them per request is cheaper than keeping them sorted
+        tournaments = dict(((t.created_at, t.name), t) for t in self.manager.tournaments.values())
+        keys, next_key = descending_page(sorted(tournaments.keys()), cursor, limit)
+        return stream_page(request, [tournaments[k] for k in keys], fields, next_key)
+
+
+class ApiTournament(Resource):
+    def __init__(self, tournament):
+        self.children = []
+        self.tournament = tournament
+
+    def getChild(self, name, request):
+        if name == '':
+            return self
+        elif name == 'standings':
+            return ApiStandings(self.tournament)
+        elif name == 'games':
+            return ApiGames(self.tournament)
+        return NoResource()
+
+    def render_GET(self, request):
+        try:
+            fields = selected_fields(request, TOURNAMENT_FIELDS, TOURNAMENT_DEFAULT_FIELDS)
+        except ApiError, e:
+            return error(request, e.message)
+        request.setHeader("Content-Type", "application/json")
+        return render_item(self.tournament, fields)
+
+
+# tournament name -> (tournament version, standings sorted by (-score, player), their keys)
+standings_cache = {}
+
+def sorted_standings(tournament):
+    cached = standings_cache.get(tournament.name)
+    if cached is None or cached[0] != tournament.version:
+        standings = tournament.get_standings()
+        rows = sorted(({"player" : p, "played" : s["played"], "score" : s["score"]} for p, s in standings.items()), key=lambda r: (-r["score"], r["player"]))
+        cached = standings_cache[tournament.name] = (tournament.version, rows, [(-r["score"], r["player"]) for r in rows])
+    return cached[1], cached[2]
+
+
+class ApiStandings(Resource):
+    isLeaf = True
+    def __init__(self, tournament):
+        self.children = []
+        self.tournament = tournament
+
+    def render_GET(self, request):
+        try:
+            limit, cursor, fields = page_args(request, STANDING_FIELDS, STANDING_DEFAULT_FIELDS)
+        except ApiError, e:
+            return error(request, e.message)
+        rows, keys = sorted_standings(self.tournament)
+        start = 0 if cursor is None else bisect.bisect_right(keys, cursor)
+        end = start + limit
+        return stream_page(request, rows[start:end], fields, keys[end - 1] if end < len(keys) else None)
+
+
+class ApiGames(Resource):
+    def __init__(self, tournament):
+        self.children = []
+        self.tournament = tournament
+
+    def getChild(self, name, request):
+        if name == 'active':
+            return ApiGameList(self.tournament, game_core.GameState.IN_PROGRESS, ACTIVE_GAME_DEFAULT_FIELDS)
+        elif name == 'completed':
+            return ApiGameList(self.tournament, game_core.GameState.FINISHED, COMPLETED_GAME_DEFAULT_FIELDS)
+        return NoResource()
+
+
+class ApiGameList(Resource):
+    isLeaf = True
+    def __init__(self, tournament, state, default_fields):
+        self.children = []
+        self.tournament = tournament
+        self.state = state
+        self.default_fields = default_fields
+
+    def render_GET(self, request):
+        try:
+            limit, cursor, fields = page_args(request, GAME_FIELDS, self.default_fields)
+        except ApiError, e:
+            return error(request, e.message)
+        # one extra, to know whether there is a next page
+        games = self.tournament.games_before(self.state, cursor, limit + 1)
+        next_key = (games[limit - 1].created_at, games[limit - 1].id) if len(games) > limit else None
+        return stream_page(request, games[:limit], fields, next_key)
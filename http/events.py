@@ -0,0 +1,119 @@
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+from twisted.internet import task
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+import logging
+
+log = logging.getLogger("http")
+
+# seconds between comment lines on an idle stream, so proxies don't time it out
+KEEPALIVE_INTERVAL = 15.0
+# milliseconds a client should wait before reconnecting
+RETRY_MS = 3000
+
+
+def serialized(event):
+    """The event in the event stream format, built once for every subscriber."""
+    data = event.prepared.get("sse")
+    if data is None:
+        message = event.broadcast.message
+        if isinstance(message, unicode):
+            message = message.encode("utf-8")
+        data = event.prepared["sse"] = "id: %s\nevent: %s\ndata: %s\n\n" % (event.id, event.broadcast.action, message)
+    return data
+
+
+@implementer(IPushProducer)
+class EventSubscriber(object):
+    """
+    One open event stream. While the transport is paused, events are not queued up for it;
+    once it resumes it catches up from the feed's retained events, or starts over from the
+    feed's current state if it fell further behind than those go.
+    """
+    def __init__(self, request, feed):
+        self.request = request
+        self.feed = feed
+        self.last_event_id = None
+        self.paused = False
+        self.keepalive = task.LoopingCall(self.send_keepalive)
+
+    def start(self, last_event_id):
+        self.request.registerProducer(self, True)
+        self.request.write("retry: %s\n\n" % (RETRY_MS,))
+        self.last_event_id = last_event_id
+        self.catch_up()
+        self.feed.subscribe(self)
+        self.keepalive.start(KEEPALIVE_INTERVAL, now=False)
+        self.request.notifyFinish().addBoth(self.finished)
+
+    def catch_up(self):
+        events = self.feed.since(self.last_event_id)
+        if events is None:
+            events = self.feed.reset_events()
+        if events:
+            self.request.write("".join(serialized(e) for e in events))
+            self.last_event_id = events[-1].id
+
+    def send_event(self, event):
+        if self.paused:
+            return
+        self.request.write(serialized(event))
+        self.last_event_id = event.id
+
+    def send_keepalive(self):
+        if not self.paused:
+            self.request.write(":\n\n")
+
+    def feed_closed(self):
+        # the game is over; the reconnect this causes gets a 204, which stops the client
+        self.stop()
+        self.request.unregisterProducer()
+        self.request.finish()
+
+    def finished(self, _):
+        self.stop()
+
+    def stop(self):
+        self.feed.unsubscribe(self)
+        if self.keepalive.running:
+            self.keepalive.stop()
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        if self.paused:
+            self.paused = False
+            self.catch_up()
+
+    def stopProducing(self):
+        self.stop()
+
+
+class EventStream(Resource):
+    """
+    text/event-stream of a game's or tournament's feed, for EventSource clients. A
+    Last-Event-ID header (or last_event_id parameter) resumes after that event; without
+    one, or when that event is no longer retained, the stream starts with a RESET event
+    and the current state.
+    """
+    isLeaf = True
+    # feed is called for the current feed, None once there will be no more events
+    def __init__(self, feed):
+        self.children = []
+        self.feed = feed
+
+    def render_GET(self, request):
+        feed = self.feed()
+        if feed is None:
+            request.setResponseCode(204)
+            return ""
+        request.setHeader("Content-Type", "text/event-stream")
+        request.setHeader("Cache-Control", "no-cache")
+        # tell buffering proxies (nginx) to pass events straight through
+        request.setHeader("X-Accel-Buffering", "no")
+        last_event_id = request.getHeader("last-event-id") or request.args.get('last_event_id', [None])[0]
+        EventSubscriber(request, feed).start(last_event_id)
+        return NOT_DONE_YET
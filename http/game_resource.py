@@ -5,6 +5,9 @@ from twisted.web.static import File
 import cgi
 import util
 
+from pgn_export import game_pgn
+from events import EventStream
+
 
 class GameResource(Resource):
     def __init__(self, game):
@@ -14,6 +17,10 @@ class GameResource(Resource):
     def getChild(self, name, request):
         if name == '':
             return self
+        elif name == 'pgn':
+            return game_pgn(self.game)
+        elif name == 'events':
+            return EventStream(lambda: self.game.feed)
         else:
             return NoResource()
 
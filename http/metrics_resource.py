@@ -0,0 +1,14 @@
+from twisted.web.resource import Resource
+
+import metrics
+
+
+# Prometheus text exposition of everything in metrics.REGISTRY
+class Metrics(Resource):
+    isLeaf = True
+    def __init__(self):
+        self.children = []
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        return metrics.REGISTRY.render()
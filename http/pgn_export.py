@@ -0,0 +1,77 @@
+from twisted.web.resource import Resource, EncodingResourceWrapper
+from twisted.web.server import NOT_DONE_YET, GzipEncoderFactory
+from twisted.internet.interfaces import IPullProducer
+from zope.interface import implementer
+
+import heapq
+import util
+
+from game_core import GameState
+
+# bytes of pgn to gather before each write
+CHUNK_SIZE = 64 * 1024
+
+
+@implementer(IPullProducer)
+class PgnProducer(object):
+    """
+    Writes the pgn of each of games to request, a chunk each time the transport asks for
+    more, so only about CHUNK_SIZE bytes of an export are held at once. Finished games
+    are copied from the history file, games still in memory are serialized from there.
+    """
+    def __init__(self, request, manager, games):
+        self.request = request
+        self.games = games
+        self.history_file = open(manager.history_file_name, "r")
+
+    def resumeProducing(self):
+        chunk, size = [], 0
+        for game in self.games:
+            text = game.pgn_text(self.history_file)
+            chunk.append(text)
+            size += len(text)
+            if size >= CHUNK_SIZE:
+                break
+        if chunk:
+            self.request.write("".join(chunk))
+        else:
+            self.request.unregisterProducer()
+            self.request.finish()
+            self.history_file.close()
+
+    def stopProducing(self):
+        self.history_file.close()
+
+
+class PgnExport(Resource):
+    isLeaf = True
+    # games is called (once per request) for an iterable of the games to export
+    def __init__(self, manager, filename, games):
+        self.children = []
+        self.manager = manager
+        self.filename = filename
+        self.games = games
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "application/x-chess-pgn")
+        request.setHeader("Content-Disposition", "attachment; filename=\"%s\"" % (self.filename,))
+        request.registerProducer(PgnProducer(request, self.manager, iter(self.games())), False)
+        return NOT_DONE_YET
+
+
+def gzipped(resource):
+    """Serves resource gzipped to clients that accept it."""
+    return EncodingResourceWrapper(resource, [GzipEncoderFactory()])
+
+
+def tournament_games(tournament):
+    """The tournament's finished and in progress games, oldest first."""
+    # the keys as they are now; games that start later are not part of the export
+    keys = heapq.merge(list(tournament.game_keys_by_state[GameState.FINISHED]), list(tournament.game_keys_by_state[GameState.IN_PROGRESS]))
+    return (tournament.games[game_id] for _, game_id in keys)
+
+def tournament_pgn(tournament):
+    return gzipped(PgnExport(tournament.manager, "%s.pgn" % (util.url_escape(tournament.name),), lambda: tournament_games(tournament)))
+
+def game_pgn(game):
+    return gzipped(PgnExport(game.tournament.manager, "%s.pgn" % (game.id,), lambda: [game]))
@@ -0,0 +1,70 @@
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+from twisted.internet import reactor
+
+import cProfile
+import hmac
+import logging
+import pstats
+import StringIO
+
+log = logging.getLogger("http")
+
+MAX_SECONDS = 120
+SORT_KEYS = ["cumulative", "tottime", "ncalls"]
+
+
+# GET /profile?token=...&seconds=10&sort=cumulative&limit=50
+# Profiles the reactor thread for the given number of seconds and returns the pstats report.
+class Profile(Resource):
+    isLeaf = True
+    # only one capture at a time, across requests
+    running = False
+
+    def __init__(self, admin_token):
+        self.children = []
+        self.admin_token = admin_token
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "text/plain; charset=utf-8")
+        token = request.args.get('token', [''])[0]
+        if not hmac.compare_digest(token, self.admin_token):
+            request.setResponseCode(403)
+            return "Forbidden\n"
+
+        try:
+            seconds = float(request.args.get('seconds', ['10'])[0])
+            limit = int(request.args.get('limit', ['50'])[0])
+        except ValueError:
+            request.setResponseCode(400)
+            return "Error: bad values for seconds or limit\n"
+        sort = request.args.get('sort', ['cumulative'])[0]
+        if not (0 < seconds <= MAX_SECONDS) or not sort in SORT_KEYS:
+            request.setResponseCode(400)
+            return "Error: seconds must be in (0, %s] and sort one of %s\n" % (MAX_SECONDS, ", ".join(SORT_KEYS))
+
+        if Profile.running:
+            request.setResponseCode(409)
+            return "Error: a profile is already running\n"
+        Profile.running = True
+
+        log.info("Profiling the reactor for %s seconds", seconds)
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        finished = []
+        request.notifyFinish().addBoth(finished.append)
+
+        def report():
+            profiler.disable()
+            Profile.running = False
+            if finished:
+                # client went away
+                return
+            out = StringIO.StringIO()
+            stats = pstats.Stats(profiler, stream=out)
+            stats.sort_stats(sort).print_stats(limit)
+            request.write(out.getvalue())
+            request.finish()
+        reactor.callLater(seconds, report)
+        return NOT_DONE_YET
@@ -4,11 +4,17 @@ from twisted.web.static import File
 from twisted.web.util import redirectTo
 
 from tournament_list import TournamentList
+from shard import ShardInfo
+from metrics_resource import Metrics
+from profile_resource import Profile
+from api import Api
 
 class HttpRoot(Resource):
-    def __init__(self, manager):
+    # admin_token enables the /profile endpoint, for requests that pass it
+    def __init__(self, manager, admin_token=None):
         self.children = []
         self.manager = manager
+        self.admin_token = admin_token
 
     def getChild(self, name, request):
         if name == '':
@@ -17,6 +23,14 @@ class HttpRoot(Resource):
             return File('./static/')
         elif name == 'tournaments':
             return TournamentList(self.manager)
+        elif name == 'api':
+            return Api(self.manager)
+        elif name == 'shard':
+            return ShardInfo(self.manager)
+        elif name == 'metrics':
+            return Metrics()
+        elif name == 'profile' and self.admin_token:
+            return Profile(self.admin_token)
         else:
             return NoResource()
 
@@ -0,0 +1,17 @@
+from twisted.web.resource import Resource
+
+import json
+
+from tournament_list import tournament_summary
+
+
+# What shard_router.py needs to know about a worker's tournaments to render the combined list
+class ShardInfo(Resource):
+    isLeaf = True
+    def __init__(self, manager):
+        self.children = []
+        self.manager = manager
+
+    def render_GET(self, request):
+        request.setHeader("Content-Type", "application/json")
+        return json.dumps({"tournaments" : [tournament_summary(t) for t in self.manager.tournaments.values()]})
@@ -3,10 +3,23 @@ from twisted.web.resource import NoResource
 from twisted.web.static import File
 from game_resource import GameResource
 from human_client import HumanClient
+from pgn_export import tournament_pgn
+from events import EventStream
 
 import datetime
+import logging
 import util
 
+from game_core import GameState
+
+log = logging.getLogger("http")
+
+# tournament name -> util.CachedPage of its page
+page_cache = {}
+
+# newest completed games listed on the page, the rest are in the JSON API
+MAX_LISTED_GAMES = 200
+
 class Tournament(Resource):
     def __init__(self, manager, tournament):
         self.manager = manager
@@ -18,9 +31,13 @@ class Tournament(Resource):
             return self
         elif name == 'play':
             return HumanClient(self.tournament)
+        elif name == 'pgn':
+            return tournament_pgn(self.tournament)
+        elif name == 'events':
+            return EventStream(lambda: self.tournament.feed)
         elif name.startswith("force_disconnect__"):
             player_name = name[len("force_disconnect__"):]
-            print "Removing player %s" % (player_name)
+            log.info("Removing player %s", player_name)
             if player_name in self.tournament.players:
                 player = self.tournament.players[player_name]
                 player.force_disconnect()
@@ -55,31 +72,42 @@ class Tournament(Resource):
         if len(games) == 0:
             return "<p>No games</p>"
         games = sorted(games, key=lambda g:g.created_at, reverse=True)
+        tournament_url = util.url_escape(self.tournament.name)
 
-        rtn = "<ul>"
+        items = []
         for g in games:
-            l = "<a href=\"/tournaments/%s/%s\">%s v. %s</a>" % (util.url_escape(self.tournament.name), g.id, util.html_escape(g.players[0].name), util.html_escape(g.players[1].name))
+            l = "<a href=\"/tournaments/%s/%s\">%s v. %s</a>" % (tournament_url, g.id, util.html_escape(g.players[0].name), util.html_escape(g.players[1].name))
             if g.status != "*":
                 l += " %s-%s %s" % (g.outcomes[0], g.outcomes[1], g.status)
-            rtn += "<li>%s</li>" % (l,)
-        rtn += "</ul>"
-        return rtn
+            items.append("<li>%s</li>" % (l,))
+        return "<ul>%s</ul>" % ("".join(items),)
 
     def render_GET(self, request):
         request.setHeader("Content-Type", "text/html; charset=utf-8")
+        page = util.cached_page(page_cache, self.tournament.name, self.tournament.version, self.render_html)
+        if util.not_modified(request, page.etag, self.tournament.modified_at):
+            return ""
+        return page.html
 
+    def render_html(self):
         html = "<html><head><h1>Tournament %s</h1></head><body>" % (util.html_escape(self.tournament.name),)
         html += "<p>Details</p>"
         html += self.details_table()
 
         html += "<h3><a href=\"/tournaments/%s/play\">Join Tournament</a></32>" % (util.url_escape(self.tournament.name),)
+        html += "<p><a href=\"/tournaments/%s/pgn\">Download all games (PGN)</a></p>" % (util.url_escape(self.tournament.name),)
 
         html += "<h2>Standings</h2>"
         html += self.standings_table()
         html += "<h2>Active Games</h2>"
         html += self.game_list(self.tournament.active_games())
         html += "<h2>Completed Games</h2>"
-        html += self.game_list(self.tournament.compleated_games())
+        completed = self.tournament.games_before(GameState.FINISHED, limit=MAX_LISTED_GAMES)
+        html += self.game_list(completed)
+        total = self.tournament.game_count(GameState.FINISHED)
+        if total > len(completed):
+            url = "/api/tournaments/%s/games/completed" % (util.url_escape(self.tournament.name),)
+            html += "<p>Newest %s of %s shown, all are at <a href=\"%s\">%s</a></p>" % (len(completed), total, url, url)
         html += "</body></html>"
         return html
 
@@ -3,7 +3,6 @@ from twisted.web.resource import NoResource
 from twisted.web.static import File
 from twisted.web.util import redirectTo
 
-import urllib
 import util
 
 from tournament import Tournament
@@ -40,8 +39,10 @@ class TournamentList (Resource):
         self.manager = manager
 
     def getChild(self, name, request):
-        name = urllib.unquote(name).decode("utf-8")
-        if name == '':
+        name = util.path_name(name)
+        if name is None:
+            return NoResource()
+        elif name == '':
             return self
         elif name == 'new':
             return NewTournament(self.manager)
@@ -52,31 +53,47 @@ class TournamentList (Resource):
 
     def render_GET(self, request):
         request.setHeader("Content-Type", "text/html; charset=utf-8")
+        page = util.cached_page(page_cache, "", self.manager.version, self.render_html)
+        if util.not_modified(request, page.etag, self.manager.modified_at):
+            return ""
+        return page.html
 
-        tournament_html = ""
-        if len(self.manager.tournaments):
-            tournaments = sorted(self.manager.tournaments.values(), key=lambda t:t.created_at, reverse=True)
+    def render_html(self):
+        return tournament_list_html([tournament_summary(t) for t in self.manager.tournaments.values()])
 
-            tournament_html = "<ul>"
-            for t in tournaments:
-                tournament_html += "<li><a href='/tournaments/%s'>%s</a> (%s games,  %s active players)</li>" % (util.url_escape(t.name), util.html_escape(t.name), len(t.all_games()), len(t.players))
-            tournament_html += "</ul>"
-        else:
-            tournament_html = "<p>No Tournaments :(</p>"
-
-
-        form_html = """
-        <form action="/tournaments/new" method="post">
-            Tournament name:
-            <input type="text" name="name"><br>
-            Time limit (seconds):
-            <input type="text" name="time_limit"><br>
-            Increment (seconds):
-            <input type="text" name="increment"><br>
-            Games per pairing:
-            <input type="text" name="games_per_pair"><br>
-            <input type="submit" value="Submit">
-        </form>"""
-
-        html = "<html><head><h1>Chess Server</h1></head><body><h2>Tournaments</h2>%s<h2>Create new tournament</h2>%s</body></html>" % (tournament_html, form_html)
-        return html
+
+# holds the one page, under ""
+page_cache = {}
+
+
+def tournament_summary(t):
+    return {"name" : t.name, "created_at" : t.created_at, "games" : t.all_games_count(), "players" : len(t.players)}
+
+
+# summaries are dicts from tournament_summary, from this process or (under shard_router.py) from the workers
+def tournament_list_html(summaries):
+    tournament_html = ""
+    if len(summaries):
+        summaries = sorted(summaries, key=lambda t:t["created_at"], reverse=True)
+
+        items = ["<li><a href='/tournaments/%s'>%s</a> (%s games,  %s active players)</li>" % (util.url_escape(t["name"]), util.html_escape(t["name"]), t["games"], t["players"]) for t in summaries]
+        tournament_html = "<ul>%s</ul>" % ("".join(items),)
+    else:
+        tournament_html = "<p>No Tournaments :(</p>"
+
+
+    form_html = """
+    <form action="/tournaments/new" method="post">
+        Tournament name:
+        <input type="text" name="name"><br>
+        Time limit (seconds):
+        <input type="text" name="time_limit"><br>
+        Increment (seconds):
+        <input type="text" name="increment"><br>
+        Games per pairing:
+        <input type="text" name="games_per_pair"><br>
+        <input type="submit" value="Submit">
+    </form>"""
+
+    html = "<html><head><h1>Chess Server</h1></head><body><h2>Tournaments</h2>%s<h2>Create new tournament</h2>%s</body></html>" % (tournament_html, form_html)
+    return html
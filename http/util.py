@@ -1,4 +1,7 @@
+from twisted.web import http
+
 import cgi
+import hashlib
 import urllib
 
 def html_escape(s):
@@ -7,4 +10,47 @@ def html_escape(s):
 def url_escape(s):
     return urllib.quote(s.encode("utf-8"),  safe='')
 
+def path_name(segment):
+    """A name from a url path segment (which twisted has already unquoted), None if it isn't utf-8."""
+    try:
+        return segment.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+# A rendered page, and the version of whatever it was rendered from
+class CachedPage(object):
+    def __init__(self, version, html):
+        self.version = version
+        self.html = html
+        self.etag = '"%s"' % (hashlib.sha1(html).hexdigest(),)
+
+def cached_page(cache, key, version, render):
+    """Returns the CachedPage for key, calling render() for new html if it is older than version."""
+    page = cache.get(key)
+    if page is None or page.version != version:
+        page = cache[key] = CachedPage(version, render())
+    return page
+
+def not_modified(request, etag, modified_at):
+    """
+    Sets the ETag and Last-Modified headers, and returns True (having set a 304 status)
+    if the client's copy is still current. modified_at is in whole seconds (see
+    game_core.modified_time).
+    """
+    request.setHeader("ETag", etag)
+    request.setHeader("Last-Modified", http.datetimeToString(modified_at))
+
+    if_none_match = request.getHeader("if-none-match")
+    if if_none_match is not None:
+        current = if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+    else:
+        try:
+            if_modified_since = request.getHeader("if-modified-since")
+            current = if_modified_since is not None and http.stringToDatetime(if_modified_since) >= modified_at
+        except ValueError:
+            current = False
 
+    if current:
+        request.setResponseCode(http.NOT_MODIFIED)
+    return current
@@ -0,0 +1,186 @@
+"""
+Counters, gauges and histograms for the chess server, rendered in the Prometheus text
+format by http/metrics_resource.py.
+
+Metrics are created once at module level where they are used. Updating one is an
+attribute increment (plus a dict lookup for labelled metrics, and a bisect for
+histograms), so they can sit on the hot paths; all formatting happens when /metrics
+is scraped.
+"""
+import bisect
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+        self.names = set()
+
+    def register(self, metric):
+        assert not metric.name in self.names, "Metric %s already registered" % (metric.name,)
+        self.names.add(metric.name)
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                lines.append("%s%s%s %s" % (metric.name, suffix, format_labels(labels), format_value(value)))
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % (",".join('%s="%s"' % (name, escape_label(value)) for name, value in labels),)
+
+def escape_label(value):
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value):
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+
+class CounterValue(object):
+    __slots__ = ["value"]
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeValue(CounterValue):
+    __slots__ = []
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class FunctionValue(object):
+    """A gauge's value, read from function() when metrics are rendered."""
+    __slots__ = ["function"]
+
+    def __init__(self, function):
+        self.function = function
+
+    @property
+    def value(self):
+        return self.function()
+
+
+class HistogramValue(object):
+    __slots__ = ["buckets", "counts", "sum"]
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # counts[i] is observations in (buckets[i - 1], buckets[i]], the last one above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric(object):
+    """
+    A metric, optionally split by label values. Unlabelled metrics are updated directly
+    (inc, observe, ...); labelled ones through labels(*values).
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        # label values -> value object
+        self.children = {}
+        if not self.label_names:
+            self.children[()] = self.new_value()
+        registry.register(self)
+
+    def new_value(self):
+        raise Exception("Not Implemented")
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            assert len(values) == len(self.label_names), "Expected labels %s" % (self.label_names,)
+            child = self.children[values] = self.new_value()
+        return child
+
+    def samples(self):
+        for values, child in sorted(self.children.items()):
+            yield "", zip(self.label_names, values), child.value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_value(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def new_value(self):
+        return GaugeValue()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def dec(self, amount=1):
+        self.children[()].dec(amount)
+
+    def set(self, value):
+        self.children[()].set(value)
+
+    # for values that are cheaper to look up at scrape time than to keep up to date
+    def set_function(self, function):
+        assert not self.label_names, "Only unlabelled gauges can be set to a function"
+        self.children[()] = FunctionValue(function)
+
+
+# seconds, for work done on the reactor thread or an fsync
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, help, labels, registry)
+
+    def new_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def samples(self):
+        for values, child in sorted(self.children.items()):
+            labels = zip(self.label_names, values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield "_bucket", labels + [("le", format_value(float(bound)))], cumulative
+            yield "_sum", labels, child.sum
+            yield "_count", labels, cumulative
@@ -8,45 +8,49 @@ from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerF
 
 import logging
 import argparse
-import traceback
+import time
 
+import connections
 import game_core
+import gateway_ipc
+import metrics
+import server_logging
+import sharding
 from http.root import HttpRoot
 
 
-logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d %I:%M:%S %p', level=logging.DEBUG)
 parser = argparse.ArgumentParser(description='Chess server.')
 parser.add_argument("port", type=int, help="Port on which to listen for connections")
 parser.add_argument("--http_port", type=int, default=80, help="Serve details on the active games over http on this port")
 parser.add_argument("--websocket_port", type=int, default=81, help="Serve details on the active games over http on this port")
 parser.add_argument("--history_file", type=str, default='static/game_history.pgn', help="File to record game history")
+parser.add_argument("--history_fsync", type=str, default=game_core.FsyncPolicy.ALWAYS, choices=[game_core.FsyncPolicy.ALWAYS, game_core.FsyncPolicy.INTERVAL, game_core.FsyncPolicy.NEVER], help="When to fsync the game history file")
+parser.add_argument("--history_fsync_interval", type=float, default=1.0, help="Seconds between fsyncs of the game history file with --history_fsync interval")
+parser.add_argument("--history_cache_size", type=int, default=256, help="Number of finished games to keep parsed in memory")
+parser.add_argument("--max_queued_kb", type=int, default=1024, help="Outbound data to hold for a client that is not reading before treating it as a slow consumer")
+parser.add_argument("--slow_consumer_grace", type=float, default=10.0, help="Seconds an observer may stay over --max_queued_kb before it is disconnected")
+parser.add_argument("--log_profile", type=str, default="verbose", choices=sorted(server_logging.PROFILES.keys()), help="Logging levels and message sampling to use")
+parser.add_argument("--log_level", type=str, action="append", default=[], help="Override the level of one logger, e.g. server.messages=WARNING (may be repeated)")
+parser.add_argument("--shard", type=int, default=0, help="Index of this worker when run behind shard_router.py")
+parser.add_argument("--shards", type=int, default=1, help="Number of workers behind shard_router.py")
+parser.add_argument("--gateway_socket", type=str, default=None, help="Also accept gateway.py processes on this unix socket")
+parser.add_argument("--tick_budget", type=float, default=0.1, help="Warn when a periodic loop runs, or the reactor runs it late, by more than this many seconds")
+parser.add_argument("--admin_token", type=str, default=None, help="Enables the /profile endpoint for requests passing this token")
 
 args = parser.parse_args()
 
-manager = game_core.Manager(args.history_file)
+log_listener = server_logging.configure(args.log_profile, args.log_level)
+log = logging.getLogger("server")
+message_log = logging.getLogger("server.messages")
 
-class LineReceiverPlayer(game_core.BasePlayer):
-    def __init__(self, connection):
-        super(LineReceiverPlayer, self).__init__()
-        self.connection = connection
+game_id_node = sharding.game_id_node(args.shard) if args.shards > 1 else None
+manager = game_core.Manager(args.history_file, reactor, args.history_fsync, args.history_fsync_interval, args.history_cache_size, game_id_node)
+reactor.addSystemEventTrigger('before', 'shutdown', manager.close)
+reactor.addSystemEventTrigger('after', 'shutdown', log_listener.stop)
 
-    def send_message(self, action, message):
-        self.connection.transport.write(self.format_message(action, message).encode('utf-8'))
-
-    def force_disconnect(self):
-        self.connection.transport.loseConnection()
-
-class  WebSocketPlayer(game_core.BasePlayer):
-    def __init__(self, connection):
-        super(WebSocketPlayer, self).__init__()
-        self.connection = connection
-
-    def send_message(self, action, message):
-        self.connection.sendMessage(self.format_message(action, message).encode('utf-8'), False)
-
-    def force_disconnect(self):
-        self.connection.transport.loseConnection()
-        #manager.player_disconnected(self)
+connections.BufferedPlayer.max_queued_bytes = args.max_queued_kb * 1024
+connections.BufferedPlayer.slow_consumer_grace = args.slow_consumer_grace
+connections.publish_queue_stats(lambda: manager.connected_players)
 
 class ChessLineProtocol(basic.LineReceiver):
 
@@ -56,12 +60,15 @@ class ChessLineProtocol(basic.LineReceiver):
         pass
 
     def connectionMade(self):
-        logging.info("Client connected: %s" % (self.transport.getPeer(),))
-        self.player = LineReceiverPlayer(self)
+        log.info("Client connected: %s", self.transport.getPeer())
+        self.player = connections.LineReceiverPlayer(self)
+        self.transport.registerProducer(self.player, True)
+        connections.clients_connected.labels("tcp").inc()
         manager.player_connected(self.player)
 
     def connectionLost(self, reason):
-        logging.info("Client disconnected: %s" % (self.transport.getPeer(),))
+        log.info("Client disconnected: %s", self.transport.getPeer())
+        connections.clients_connected.labels("tcp").dec()
         manager.player_disconnected(self.player)
 
     def lineReceived(self, line):
@@ -69,11 +76,12 @@ class ChessLineProtocol(basic.LineReceiver):
         if len(line) != 0:
             try:
                 action, message = self.player.parse_message(line)
-                logging.info("Received message from socket %s %s" % (action, message))
+                if message_log.isEnabledFor(logging.INFO):
+                    message_log.info("Received message from socket %s %s", action, message, extra={"action" : action})
                 manager.message_recieved(self.player, action, message)
 
             except AssertionError, e:
-                traceback.print_exc()
+                log.warning("Disconnecting client after bad message", exc_info=True)
                 self.player.send_message("INFO", " ".join(e.message.split("\n")))
                 self.player.force_disconnect()
 
@@ -81,49 +89,74 @@ class ChessLineProtocol(basic.LineReceiver):
 
 class ChessWebSocketsProtocol(WebSocketServerProtocol):
     def __init__(self):
+        super(ChessWebSocketsProtocol, self).__init__()
         self.player = None
-        self.is_closed = True
 
     def onConnect(self, request):
         pass
 
     def onOpen(self):
-        logging.info("WebSocket client connected: %s" % (self.transport.getPeer(),))
-        self.player = WebSocketPlayer(self)
+        log.info("WebSocket client connected: %s", self.transport.getPeer())
+        self.player = connections.WebSocketPlayer(self)
+        self.registerProducer(self.player, True)
+        connections.clients_connected.labels("websocket").inc()
         manager.player_connected(self.player)
 
     def onMessage(self, payload, isBinary):
         try:
             action, message = self.player.parse_message(payload.decode('utf-8'))
-            logging.info("Received message from websocket %s %s" % (action, message))
+            if message_log.isEnabledFor(logging.INFO):
+                message_log.info("Received message from websocket %s %s", action, message, extra={"action" : action})
             manager.message_recieved(self.player, action, message)
         except AssertionError, e:
-            traceback.print_exc()
+            log.warning("Disconnecting client after bad message", exc_info=True)
             self.player.send_message("INFO", " ".join(e.message.split("\n")))
             self.player.force_disconnect()
 
 
     def onClose(self, wasClean, code, reason):
-        logging.info("WebSocket client disconnected: %s" % (self.transport.getPeer(),))
+        log.info("WebSocket client disconnected: %s", self.transport.getPeer())
         if self.player:
+            connections.clients_connected.labels("websocket").dec()
             manager.player_disconnected(self.player)
 
-logging.info("Starting chess server on port %s" % (args.port,))
+log.info("Starting chess server on port %s", args.port)
 
-def update_pairings():
-    manager.update_pairings()
-    reactor.callLater(3.0, update_pairings)
-update_pairings()
+tick_seconds = metrics.Histogram("chess_tick_seconds", "Time taken by one run of a periodic loop", ["loop"])
+tick_lag_seconds = metrics.Histogram("chess_reactor_lag_seconds", "How much later than scheduled the reactor ran a periodic loop", ["loop"])
 
-def check_timeouts():
-    manager.check_timeouts()
-    reactor.callLater(1.0, check_timeouts)
-check_timeouts()
+# Runs fn now and then interval seconds after each run finishes, timing each run and how
+# late the reactor got to it. A late run means everything else on the reactor was late too.
+# A run that raises is logged, and the loop carries on.
+def run_periodically(name, interval, fn):
+    duration = tick_seconds.labels(name)
+    lag = tick_lag_seconds.labels(name)
 
-def send_clock_updates():
-    manager.send_clock_updates()
-    reactor.callLater(5.0, send_clock_updates)
-send_clock_updates()
+    def tick(scheduled_at):
+        started = time.time()
+        late = max(started - scheduled_at, 0)
+        lag.observe(late)
+        if late > args.tick_budget:
+            log.warning("Reactor ran %s %0.3fs late", name, late)
+
+        try:
+            fn()
+        except Exception:
+            # the next run may well succeed, the loop must not stop
+            log.exception("Error in periodic %s", name)
+        finally:
+            elapsed = time.time() - started
+            duration.observe(elapsed)
+            if elapsed > args.tick_budget:
+                log.warning("%s took %0.3fs", name, elapsed)
+            reactor.callLater(interval, tick, time.time() + interval)
+    tick(time.time())
+
+run_periodically("update_pairings", 3.0, manager.update_pairings)
+run_periodically("send_clock_updates", 5.0, manager.send_clock_updates)
+run_periodically("demote_finished_games", 5.0, manager.demote_finished_games)
+# does nothing, so its lag is the reactor's alone, sampled more often than the loops run
+run_periodically("lag_probe", 0.5, lambda: None)
 
 
 # line server
@@ -137,8 +170,12 @@ websocket_factory = WebSocketServerFactory()
 websocket_factory.protocol = ChessWebSocketsProtocol
 reactor.listenTCP(args.websocket_port, websocket_factory)
 
+# gateway processes
+if args.gateway_socket:
+    reactor.listenUNIX(args.gateway_socket, gateway_ipc.GatewayFactory(manager, reactor), wantPID=True)
+
 # HTTP server
-reactor.listenTCP(args.http_port, server.Site(HttpRoot(manager)))
+reactor.listenTCP(args.http_port, server.Site(HttpRoot(manager, args.admin_token)))
 
 reactor.run()
 
@@ -0,0 +1,125 @@
+"""
+Logging for the chess server.
+
+Components log to their own loggers (game_core, game_core.observers, server,
+server.messages) so each can have its own level. Records are handed to a
+background thread through a bounded queue, so formatting them and writing
+to stderr never happens on the reactor. Records carrying an "action" (one
+per inbound protocol message) can be sampled per message type.
+"""
+import logging
+import threading
+import Queue
+
+
+FORMAT = '%(asctime)s %(message)s'
+DATE_FORMAT = '%m/%d %I:%M:%S %p'
+
+# levels: logger name -> level ("" is the root logger)
+# sample: action -> log one message in every n of that type ("*" for any other action)
+PROFILES = {
+    "verbose" : {
+        "levels" : {"" : logging.DEBUG},
+        "sample" : {},
+    },
+    "production" : {
+        "levels" : {"" : logging.INFO, "game_core.observers" : logging.WARNING},
+        "sample" : {"MOVE" : 1000, "ACK" : 100, "SAY" : 100},
+    },
+    "quiet" : {
+        "levels" : {"" : logging.WARNING},
+        "sample" : {},
+    },
+}
+
+
+class ActionSampler(logging.Filter):
+    def __init__(self, rates):
+        logging.Filter.__init__(self)
+        self.rates = rates
+        self.counts = {}
+
+    def filter(self, record):
+        action = getattr(record, "action", None)
+        if action is None:
+            return True
+        rate = self.rates.get(action, self.rates.get("*", 1))
+        count = self.counts.get(action, 0)
+        self.counts[action] = count + 1
+        return count % rate == 0
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts records on a queue for a QueueListener to write. Message formatting is left to the
+    listener thread, apart from tracebacks, which have to be captured while they exist.
+    When the queue is full records are dropped and counted rather than blocking the caller.
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def emit(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+
+class QueueListener(object):
+    def __init__(self, queue, handler):
+        self.queue = queue
+        self.handler = handler
+        self.thread = threading.Thread(target=self.run, name="log-writer")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        # write out whatever is still queued, then stop the thread
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            self.handler.handle(record)
+
+
+def configure(profile, level_overrides=(), max_queued=10000):
+    """
+    Sets up the given profile from PROFILES, with level_overrides given as
+    "logger.name=LEVEL" strings. Returns the QueueListener, which should be
+    stopped on shutdown so that queued records are written out.
+    """
+    settings = PROFILES[profile]
+    levels = dict(settings["levels"])
+    for override in level_overrides:
+        name, level = override.split("=", 1)
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+
+    for name, level in levels.items():
+        logging.getLogger(name or None).setLevel(level)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(FORMAT, DATE_FORMAT))
+
+    queue = Queue.Queue(max_queued)
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(ActionSampler(settings["sample"]))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(queue, stream_handler)
+    listener.start()
+    return listener
@@ -0,0 +1,464 @@
+"""
+Front process for running the chess server as several worker processes.
+
+Each worker is an ordinary server.py (started with --shard/--shards) that owns the
+tournaments whose names hash to it (see sharding.py). The router accepts the line
+and websocket connections that would otherwise go to server.py and relays each
+client's messages to the worker that owns what they refer to: a JOIN and everything
+after it, and a WATCH_TOURNAMENT or UNWATCH_TOURNAMENT, go to the tournament's worker,
+a WATCH or UNWATCH to the worker that created the game. A client has one connection to
+each worker it talks to, so workers see ordinary players and observers and all
+validation stays with them.
+
+HTTP requests for a tournament (and its games) are proxied to its worker. The
+tournament list is put together from every worker's /shard summary, and the
+/api/tournaments list from a page of every worker's.
+"""
+from twisted.protocols import basic
+from twisted.internet import reactor, defer, protocol
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.internet.interfaces import IPushProducer
+from twisted.web import server
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.proxy import ReverseProxyResource
+from twisted.web.resource import Resource, NoResource
+from twisted.web.static import File
+from twisted.web.util import redirectTo
+from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory
+from zope.interface import implementer
+
+import argparse
+import json
+import logging
+import sys
+import urllib
+
+import server_logging
+import sharding
+from http.tournament_list import tournament_list_html
+from http import api
+from http import util
+
+
+parser = argparse.ArgumentParser(description='Chess server front process for sharded workers.')
+parser.add_argument("port", type=int, help="Port on which to listen for connections")
+parser.add_argument("--http_port", type=int, default=80, help="Serve details on the active games over http on this port")
+parser.add_argument("--websocket_port", type=int, default=81, help="Serve details on the active games over http on this port")
+parser.add_argument("--workers", type=str, default="", help="Already running workers, as host:port:http_port,... in shard order")
+parser.add_argument("--spawn", type=int, default=0, help="Start this many local server.py workers instead of using --workers")
+parser.add_argument("--worker_base_port", type=int, default=9000, help="First port for spawned workers (each uses three consecutive ports)")
+parser.add_argument("--log_profile", type=str, default="verbose", choices=sorted(server_logging.PROFILES.keys()), help="Logging levels and message sampling to use (also passed to spawned workers)")
+
+args = parser.parse_args()
+
+log_listener = server_logging.configure(args.log_profile)
+log = logging.getLogger("router")
+reactor.addSystemEventTrigger('after', 'shutdown', log_listener.stop)
+
+
+class Worker(object):
+    def __init__(self, host, port, http_port):
+        self.host = host
+        self.port = port
+        self.http_port = http_port
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    def __init__(self, shard):
+        self.shard = shard
+        self.ended = defer.Deferred()
+
+    def processEnded(self, reason):
+        log.info("Worker %s exited: %s", self.shard, reason.getErrorMessage())
+        self.ended.callback(None)
+
+
+def spawn_workers(count, base_port):
+    workers = []
+    processes = []
+    for shard in range(count):
+        port = base_port + 3 * shard
+        argv = [sys.executable, "server.py", str(port),
+                "--http_port", str(port + 1),
+                "--websocket_port", str(port + 2),
+                "--history_file", "static/game_history.shard%s.pgn" % (shard,),
+                "--shard", str(shard),
+                "--shards", str(count),
+                "--log_profile", args.log_profile]
+        process = WorkerProcess(shard)
+        reactor.spawnProcess(process, sys.executable, argv, env=None, childFDs={0 : "w", 1 : 1, 2 : 2})
+        processes.append(process)
+        workers.append(Worker("127.0.0.1", port, port + 1))
+
+    def stop_workers():
+        for process in processes:
+            if process.transport.pid is not None:
+                process.transport.signalProcess("TERM")
+        # workers flush their history files on the way down, so wait for them
+        return defer.DeferredList([process.ended for process in processes])
+    reactor.addSystemEventTrigger('before', 'shutdown', stop_workers)
+    return workers
+
+
+def parse_workers(spec):
+    workers = []
+    for entry in spec.split(","):
+        host, port, http_port = entry.strip().split(":")
+        workers.append(Worker(host, int(port), int(http_port)))
+    return workers
+
+
+if args.spawn:
+    workers = spawn_workers(args.spawn, args.worker_base_port)
+else:
+    assert args.workers, "Give either --workers or --spawn"
+    workers = parse_workers(args.workers)
+
+
+class Upstream(basic.LineReceiver):
+    """One client's connection to one worker."""
+    delimiter = '\n'
+    MAX_LENGTH = 1024 * 1024
+
+    def __init__(self, client):
+        self.client = client
+
+    def lineReceived(self, line):
+        self.client.connection.write_line(line + '\n')
+
+    def connectionLost(self, reason):
+        self.client.upstream_lost(self)
+
+
+@implementer(IPushProducer)
+class RoutedClient(object):
+    """
+    Routes one client's messages to workers. Registered as the producer for the client's
+    transport: when the client stops reading, the router stops reading from its workers,
+    so their own backpressure (coalescing, dropping slow observers) applies as if the
+    client were connected to them directly.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        # the shard of the tournament the client joined
+        self.home = None
+        # shard -> connected Upstream
+        self.upstreams = {}
+        # shard -> (connect deferred, data waiting for the connection)
+        self.pending = {}
+        self.paused = False
+        self.closed = False
+
+    def line_received(self, line):
+        line = line.decode('utf-8').strip()
+        if len(line) == 0:
+            return
+        parts = [s for s in line.split(" ") if len(s)]
+        action = parts[0].upper()
+
+        if action == "DISCONNECT":
+            self.close()
+            return
+        elif action == "WATCH" or action == "UNWATCH":
+            shard = sharding.shard_for_game(parts[1], len(workers)) if len(parts) > 1 else None
+            if shard is None:
+                self.reject("No game found with id %s" % (parts[1] if len(parts) > 1 else "",))
+                return
+        elif action == "WATCH_TOURNAMENT" or action == "UNWATCH_TOURNAMENT":
+            if len(parts) < 2:
+                self.reject("Tournament not found")
+                return
+            shard = sharding.shard_for_tournament(parts[1], len(workers))
+        elif self.home is None:
+            if action != "JOIN":
+                self.reject("First message must be a JOIN or WATCH")
+                return
+            if len(parts) != 3:
+                self.reject("Bad name or tournament")
+                return
+            self.home = sharding.shard_for_tournament(parts[1], len(workers))
+            shard = self.home
+        else:
+            shard = self.home
+
+        self.send(shard, line.encode('utf-8') + '\n')
+
+    def send(self, shard, data):
+        if shard in self.upstreams:
+            self.upstreams[shard].transport.write(data)
+            return
+        if shard not in self.pending:
+            worker = workers[shard]
+            endpoint = TCP4ClientEndpoint(reactor, worker.host, worker.port)
+            d = connectProtocol(endpoint, Upstream(self))
+            d.addCallbacks(self.upstream_connected, self.upstream_failed, callbackArgs=(shard,), errbackArgs=(shard,))
+            self.pending[shard] = (d, [])
+        self.pending[shard][1].append(data)
+
+    def upstream_connected(self, upstream, shard):
+        _, waiting = self.pending.pop(shard)
+        self.upstreams[shard] = upstream
+        if self.paused:
+            upstream.transport.pauseProducing()
+        for data in waiting:
+            upstream.transport.write(data)
+
+    def upstream_failed(self, failure, shard):
+        if self.closed:
+            return
+        log.warning("Could not connect to shard %s: %s", shard, failure.getErrorMessage())
+        self.reject("Server unavailable")
+
+    def upstream_lost(self, upstream):
+        # the worker disconnected this client (e.g. after a bad message), so the router does too
+        if not self.closed:
+            self.close()
+
+    def reject(self, message):
+        self.connection.write_line(("INFO %s\n" % (message,)).encode('utf-8'))
+        self.close()
+
+    def close(self):
+        self.close_upstreams()
+        self.connection.close()
+
+    def connection_lost(self):
+        self.close_upstreams()
+
+    def close_upstreams(self):
+        if self.closed:
+            return
+        self.closed = True
+        pending = self.pending
+        self.pending = {}
+        for d, _ in pending.values():
+            d.cancel()
+        for upstream in self.upstreams.values():
+            upstream.transport.loseConnection()
+
+    def pauseProducing(self):
+        self.paused = True
+        for upstream in self.upstreams.values():
+            upstream.transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.paused = False
+        for upstream in self.upstreams.values():
+            upstream.transport.resumeProducing()
+
+    def stopProducing(self):
+        self.close_upstreams()
+
+
+class FrontLineProtocol(basic.LineReceiver):
+
+    delimiter = '\n'
+
+    def connectionMade(self):
+        log.info("Client connected: %s", self.transport.getPeer())
+        self.client = RoutedClient(self)
+        self.transport.registerProducer(self.client, True)
+
+    def connectionLost(self, reason):
+        log.info("Client disconnected: %s", self.transport.getPeer())
+        self.client.connection_lost()
+
+    def lineReceived(self, line):
+        self.client.line_received(line)
+
+    def write_line(self, data):
+        self.transport.write(data)
+
+    def close(self):
+        self.transport.loseConnection()
+
+
+class FrontWebSocketProtocol(WebSocketServerProtocol):
+    client = None
+
+    def onOpen(self):
+        log.info("WebSocket client connected: %s", self.transport.getPeer())
+        self.client = RoutedClient(self)
+        self.registerProducer(self.client, True)
+
+    def onMessage(self, payload, isBinary):
+        self.client.line_received(payload)
+
+    def onClose(self, wasClean, code, reason):
+        log.info("WebSocket client disconnected: %s", self.transport.getPeer())
+        if self.client:
+            self.client.connection_lost()
+
+    def write_line(self, data):
+        if self.state == WebSocketServerProtocol.STATE_OPEN:
+            self.sendMessage(data, False)
+
+    def close(self):
+        self.transport.loseConnection()
+
+
+http_agent = Agent(reactor, pool=HTTPConnectionPool(reactor))
+
+
+def worker_for_tournament(name):
+    return workers[sharding.shard_for_tournament(name, len(workers))]
+
+
+class FrontRoot(Resource):
+    def __init__(self):
+        self.children = []
+
+    def getChild(self, name, request):
+        if name == '':
+            return self
+        elif name == 'static':
+            return File('./static/')
+        elif name == 'tournaments':
+            return FrontTournamentList()
+        elif name == 'api':
+            return FrontApi()
+        else:
+            return NoResource()
+
+    def render_GET(self, request):
+        return redirectTo("/tournaments", request)
+
+
+class FrontApi(Resource):
+    def __init__(self):
+        self.children = []
+
+    def getChild(self, name, request):
+        if name == 'tournaments':
+            return FrontApiTournamentList()
+        return NoResource()
+
+
+class FrontApiTournamentList(Resource):
+    def __init__(self):
+        self.children = []
+
+    def getChild(self, name, request):
+        if name == '':
+            return self
+        tournament_name = util.path_name(name)
+        if tournament_name is None:
+            return NoResource()
+        worker = worker_for_tournament(tournament_name)
+        return ReverseProxyResource(worker.host, worker.http_port, "/api/tournaments/" + urllib.quote(name, safe=""))
+
+    def render_GET(self, request):
+        try:
+            limit, cursor, fields = api.page_args(request, api.TOURNAMENT_FIELDS, api.TOURNAMENT_DEFAULT_FIELDS)
+        except api.ApiError, e:
+            return api.error(request, e.message)
+        names = [name for name, _ in fields]
+        # each worker's newest limit before the cursor, with what is needed to merge them
+        query = {"limit" : limit, "fields" : ",".join(set(names) | set(["name", "created_at"]))}
+        if cursor is not None:
+            query["cursor"] = api.encode_cursor(cursor)
+
+        lost = []
+        request.notifyFinish().addErrback(lambda _: lost.append(True))
+
+        def fetch(worker):
+            d = http_agent.request("GET", "http://%s:%s/api/tournaments?%s" % (worker.host, worker.http_port, urllib.urlencode(query)))
+            d.addCallback(readBody)
+            d.addCallback(json.loads)
+            return d
+
+        def render(pages):
+            if lost:
+                return
+            items = sorted((t for page in pages for t in page["items"]), key=lambda t: (t["created_at"], t["name"]), reverse=True)
+            more = len(items) > limit or any(page["next_cursor"] for page in pages)
+            items = items[:limit]
+            next_cursor = api.encode_cursor((items[-1]["created_at"], items[-1]["name"])) if more else None
+            request.setHeader("Content-Type", "application/json")
+            request.write(json.dumps({"items" : [dict((n, t[n]) for n in names) for t in items], "next_cursor" : next_cursor}))
+            request.finish()
+
+        def render_error(failure):
+            log.warning("Could not list tournaments: %s", failure.getErrorMessage())
+            if lost:
+                return
+            request.write(api.error(request, "a shard is unavailable", 502))
+            request.finish()
+
+        d = defer.gatherResults([fetch(worker) for worker in workers], consumeErrors=True)
+        d.addCallbacks(render, render_error)
+        return server.NOT_DONE_YET
+
+
+class FrontTournamentList(Resource):
+    def __init__(self):
+        self.children = []
+
+    def getChild(self, name, request):
+        if name == '':
+            return self
+        elif name == 'new':
+            return FrontNewTournament()
+        tournament_name = util.path_name(name)
+        if tournament_name is None:
+            return NoResource()
+        worker = worker_for_tournament(tournament_name)
+        return ReverseProxyResource(worker.host, worker.http_port, "/tournaments/" + urllib.quote(name, safe=""))
+
+    def render_GET(self, request):
+        lost = []
+        request.notifyFinish().addErrback(lambda _: lost.append(True))
+
+        def fetch(worker):
+            d = http_agent.request("GET", "http://%s:%s/shard" % (worker.host, worker.http_port))
+            d.addCallback(readBody)
+            d.addCallback(lambda body: json.loads(body)["tournaments"])
+            return d
+
+        def render(results):
+            if lost:
+                return
+            request.setHeader("Content-Type", "text/html; charset=utf-8")
+            request.write(tournament_list_html([t for summaries in results for t in summaries]))
+            request.finish()
+
+        def render_error(failure):
+            log.warning("Could not list tournaments: %s", failure.getErrorMessage())
+            if lost:
+                return
+            request.setResponseCode(502)
+            request.write("<html><head><h2>Error: a shard is unavailable</h2></head><body></body></html>")
+            request.finish()
+
+        d = defer.gatherResults([fetch(worker) for worker in workers], consumeErrors=True)
+        d.addCallbacks(render, render_error)
+        return server.NOT_DONE_YET
+
+
+class FrontNewTournament(Resource):
+    isLeaf = True
+    def __init__(self):
+        self.children = []
+
+    def render_POST(self, request):
+        name = request.args.get('name', [''])[0].strip().decode("utf-8", "replace")
+        worker = worker_for_tournament(name)
+        return ReverseProxyResource(worker.host, worker.http_port, "/tournaments/new").render(request)
+
+
+log.info("Starting chess router on port %s for %s shards", args.port, len(workers))
+
+# line server
+factory = protocol.Factory()
+factory.protocol = FrontLineProtocol
+reactor.listenTCP(args.port, factory)
+
+# websocket server
+websocket_factory = WebSocketServerFactory()
+websocket_factory.protocol = FrontWebSocketProtocol
+reactor.listenTCP(args.websocket_port, websocket_factory)
+
+# HTTP server
+reactor.listenTCP(args.http_port, server.Site(FrontRoot()))
+
+reactor.run()
@@ -0,0 +1,45 @@
+"""
+Placement of tournaments and games on shards, shared by the worker servers and
+shard_router.py.
+
+Tournaments are placed by a hash of their name, so the number of shards must
+stay the same for as long as the workers' history files are in use. Games are
+found through their id: each worker creates uuid1 game ids whose node field
+names its shard.
+"""
+import zlib
+
+# multicast bit set, so a shard node can't be mistaken for a real MAC address (RFC 4122 4.5)
+SHARD_NODE_PREFIX = 0x010000000000
+SHARD_NODE_MASK = 0xffff
+
+
+def shard_for_tournament(name, shards):
+    if isinstance(name, unicode):
+        name = name.encode("utf-8")
+    return (zlib.crc32(name.strip()) & 0xffffffff) % shards
+
+
+def game_id_node(shard):
+    return SHARD_NODE_PREFIX | shard
+
+
+def shard_for_game(game_id, shards):
+    """
+    Returns the shard that created game_id, or None for ids not made by a shard. With a
+    single shard every game is on it, whatever its id.
+    """
+    if shards == 1:
+        return 0
+    if len(game_id) != 32:
+        return None
+    try:
+        node = int(game_id[-12:], 16)
+    except ValueError:
+        return None
+    if node & ~SHARD_NODE_MASK != SHARD_NODE_PREFIX:
+        return None
+    shard = node & SHARD_NODE_MASK
+    if shard >= shards:
+        return None
+    return shard
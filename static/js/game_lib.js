@@ -85,7 +85,7 @@ function manage_game(tournament_name, player_name, game_id, play) {
             send_message(socket, "JOIN", tournament_name + " " + player_name);
             status_div.innerHTML = "Waiting for pairing from server...";
         } else {
-            send_message(socket, "WATCH", game_id);
+            send_message(socket, "WATCH", game_id + " DELTA");
         }
         if (join_div) join_div.hidden = true;
     }
@@ -105,6 +105,34 @@ function manage_game(tournament_name, player_name, game_id, play) {
         }
     }
 
+    // apply a UCI move (as sent in MOVED messages) to the board
+    function apply_move(move) {
+        var from = move.substring(0, 2);
+        var to = move.substring(2, 4);
+        var position = board.position();
+        var piece = position[from];
+        if (piece === undefined) return;
+        delete position[from];
+
+        if (piece.charAt(1) === "K" && Math.abs(from.charCodeAt(0) - to.charCodeAt(0)) === 2) {
+            // castling, the rook comes along
+            var kingside = to.charAt(0) === "g";
+            var rook_from = (kingside ? "h" : "a") + from.charAt(1);
+            var rook_to = (kingside ? "f" : "d") + from.charAt(1);
+            position[rook_to] = position[rook_from];
+            delete position[rook_from];
+        } else if (piece.charAt(1) === "P" && from.charAt(0) !== to.charAt(0) && position[to] === undefined) {
+            // en passant, the captured pawn is next to the from square
+            delete position[to.charAt(0) + from.charAt(1)];
+        }
+
+        if (move.length > 4) {
+            piece = piece.charAt(0) + move.charAt(4).toUpperCase();
+        }
+        position[to] = piece;
+        board.position(position);
+    }
+
     socket.onmessage = function (event) {
         console.log("Got message: " + event.data);
         var parts = event.data.split(" ");
@@ -132,6 +160,19 @@ function manage_game(tournament_name, player_name, game_id, play) {
         } else if (action === "CLOCK_UPDATE") {
             do_state_update();
             reset_dead_reckon_time();
+        } else if (action === "CLOCK") {
+            white_time = Number(message_parts[1]);
+            black_time = Number(message_parts[2]);
+            update_time_labels();
+            reset_dead_reckon_time();
+        } else if (action === "MOVED") {
+            move_sound.play();
+            apply_move(message_parts[1]);
+            white_to_move = !white_to_move;
+            white_time = Number(message_parts[2]);
+            black_time = Number(message_parts[3]);
+            update_time_labels();
+            reset_dead_reckon_time();
         } else if (action === "GAME_OVER") {
             gameover_sound.play();
             your_move = false;
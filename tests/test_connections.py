@@ -0,0 +1,93 @@
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial import unittest
+
+import connections
+import metrics
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.transport = StringTransport()
+
+
+class BufferedPlayerTest(unittest.TestCase):
+    def setUp(self):
+        self.player = connections.LineReceiverPlayer(FakeConnection())
+        self.transport = self.player.connection.transport
+
+    def lines(self):
+        lines = self.transport.value().splitlines()
+        self.transport.clear()
+        return lines
+
+    def test_writes_straight_through_while_not_paused(self):
+        self.player.send_message("INFO", "hello")
+        self.assertEqual(self.lines(), ["INFO hello"])
+        self.assertEqual(self.player.queue_stats(), {"queued_messages" : 0, "queued_bytes" : 0, "coalesced" : 0, "paused" : False})
+
+    def test_coalesces_while_paused(self):
+        self.player.pauseProducing()
+        self.player.send_message("PLAYER_MOVED", "g1 a e2-e4")
+        self.player.send_message("CLOCK_UPDATE", "g1 10")
+        self.player.send_message("GAME_STATE", "g2 1")
+        self.player.send_message("PLAYER_MOVED", "g1 b e7-e5")
+        self.player.send_message("CLOCK_UPDATE", "g1 9")
+        self.player.send_message("GAME_STATE", "g2 2")
+        self.assertEqual(self.lines(), [])
+        stats = self.player.queue_stats()
+        self.assertEqual((stats["queued_messages"], stats["coalesced"], stats["paused"]), (4, 2, True))
+
+        self.player.resumeProducing()
+        # the newer clock goes after the move it follows
+        self.assertEqual(self.lines(), ["PLAYER_MOVED g1 a e2-e4", "PLAYER_MOVED g1 b e7-e5", "CLOCK_UPDATE g1 9", "GAME_STATE g2 2"])
+        self.assertEqual(self.player.queued_bytes, 0)
+
+    def test_messages_keep_their_order_after_resuming(self):
+        self.player.pauseProducing()
+        self.player.send_message("INFO", "1")
+        self.player.resumeProducing()
+        self.player.send_message("INFO", "2")
+        self.assertEqual(self.lines(), ["INFO 1", "INFO 2"])
+
+    def test_stays_queued_if_paused_again_while_resuming(self):
+        player = self.player
+        class PausingTransport(StringTransport):
+            def write(self, data):
+                StringTransport.write(self, data)
+                player.pauseProducing()
+        self.transport = player.connection.transport = PausingTransport()
+        player.pauseProducing()
+        player.send_message("INFO", "1")
+        player.send_message("INFO", "2")
+        player.resumeProducing()
+        self.assertEqual(self.lines(), ["INFO 1"])
+        self.assertEqual(len(player.queue), 1)
+
+    def fill_queue(self):
+        self.player.max_queued_bytes = 10
+        self.player.slow_consumer_grace = -1
+        self.player.pauseProducing()
+        self.player.send_message("INFO", "x" * 20)
+        self.player.send_message("INFO", "x" * 20)
+
+    def test_drops_slow_observer(self):
+        self.fill_queue()
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(self.player.queued_bytes, 0)
+
+    def test_keeps_slow_player(self):
+        self.player.tournament_name = "T"
+        self.fill_queue()
+        self.assertFalse(self.transport.disconnecting)
+        self.assertEqual(len(self.player.queue), 2)
+
+    def test_queue_metrics(self):
+        other = connections.LineReceiverPlayer(FakeConnection())
+        connections.publish_queue_stats(lambda: [self.player, other, object()])
+        self.player.pauseProducing()
+        self.player.send_message("INFO", "1")
+        other.send_message("INFO", "2")
+        rendered = metrics.REGISTRY.render()
+        self.assertIn("\nchess_client_queued_bytes 7\n", rendered)
+        self.assertIn("\nchess_client_queued_messages 1\n", rendered)
+        self.assertIn("\nchess_clients_paused 1\n", rendered)
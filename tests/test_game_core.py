@@ -0,0 +1,579 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+import errno
+import json
+import os
+import time
+
+import chess
+
+import game_core
+import metrics
+from game_core import GameState
+
+
+class FakePlayer(game_core.BasePlayer):
+    def __init__(self):
+        super(FakePlayer, self).__init__()
+        self.messages = []
+        self.disconnected = False
+
+    def send_message(self, action, message):
+        self.messages.append((action, message))
+
+    def force_disconnect(self):
+        self.disconnected = True
+
+    def received(self, action):
+        return [m for a, m in self.messages if a == action]
+
+
+class FailingFile(object):
+    """A file whose next failures writes (all of them for None) fail as if the disk were full."""
+    def __init__(self, f, failures):
+        self.f = f
+        self.failures = failures
+
+    def write(self, data):
+        if self.failures is None or self.failures > 0:
+            if self.failures:
+                self.failures -= 1
+            raise IOError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class ManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = self.mktemp()
+        os.mkdir(directory)
+        self.history_file_name = os.path.join(directory, "history.pgn")
+        self.clock = task.Clock()
+        self.manager = self.new_manager()
+
+    def new_manager(self, **kwargs):
+        manager = game_core.Manager(self.history_file_name, self.clock, **kwargs)
+        self.addCleanup(manager.close)
+        return manager
+
+    def connect(self):
+        player = FakePlayer()
+        self.manager.player_connected(player)
+        return player
+
+    def join(self, tournament_name, name):
+        player = self.connect()
+        self.manager.message_recieved(player, "JOIN", "%s %s" % (tournament_name, name))
+        return player
+
+    def pair(self, tournament_name):
+        # players wait WAIT_BETWEEN_GAMES of wall clock time between games
+        for p in self.manager.tournaments[tournament_name].players.values():
+            p.last_game_done = 0
+        self.manager.update_pairings()
+
+    def start_game(self, tournament_name, *players):
+        self.pair(tournament_name)
+        game = players[0].current_game
+        for p in game.players:
+            self.manager.message_recieved(p, "ACK", game.id)
+        return game
+
+    def move(self, game, move):
+        self.manager.message_recieved(game.current_player(), "MOVE", "%s %s" % (game.id, move))
+
+    def play_games(self, count):
+        self.manager.create_tournament("T", count, 60, 0)
+        a, b = self.join("T", "a"), self.join("T", "b")
+        games = []
+        for _ in range(count):
+            game = self.start_game("T", a, b)
+            # fool's mate
+            for move in ["f2-f3", "e7-e5", "g2-g4", "d8-h4"]:
+                self.move(game, move)
+            games.append(game)
+        return games
+
+    def finish_history(self):
+        # wait for the writer to have everything on disk
+        self.manager.close()
+        self.manager.demote_finished_games()
+
+
+class RepetitionTableTest(unittest.TestCase):
+    def push(self, board, table, *moves):
+        for move in moves:
+            table.push(board, chess.Move.from_uci(move))
+
+    def test_threefold_repetition(self):
+        board = chess.Board()
+        table = game_core.RepetitionTable(board)
+        shuffle = ["g1f3", "g8f6", "f3g1", "f6g8"]
+        self.push(board, table, *shuffle)
+        self.assertFalse(table.is_threefold_repetition())
+        self.push(board, table, *shuffle[:-1])
+        self.assertFalse(table.is_threefold_repetition())
+        self.push(board, table, shuffle[-1])
+        self.assertTrue(table.is_threefold_repetition())
+
+    def test_irreversible_move_clears_counts(self):
+        board = chess.Board()
+        table = game_core.RepetitionTable(board)
+        self.push(board, table, "g1f3", "g8f6", "f3g1", "f6g8", "e2e4")
+        self.assertEqual(sum(table.counts.values()), 1)
+
+    def test_en_passant_square_only_counts_if_capture_is_legal(self):
+        # after 1. e4 there is no black pawn to capture en passant, so the position is the
+        # same as one reached with the same pieces but no en passant square
+        board = chess.Board()
+        table = game_core.RepetitionTable(board)
+        self.push(board, table, "e2e4")
+        self.assertEqual(table.key, table.position_key(chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")))
+
+
+class PairingTest(ManagerTestCase):
+    def test_pairs_up_to_games_per_pair_alternating_colors(self):
+        self.manager.create_tournament("T", 2, 60, 0)
+        a, b = self.join("T", "a"), self.join("T", "b")
+        tournament = self.manager.tournaments["T"]
+
+        first = self.start_game("T", a, b)
+        self.manager.message_recieved(first.players[0], "RESIGN", first.id)
+        self.assertEqual(tournament.get_pairing_count(*first.players), 1)
+
+        second = self.start_game("T", a, b)
+        self.assertEqual([p.name for p in second.players], [p.name for p in reversed(first.players)])
+        self.manager.message_recieved(second.players[0], "RESIGN", second.id)
+
+        self.pair("T")
+        self.assertIsNone(a.current_game)
+        self.assertIsNone(b.current_game)
+        self.assertEqual(tournament.get_standings(), {"a" : {"played" : 2, "score" : 1}, "b" : {"played" : 2, "score" : 1}})
+
+
+class TimerTest(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.manager.create_tournament("T", 1, 10, 1)
+        self.a, self.b = self.join("T", "a"), self.join("T", "b")
+
+    def test_flag(self):
+        game = self.start_game("T", self.a, self.b)
+        self.move(game, "e2-e4")
+        self.clock.advance(3)
+        self.move(game, "e7-e5")
+        # white had 10 + 1 increment
+        self.clock.advance(10.99)
+        self.assertEqual(game.state, GameState.IN_PROGRESS)
+        self.clock.advance(0.02)
+        self.assertEqual(game.state, GameState.FINISHED)
+        self.assertEqual(game.status, "Out of time")
+        self.assertEqual(game.outcomes, [0, 1])
+
+    def test_times_count_down_on_the_clock(self):
+        game = self.start_game("T", self.a, self.b)
+        self.clock.advance(2.5)
+        self.assertEqual(game.updated_times(), [7.5, 10.0])
+        self.move(game, "e2-e4")
+        self.assertEqual(game.times, [8.5, 10.0])
+
+    def test_unacked_game_is_aborted(self):
+        self.pair("T")
+        game = self.a.current_game
+        self.manager.message_recieved(self.a, "ACK", game.id)
+        self.clock.advance(game_core.WAIT_BEFORE_ABORTING + 0.01)
+        self.assertEqual(game.state, GameState.ABORTED)
+        self.assertEqual(self.a.received("GAME_ABORTED"), ["%s Not acked by both players within time limit" % (game.id,)])
+        self.assertFalse(self.a.disconnected)
+        self.assertTrue(self.b.disconnected)
+        self.assertIsNone(game.timeout_call)
+
+    def test_game_over_cancels_timer(self):
+        game = self.start_game("T", self.a, self.b)
+        self.manager.message_recieved(self.a, "RESIGN", game.id)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class TournamentTest(ManagerTestCase):
+    def test_games_move_between_state_indexes(self):
+        self.manager.create_tournament("T", 1, 60, 0)
+        tournament = self.manager.tournaments["T"]
+        a, b = self.join("T", "a"), self.join("T", "b")
+
+        self.pair("T")
+        game = a.current_game
+        self.assertEqual(tournament.games_by_state[GameState.NEEDS_ACK].keys(), [game.id])
+        self.assertEqual(tournament.all_games_count(), 0)
+
+        for p in game.players:
+            self.manager.message_recieved(p, "ACK", game.id)
+        self.assertEqual(tournament.active_games(), [game])
+        self.assertEqual(tournament.game_count(GameState.NEEDS_ACK), 0)
+
+        self.manager.message_recieved(a, "RESIGN", game.id)
+        self.assertEqual(tournament.active_games(), [])
+        self.assertEqual(tournament.compleated_games(), [game])
+        self.assertEqual(tournament.all_games_count(), 1)
+
+    def test_games_before_pages_newest_first(self):
+        self.manager.create_tournament("T", 1, 60, 0)
+        tournament = self.manager.tournaments["T"]
+        for i in range(5):
+            game = game_core.Game(tournament, game_core.PlayerSummary("a"), game_core.PlayerSummary("b"), history_offset=0)
+            game.created_at = float(i)
+            game.state = GameState.FINISHED
+            tournament.add_game(game)
+        page = tournament.games_before(GameState.FINISHED, limit=2)
+        self.assertEqual([g.created_at for g in page], [4.0, 3.0])
+        page = tournament.games_before(GameState.FINISHED, (page[-1].created_at, page[-1].id), limit=10)
+        self.assertEqual([g.created_at for g in page], [2.0, 1.0, 0.0])
+
+    def test_modified_times_are_whole_seconds_and_increase(self):
+        self.manager.create_tournament("T", 1, 60, 0)
+        tournament = self.manager.tournaments["T"]
+        times = [tournament.modified_at]
+        for name in ["a", "b", "c"]:
+            self.join("T", name)
+            times.append(tournament.modified_at)
+        self.assertEqual([t - times[0] for t in times], [0, 1, 2, 3])
+        self.assertIsInstance(times[0], int)
+        self.assertTrue(times[0] >= time.time())
+        self.assertTrue(self.manager.modified_at >= times[-1])
+
+
+class OutcomeTest(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.manager.create_tournament("T", 1, 60, 0)
+        self.a, self.b = self.join("T", "a"), self.join("T", "b")
+        self.game = self.start_game("T", self.a, self.b)
+
+    def outcome(self, fen, move):
+        self.game.board = chess.Board(fen)
+        self.game.repetitions = game_core.RepetitionTable(self.game.board)
+        move = chess.Move.from_uci(move)
+        self.assertTrue(self.game.board.is_legal(move))
+        return self.game.apply_move(move)
+
+    def test_checkmate(self):
+        self.assertEqual(self.outcome("rnbqkbnr/pppp1ppp/8/4p3/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq - 0 2", "d8h4"), "Checkmate")
+
+    def test_stalemate(self):
+        self.assertEqual(self.outcome("7k/8/6Q1/8/8/8/8/K7 w - - 0 1", "g6f7"), "Stalemate")
+
+    def test_insufficient_material(self):
+        self.assertEqual(self.outcome("k7/8/8/8/8/8/1r6/K7 w - - 0 1", "a1b2"), "Insufficient material")
+
+    def test_fifty_moves(self):
+        self.assertEqual(self.outcome("k7/8/8/8/8/8/8/KR6 w - - 99 80", "b1b2"), "Fifty moves without capture or pawn push")
+        self.assertIsNone(self.outcome("k7/8/8/8/8/8/8/KR6 w - - 98 80", "b1b2"))
+
+    def test_threefold_repetition_ends_the_game(self):
+        for move in ["g1-f3", "g8-f6", "f3-g1", "f6-g8"] * 2:
+            self.assertEqual(self.game.state, GameState.IN_PROGRESS)
+            self.move(self.game, move)
+        self.assertEqual(self.game.status, "Threefold repetition")
+        self.assertEqual(self.game.outcomes, [0.5, 0.5])
+        self.assertEqual(self.game.state, GameState.FINISHED)
+
+    def test_fen_is_kept_per_ply(self):
+        self.move(self.game, "e2-e4")
+        self.move(self.game, "e7-e5")
+        self.assertEqual(len(self.game.fens), 3)
+        self.assertEqual(self.game.fens[0], chess.STARTING_FEN)
+        self.assertEqual(self.game.current_fen(), self.game.board.fen())
+        moved = self.b.received("PLAYER_MOVED")[-1]
+        self.assertTrue(moved.endswith(self.game.current_fen()))
+
+
+class ObserverTest(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.manager.create_tournament("T", 1, 60, 0)
+        self.a, self.b = self.join("T", "a"), self.join("T", "b")
+        self.game = self.start_game("T", self.a, self.b)
+
+    def test_games_are_found_by_id(self):
+        self.assertIs(self.manager.game_for_id(self.game.id), self.game)
+        observer = self.connect()
+        self.assertRaises(AssertionError, self.manager.message_recieved, observer, "WATCH", "nosuchgame")
+
+    def test_watch_twice_observes_once(self):
+        observer = self.connect()
+        self.manager.message_recieved(observer, "WATCH", self.game.id)
+        self.manager.message_recieved(observer, "WATCH", self.game.id)
+        self.move(self.game, "e2-e4")
+        self.assertEqual(len(observer.received("GAME_STATE")), 2)
+        self.assertEqual(len(observer.received("PLAYER_MOVED")), 1)
+        self.assertEqual(self.game.observers.keys(), [observer])
+
+    def test_unwatch_and_disconnect(self):
+        observer, other = self.connect(), self.connect()
+        for o in (observer, other):
+            self.manager.message_recieved(o, "WATCH", self.game.id)
+        self.manager.message_recieved(observer, "UNWATCH", self.game.id)
+        self.manager.player_disconnected(other)
+        self.assertEqual(len(self.game.observers), 0)
+        self.assertEqual(other.observing_games.keys(), [])
+
+    def test_delta_observers_get_short_messages(self):
+        full, delta = self.connect(), self.connect()
+        self.manager.message_recieved(full, "WATCH", self.game.id)
+        self.manager.message_recieved(delta, "WATCH", "%s delta" % (self.game.id,))
+        self.move(self.game, "e2-e4")
+        self.assertEqual(len(full.received("PLAYER_MOVED")), 1)
+        self.assertEqual(delta.received("PLAYER_MOVED"), [])
+        moved = delta.received("MOVED")
+        self.assertEqual(len(moved), 1)
+        self.assertEqual(moved[0].split(" ")[:2], [self.game.id, "e2e4"])
+        # both still start from the full state
+        self.assertEqual(len(delta.received("GAME_STATE")), 1)
+
+        self.assertRaises(AssertionError, self.manager.message_recieved, delta, "WATCH", "%s full" % (self.game.id,))
+
+
+class HistoryTest(ManagerTestCase):
+    def test_games_survive_a_restart(self):
+        games = self.play_games(2)
+        self.finish_history()
+        self.assertEqual(self.manager.history_writer.stats()["games_written"], 2)
+
+        manager = self.new_manager()
+        tournament = manager.tournaments["T"]
+        self.assertEqual(sorted(tournament.games.keys()), sorted(g.id for g in games))
+        for game in games:
+            loaded = tournament.games[game.id]
+            self.assertEqual(loaded.status, "Checkmate")
+            self.assertEqual(loaded.outcomes, game.outcomes)
+            self.assertEqual(loaded.board.fen(), game.current_fen())
+        self.assertEqual(tournament.get_pairing_count(*games[0].players), 1)
+
+    def test_index_covers_every_game(self):
+        games = self.play_games(2)
+        self.finish_history()
+        with open(self.manager.history_index_name) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([e["headers"]["GameID"] for e in entries], [g.id for g in games])
+        self.assertEqual(entries[0]["end"], entries[1]["offset"])
+        self.assertEqual(entries[1]["end"], os.path.getsize(self.history_file_name))
+
+    def test_stale_index_is_rebuilt(self):
+        games = self.play_games(2)
+        self.finish_history()
+        # replace the history with just the second game, leaving the index of both behind
+        with open(self.history_file_name) as f:
+            f.seek(games[1].history_offset)
+            second = f.read()
+        with open(self.history_file_name, "w") as f:
+            f.write(second)
+
+        manager = self.new_manager()
+        self.assertEqual(manager.tournaments["T"].games.keys(), [games[1].id])
+        with open(manager.history_index_name) as f:
+            self.assertEqual([json.loads(line)["offset"] for line in f], [0])
+
+
+    def test_games_missing_from_the_index_are_scanned(self):
+        games = self.play_games(2)
+        self.finish_history()
+        with open(self.manager.history_index_name) as f:
+            first = f.readline()
+        with open(self.manager.history_index_name, "w") as f:
+            f.write(first)
+
+        manager = self.new_manager()
+        self.assertEqual(sorted(manager.tournaments["T"].games.keys()), sorted(g.id for g in games))
+        with open(manager.history_index_name) as f:
+            self.assertEqual([json.loads(line)["headers"]["GameID"] for line in f], [g.id for g in games])
+
+    def test_writer_survives_a_game_it_cannot_write(self):
+        class Unwritable(object):
+            id = "unwritable"
+            def __str__(self):
+                raise ValueError("can't serialize")
+        class BadGame(object):
+            id = "unwritable"
+            pgn = Unwritable()
+
+        self.manager.history_writer.save_game(BadGame())
+        games = self.play_games(1)
+        self.finish_history()
+        stats = self.manager.history_writer.stats()
+        self.assertEqual(stats["games_failed"], 1)
+        self.assertEqual(stats["games_written"], 1)
+        self.assertEqual(games[0].history_offset, 0)
+
+    def test_failed_batch_is_written_again(self):
+        writer = self.manager.history_writer
+        writer.retry_interval = 0.01
+        # the game's pgn goes in, then its index line fails
+        writer.history_index = FailingFile(writer.history_index, 1)
+        games = self.play_games(1)
+        self.finish_history()
+
+        stats = writer.stats()
+        self.assertEqual((stats["batches_failed"], stats["games_written"], stats["games_failed"]), (1, 1, 0))
+        with open(self.manager.history_index_name) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([(e["offset"], e["headers"]["GameID"]) for e in entries], [(0, games[0].id)])
+        self.assertEqual(entries[0]["end"], os.path.getsize(self.history_file_name))
+
+    def test_games_still_failing_on_close_are_lost(self):
+        writer = self.manager.history_writer
+        writer.retry_interval = 0.01
+        writer.history_index = FailingFile(writer.history_index, None)
+        self.play_games(1)
+        self.finish_history()
+
+        stats = writer.stats()
+        self.assertEqual((stats["games_written"], stats["games_failed"]), (0, 1))
+        self.assertEqual(os.path.getsize(self.history_file_name), 0)
+
+    def test_queue_depth_metric(self):
+        self.assertIn("\nchess_history_queue_depth 0\n", metrics.REGISTRY.render())
+
+
+class HistoryCacheTest(ManagerTestCase):
+    def test_evicts_least_recently_used(self):
+        games = self.play_games(3)
+        self.finish_history()
+        manager = self.new_manager(history_cache_size=2)
+        loaded = [manager.games[g.id] for g in games]
+        cache = manager.history_cache
+
+        loaded[0].board, loaded[1].board, loaded[0].board
+        self.assertEqual(cache.stats(), {"size" : 2, "hits" : 1, "misses" : 2})
+        # evicts loaded[1], the least recently used
+        loaded[2].board
+        self.assertEqual(cache.entries.keys(), [games[0].id, games[2].id])
+        loaded[1].board
+        self.assertEqual(cache.stats(), {"size" : 2, "hits" : 1, "misses" : 4})
+
+    def test_demoted_games_read_back_through_cache(self):
+        games = self.play_games(2)
+        self.finish_history()
+        for game in games:
+            self.assertIsNone(game._pgn)
+            self.assertEqual(game.pgn.headers["GameID"], game.id)
+            self.assertIsNone(game.fens)
+            self.assertIsInstance(game.players[0], game_core.PlayerSummary)
+
+
+class BroadcastTest(ManagerTestCase):
+    def test_one_broadcast_for_every_recipient(self):
+        class BroadcastRecorder(FakePlayer):
+            def send_broadcast(self, broadcast):
+                self.messages.append((broadcast.action, broadcast))
+
+        self.manager.create_tournament("T", 1, 60, 0)
+        a, b = self.join("T", "a"), self.join("T", "b")
+        game = self.start_game("T", a, b)
+        observers = [BroadcastRecorder(), BroadcastRecorder()]
+        for o in observers:
+            self.manager.player_connected(o)
+            self.manager.message_recieved(o, "WATCH", game.id)
+
+        for p in game.players + observers:
+            p.messages = []
+        self.move(game, u"e2-e4")
+        sent = [p.received("PLAYER_MOVED") for p in observers]
+        self.assertEqual(len(sent[0]), 1)
+        self.assertIs(sent[0][0], sent[1][0])
+        self.assertEqual(sent[0][0].data, "PLAYER_MOVED %s\n" % (a.received("PLAYER_MOVED")[0],))
+
+
+class EventFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.feed = game_core.EventFeed(lambda: [game_core.Broadcast("STATE", "now")], size=3)
+        for i in range(5):
+            self.feed.publish(game_core.Broadcast("E", str(i)))
+
+    def event_id(self, seq):
+        return "%s-%s" % (self.feed.token, seq)
+
+    def test_resumes_after_retained_event(self):
+        self.assertEqual([e.broadcast.message for e in self.feed.since(self.event_id(3))], ["3", "4"])
+        self.assertEqual(self.feed.since(self.event_id(5)), [])
+
+    def test_resumes_just_before_the_oldest_retained_event(self):
+        self.assertEqual([e.seq for e in self.feed.since(self.event_id(2))], [3, 4, 5])
+
+    def test_needs_reset_when_resume_point_is_gone(self):
+        self.assertIsNone(self.feed.since(self.event_id(1)))
+        self.assertIsNone(self.feed.since(self.event_id(6)))
+        self.assertIsNone(self.feed.since(None))
+        self.assertIsNone(self.feed.since("deadbeef-4"))
+        self.assertIsNone(self.feed.since(self.feed.token + "-x"))
+
+    def test_reset_events(self):
+        events = self.feed.reset_events()
+        self.assertEqual([(e.broadcast.action, e.broadcast.message) for e in events], [("RESET", ""), ("STATE", "now")])
+        self.assertEqual(set(e.id for e in events), set([self.event_id(5)]))
+
+    def test_close_notifies_subscribers(self):
+        closed = []
+        class Subscriber(object):
+            def send_event(self, event):
+                pass
+            def feed_closed(self):
+                closed.append(self)
+        subscriber = Subscriber()
+        self.feed.subscribe(subscriber)
+        self.feed.close()
+        self.assertEqual(closed, [subscriber])
+        self.assertEqual(len(self.feed.subscribers), 0)
+
+
+class WatchTest(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.manager.create_tournament("T", 1, 60, 0)
+        self.a, self.b = self.join("T", "a"), self.join("T", "b")
+
+    def watch_tournament(self, delta=False):
+        watcher = self.connect()
+        self.manager.message_recieved(watcher, "WATCH_TOURNAMENT", "T DELTA" if delta else "T")
+        return watcher
+
+    def test_tournament_watcher_sees_every_game_message(self):
+        watcher = self.watch_tournament()
+        game = self.start_game("T", self.a, self.b)
+        self.move(game, "e2-e4")
+        self.assertEqual([a for a, _ in watcher.messages], ["GAME_PAIRED", "GAME_STARTED", "PLAYER_MOVED"])
+
+    def test_delta_watcher(self):
+        watcher = self.watch_tournament(delta=True)
+        game = self.start_game("T", self.a, self.b)
+        self.move(game, "e2-e4")
+        self.assertEqual(watcher.received("MOVED"), ["%s e2e4 60.00 60.00" % (game.id,)])
+        self.assertEqual(watcher.received("PLAYER_MOVED"), [])
+
+    def test_new_watcher_gets_games_in_progress(self):
+        game = self.start_game("T", self.a, self.b)
+        watcher = self.watch_tournament()
+        self.assertEqual(watcher.received("GAME_STATE"), [game.game_state_str()])
+
+    def test_game_observer_gets_each_message_once(self):
+        watcher = self.watch_tournament()
+        game = self.start_game("T", self.a, self.b)
+        self.manager.message_recieved(watcher, "WATCH", game.id)
+        self.move(game, "e2-e4")
+        self.assertEqual(len(watcher.received("PLAYER_MOVED")), 1)
+
+    def test_players_cannot_watch_tournament(self):
+        self.assertRaises(AssertionError, self.manager.message_recieved, self.a, "WATCH_TOURNAMENT", "T")
+        watcher = self.watch_tournament()
+        self.assertRaises(AssertionError, self.manager.message_recieved, watcher, "JOIN", "T c")
+
+    def test_unwatch_and_disconnect(self):
+        watcher = self.watch_tournament()
+        other = self.watch_tournament()
+        self.manager.message_recieved(watcher, "UNWATCH_TOURNAMENT", "T")
+        self.manager.player_disconnected(other)
+        self.start_game("T", self.a, self.b)
+        self.assertEqual(watcher.messages, [])
+        self.assertEqual(other.messages, [])
+        self.assertEqual(len(self.manager.tournaments["T"].watchers), 0)
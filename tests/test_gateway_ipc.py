@@ -0,0 +1,87 @@
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial import unittest
+
+import os
+import struct
+
+import game_core
+import gateway_ipc
+
+
+class GatewayConnectionTest(unittest.TestCase):
+    def setUp(self):
+        directory = self.mktemp()
+        os.mkdir(directory)
+        self.clock = task.Clock()
+        self.manager = game_core.Manager(os.path.join(directory, "history.pgn"), self.clock)
+        self.addCleanup(self.manager.close)
+        self.connection = gateway_ipc.GatewayConnection(self.manager, self.clock)
+        self.transport = StringTransport()
+        self.connection.makeConnection(self.transport)
+        self.addCleanup(self.connection.connectionLost, None)
+
+    def receive(self, frame):
+        self.connection.dataReceived(struct.pack("!I", len(frame)) + frame)
+
+    def message(self, client_id, action, message):
+        self.receive(gateway_ipc.message_frame(client_id, action, message))
+
+    def sent_frames(self):
+        self.clock.advance(0)
+        data = self.transport.value()
+        self.transport.clear()
+        frames = []
+        while data:
+            length = struct.unpack_from("!I", data)[0]
+            frames.append(data[4:4 + length])
+            data = data[4 + length:]
+        return frames
+
+    def start_game(self):
+        self.manager.create_tournament("T", 1, 60, 0)
+        for client_id, name in [(1, "a"), (2, "b")]:
+            self.receive(gateway_ipc.client_frame(gateway_ipc.OPEN, client_id))
+            self.message(client_id, "JOIN", "T %s" % (name,))
+        for p in self.manager.tournaments["T"].players.values():
+            p.last_game_done = 0
+        self.manager.update_pairings()
+        game = self.connection.players[1].current_game
+        for p in game.players:
+            self.message(p.client_id, "ACK", game.id)
+        return game
+
+    def test_bad_message_only_drops_its_client(self):
+        game = self.start_game()
+        self.sent_frames()
+        mover = game.current_player()
+        self.message(mover.client_id, "MOVE", "%s z" % (game.id,))
+
+        self.assertFalse(self.transport.disconnecting)
+        disconnects = [gateway_ipc.parse_client_frame(f)[:2] for f in self.sent_frames() if f[0] == gateway_ipc.DISCONNECT]
+        self.assertEqual(disconnects, [(gateway_ipc.DISCONNECT, mover.client_id)])
+        self.assertEqual(sorted(self.connection.players.keys()), [1, 2])
+
+        # the connection still handles the other client's messages
+        self.message(3 - mover.client_id, "SAY", "hello")
+        self.receive(gateway_ipc.client_frame(gateway_ipc.CLOSED, mover.client_id))
+        self.assertEqual(self.connection.players.keys(), [3 - mover.client_id])
+
+    def test_undecodable_message_only_drops_its_client(self):
+        self.receive(gateway_ipc.client_frame(gateway_ipc.OPEN, 1))
+        self.receive(gateway_ipc.MESSAGE + gateway_ipc.CLIENT.pack(1) + "JOIN \xff")
+        self.assertFalse(self.transport.disconnecting)
+        self.assertIn(gateway_ipc.client_frame(gateway_ipc.DISCONNECT, 1), self.sent_frames())
+
+    def test_sends_to_many_clients_are_one_frame(self):
+        for client_id in range(3):
+            self.receive(gateway_ipc.client_frame(gateway_ipc.OPEN, client_id))
+        self.sent_frames()
+        broadcast = game_core.Broadcast("INFO", "hello")
+        for player in self.connection.players.values():
+            player.send_broadcast(broadcast)
+        frames = self.sent_frames()
+        self.assertEqual(len(frames), 1)
+        client_ids, data = gateway_ipc.parse_send_frame(frames[0])
+        self.assertEqual(sorted(client_ids), [0, 1, 2])
+        self.assertEqual(data, broadcast.data)
@@ -0,0 +1,258 @@
+from twisted.internet import task
+from twisted.trial import unittest
+from twisted.web import http
+from twisted.web.resource import NoResource
+from twisted.web.test.requesthelper import DummyRequest
+
+import json
+import os
+
+import game_core
+from http import api
+from http import events
+from http import pgn_export
+from http import util
+from tests.test_game_core import ManagerTestCase
+
+
+class StreamRequest(DummyRequest):
+    # DummyRequest drives a registered producer in a loop, as if it were a pull producer
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class NotModifiedTest(unittest.TestCase):
+    def request(self, **headers):
+        request = DummyRequest([])
+        for name, value in headers.items():
+            request.requestHeaders.setRawHeaders(name.replace("_", "-"), [value])
+        return request
+
+    def test_sets_validators(self):
+        request = self.request()
+        self.assertFalse(util.not_modified(request, '"abc"', 1000))
+        self.assertEqual(request.responseHeaders.getRawHeaders("etag"), ['"abc"'])
+        self.assertEqual(request.responseHeaders.getRawHeaders("last-modified"), [http.datetimeToString(1000)])
+        self.assertEqual(request.responseCode, None)
+
+    def test_matching_etag(self):
+        request = self.request(if_none_match='"xyz", "abc"')
+        self.assertTrue(util.not_modified(request, '"abc"', 1000))
+        self.assertEqual(request.responseCode, http.NOT_MODIFIED)
+
+    def test_etag_wins_over_date(self):
+        request = self.request(if_none_match='"old"', if_modified_since=http.datetimeToString(2000))
+        self.assertFalse(util.not_modified(request, '"abc"', 1000))
+
+    def test_date_revalidation(self):
+        # a client revalidates with the Last-Modified it was sent
+        request = self.request()
+        util.not_modified(request, '"abc"', 1000)
+        last_modified = request.responseHeaders.getRawHeaders("last-modified")[0]
+        request = self.request(if_modified_since=last_modified)
+        self.assertTrue(util.not_modified(request, '"abc"', 1000))
+        self.assertEqual(request.responseCode, http.NOT_MODIFIED)
+        request = self.request(if_modified_since=last_modified)
+        self.assertFalse(util.not_modified(request, '"abc"', 1001))
+
+    def test_bad_date(self):
+        request = self.request(if_modified_since="yesterday")
+        self.assertFalse(util.not_modified(request, '"abc"', 1000))
+
+
+class UtilTest(unittest.TestCase):
+    def test_path_name(self):
+        self.assertEqual(util.path_name("caf\xc3\xa9"), u"caf\xe9")
+        self.assertEqual(util.path_name("a%41"), u"a%41")
+        self.assertIsNone(util.path_name("\xff"))
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        key = (1514764800.25, "0ca16ecaede711e7bb5048d705daa9ad")
+        self.assertEqual(api.decode_cursor(api.encode_cursor(key)), key)
+
+    def test_bad_cursor(self):
+        for cursor in ["not base64!", api.encode_cursor([])[:-2], "eyJhIjogMX0="]:
+            self.assertRaises(ValueError, api.decode_cursor, cursor)
+
+    def test_descending_page(self):
+        keys = range(10)
+        self.assertEqual(api.descending_page(keys, None, 4), ([9, 8, 7, 6], 6))
+        self.assertEqual(api.descending_page(keys, 6, 4), ([5, 4, 3, 2], 2))
+        self.assertEqual(api.descending_page(keys, 2, 4), ([1, 0], None))
+        self.assertEqual(api.descending_page(keys, 4, 4), ([3, 2, 1, 0], None))
+
+
+class ApiTest(unittest.TestCase):
+    def setUp(self):
+        directory = self.mktemp()
+        os.mkdir(directory)
+        self.manager = game_core.Manager(os.path.join(directory, "history.pgn"), task.Clock())
+        self.addCleanup(self.manager.close)
+        self.manager.create_tournament("a%41", 1, 60, 0)
+        self.tournament = self.manager.tournaments["a%41"]
+        for i in range(5):
+            game = game_core.Game(self.tournament, game_core.PlayerSummary("w%s" % (i,)), game_core.PlayerSummary("b%s" % (i,)), history_offset=0)
+            game.created_at = float(i)
+            game.state = game_core.GameState.FINISHED
+            game.outcomes = [1, 0]
+            game.status = "Checkmate"
+            self.tournament.add_game(game)
+
+    def get(self, resource, **args):
+        request = DummyRequest([])
+        request.args = dict((k, [v]) for k, v in args.items())
+        finished = request.notifyFinish()
+        result = resource.render_GET(request)
+        if result != api.NOT_DONE_YET:
+            request.write(result)
+            request.finish()
+        return finished.addCallback(lambda _: (request, json.loads("".join(request.written))))
+
+    def test_tournament_names_are_decoded_once(self):
+        tournaments = api.ApiTournamentList(self.manager)
+        self.assertIsInstance(tournaments.getChild("a%41", DummyRequest([])), api.ApiTournament)
+        self.assertIsInstance(tournaments.getChild("aA", DummyRequest([])), NoResource)
+        self.assertIsInstance(tournaments.getChild("\xff", DummyRequest([])), NoResource)
+
+    def test_completed_games_pages(self):
+        games = api.ApiGameList(self.tournament, game_core.GameState.FINISHED, api.COMPLETED_GAME_DEFAULT_FIELDS)
+        d = self.get(games, limit="2")
+        def first_page((request, body)):
+            self.assertEqual([g["white"] for g in body["items"]], ["w4", "w3"])
+            self.assertEqual(sorted(body["items"][0].keys()), sorted(api.COMPLETED_GAME_DEFAULT_FIELDS))
+            self.assertEqual(body["items"][0]["result"], [1, 0])
+            return self.get(games, limit="2", cursor=str(body["next_cursor"]))
+        def second_page((request, body)):
+            self.assertEqual([g["white"] for g in body["items"]], ["w2", "w1"])
+            return self.get(games, limit="2", cursor=str(body["next_cursor"]), fields="id,times")
+        def last_page((request, body)):
+            self.assertEqual(body["items"], [{"id" : self.tournament.game_keys_by_state[game_core.GameState.FINISHED][0][1], "times" : None}])
+            self.assertIsNone(body["next_cursor"])
+        return d.addCallback(first_page).addCallback(second_page).addCallback(last_page)
+
+    def test_empty_page(self):
+        games = api.ApiGameList(self.tournament, game_core.GameState.IN_PROGRESS, api.ACTIVE_GAME_DEFAULT_FIELDS)
+        def check((request, body)):
+            self.assertEqual(body, {"items" : [], "next_cursor" : None})
+        return self.get(games).addCallback(check)
+
+    def test_bad_arguments(self):
+        games = api.ApiGameList(self.tournament, game_core.GameState.FINISHED, api.COMPLETED_GAME_DEFAULT_FIELDS)
+        def check((request, body)):
+            self.assertEqual(request.responseCode, 400)
+            self.assertIn("error", body)
+        return self.get(games, limit="0").addCallback(check).addCallback(
+            lambda _: self.get(games, fields="id,nope")).addCallback(check).addCallback(
+            lambda _: self.get(games, cursor="junk")).addCallback(check)
+
+    def test_standings(self):
+        standings = api.ApiStandings(self.tournament)
+        def check((request, body)):
+            self.assertEqual([s["player"] for s in body["items"]], ["w0", "w1"])
+            self.assertEqual(body["items"][0]["score"], 1)
+        return self.get(standings, limit="2").addCallback(check)
+
+
+class PgnExportTest(ManagerTestCase):
+    def export(self, resource):
+        request = DummyRequest([])
+        self.assertEqual(resource.render_GET(request), pgn_export.NOT_DONE_YET)
+        self.assertEqual(request.finished, 1)
+        return request
+
+    def test_tournament_export(self):
+        self.patch(pgn_export, "CHUNK_SIZE", 1)
+        finished = self.play_games(1)[0]
+        self.finish_history()
+        c = self.join("T", "c")
+        self.pair("T")
+        live = c.current_game
+        for p in live.players:
+            self.manager.message_recieved(p, "ACK", live.id)
+        self.move(live, "e2-e4")
+
+        tournament = self.manager.tournaments["T"]
+        self.assertEqual(list(pgn_export.tournament_games(tournament)), [finished, live])
+        request = self.export(pgn_export.PgnExport(self.manager, "T.pgn", lambda: pgn_export.tournament_games(tournament)))
+        # a chunk per game with CHUNK_SIZE this small
+        self.assertEqual(len(request.written), 2)
+        with open(self.history_file_name) as f:
+            self.assertEqual(request.written[0], f.read())
+        self.assertIn('[GameID "%s"]' % (live.id,), request.written[1])
+        self.assertIn("1. e4 *", request.written[1])
+        self.assertEqual(request.responseHeaders.getRawHeaders("content-disposition"), ['attachment; filename="T.pgn"'])
+
+    def test_game_export(self):
+        game = self.play_games(1)[0]
+        request = self.export(pgn_export.PgnExport(self.manager, "%s.pgn" % (game.id,), lambda: [game]))
+        self.assertEqual(request.written, [str(game.pgn) + "\n\n"])
+        self.assertEqual(request.responseHeaders.getRawHeaders("content-type"), ["application/x-chess-pgn"])
+
+
+class EventStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.feed = game_core.EventFeed(lambda: [game_core.Broadcast("STANDINGS", "a 0 0")], size=3)
+
+    def subscribe(self, last_event_id=None):
+        request = StreamRequest([])
+        subscriber = events.EventSubscriber(request, self.feed)
+        subscriber.keepalive.clock = task.Clock()
+        subscriber.start(last_event_id)
+        self.addCleanup(subscriber.stop)
+        del request.written[:]
+        return request
+
+    def publish(self, count):
+        for i in range(count):
+            self.feed.publish(game_core.Broadcast("E", str(i)))
+
+    def sent(self, request):
+        return [block.split("\n") for block in "".join(request.written).split("\n\n") if block]
+
+    def test_new_subscriber_starts_from_current_state(self):
+        self.publish(2)
+        request = StreamRequest([])
+        subscriber = events.EventSubscriber(request, self.feed)
+        subscriber.keepalive.clock = task.Clock()
+        subscriber.start(None)
+        blocks = self.sent(request)
+        self.assertEqual(blocks[0], ["retry: %s" % (events.RETRY_MS,)])
+        self.assertEqual(blocks[1:], [
+            ["id: %s-2" % (self.feed.token,), "event: RESET", "data: "],
+            ["id: %s-2" % (self.feed.token,), "event: STANDINGS", "data: a 0 0"],
+        ])
+        subscriber.stop()
+
+    def test_resume(self):
+        self.publish(2)
+        request = self.subscribe("%s-1" % (self.feed.token,))
+        self.publish(1)
+        self.assertEqual([b[0] for b in self.sent(request)], ["id: %s-3" % (self.feed.token,)])
+
+    def test_paused_subscriber_catches_up(self):
+        request = self.subscribe()
+        request.producer.pauseProducing()
+        self.publish(2)
+        self.assertEqual(request.written, [])
+        request.producer.resumeProducing()
+        self.assertEqual([b[2] for b in self.sent(request)], ["data: 0", "data: 1"])
+
+    def test_subscriber_that_fell_behind_is_reset(self):
+        request = self.subscribe()
+        request.producer.pauseProducing()
+        self.publish(5)
+        request.producer.resumeProducing()
+        self.assertEqual([b[1] for b in self.sent(request)], ["event: RESET", "event: STANDINGS"])
+        self.publish(1)
+        self.assertEqual(self.sent(request)[-1][0], "id: %s-6" % (self.feed.token,))
+
+    def test_feed_closed_finishes_request(self):
+        request = self.subscribe()
+        self.feed.close()
+        self.assertEqual(request.finished, 1)
+        self.assertEqual(len(self.feed.subscribers), 0)
@@ -0,0 +1,56 @@
+from twisted.trial import unittest
+
+import metrics
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = metrics.Counter("moves_total", "Moves played", registry=self.registry)
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual(self.registry.render(), "# HELP moves_total Moves played\n# TYPE moves_total counter\nmoves_total 3\n")
+
+    def test_labelled_gauge(self):
+        gauge = metrics.Gauge("clients", "Clients", ["kind"], registry=self.registry)
+        gauge.labels("websocket").inc(2)
+        gauge.labels("line").set(5)
+        gauge.labels("websocket").dec()
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:], ['clients{kind="line"} 5', 'clients{kind="websocket"} 1'])
+        self.assertRaises(AssertionError, gauge.labels, "a", "b")
+
+    def test_label_escaping(self):
+        counter = metrics.Counter("games_total", "Games", ["tournament"], registry=self.registry)
+        counter.labels(u'a "b"\\\n\xe9').inc()
+        self.assertIn('games_total{tournament="a \\"b\\"\\\\\\n\xc3\xa9"} 1\n', self.registry.render())
+
+    def test_histogram(self):
+        histogram = metrics.Histogram("latency_seconds", "Latency", buckets=(1.0, 0.1), registry=self.registry)
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            histogram.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1.0"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 2.65',
+            'latency_seconds_count 4',
+        ])
+
+    def test_gauge_read_at_scrape_time(self):
+        depth = [1]
+        gauge = metrics.Gauge("queue_depth", "Depth", registry=self.registry)
+        gauge.set_function(lambda: depth[0])
+        self.assertIn("\nqueue_depth 1\n", self.registry.render())
+        depth[0] = 7
+        self.assertIn("\nqueue_depth 7\n", self.registry.render())
+
+        labelled = metrics.Gauge("labelled", "Labelled", ["a"], registry=self.registry)
+        self.assertRaises(AssertionError, labelled.set_function, lambda: 0)
+
+    def test_names_are_unique(self):
+        metrics.Counter("moves_total", "Moves", registry=self.registry)
+        self.assertRaises(AssertionError, metrics.Gauge, "moves_total", "Moves", registry=self.registry)
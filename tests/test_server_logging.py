@@ -0,0 +1,64 @@
+from twisted.trial import unittest
+
+import logging
+import sys
+import Queue
+
+import server_logging
+
+
+def make_record(action=None, exc_info=None):
+    record = logging.LogRecord("server.messages", logging.INFO, __file__, 1, "message %s", ("x",), exc_info)
+    if action is not None:
+        record.action = action
+    return record
+
+
+class ActionSamplerTest(unittest.TestCase):
+    def test_samples_each_action_separately(self):
+        sampler = server_logging.ActionSampler({"MOVE" : 3, "*" : 2})
+        moves = [sampler.filter(make_record("MOVE")) for _ in range(6)]
+        says = [sampler.filter(make_record("SAY")) for _ in range(4)]
+        self.assertEqual(moves, [True, False, False, True, False, False])
+        self.assertEqual(says, [True, False, True, False])
+
+    def test_keeps_records_without_an_action(self):
+        sampler = server_logging.ActionSampler({"*" : 1000})
+        self.assertTrue(all(sampler.filter(make_record()) for _ in range(5)))
+
+    def test_keeps_every_record_without_a_rate(self):
+        sampler = server_logging.ActionSampler({})
+        self.assertTrue(all(sampler.filter(make_record("MOVE")) for _ in range(5)))
+
+
+class QueueHandlerTest(unittest.TestCase):
+    def test_drops_and_counts_records_when_full(self):
+        queue = Queue.Queue(2)
+        handler = server_logging.QueueHandler(queue)
+        for _ in range(5):
+            handler.emit(make_record())
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_formats_tracebacks_before_queueing(self):
+        queue = Queue.Queue()
+        handler = server_logging.QueueHandler(queue)
+        try:
+            raise ValueError("bad move")
+        except ValueError:
+            handler.emit(make_record(exc_info=sys.exc_info()))
+        record = queue.get_nowait()
+        self.assertIsNone(record.exc_info)
+        self.assertIn("ValueError: bad move", record.exc_text)
+
+    def test_listener_writes_queued_records_on_stop(self):
+        queue = Queue.Queue()
+        written = []
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                written.append(record.getMessage())
+        listener = server_logging.QueueListener(queue, ListHandler())
+        server_logging.QueueHandler(queue).emit(make_record())
+        listener.start()
+        listener.stop()
+        self.assertEqual(written, ["message x"])
@@ -0,0 +1,28 @@
+from twisted.trial import unittest
+
+import uuid
+
+import sharding
+
+
+class ShardingTest(unittest.TestCase):
+    def test_tournaments_are_spread_by_name(self):
+        shards = set(sharding.shard_for_tournament("T%s" % (i,), 4) for i in range(100))
+        self.assertEqual(shards, set(range(4)))
+        self.assertEqual(sharding.shard_for_tournament(" T1 ", 4), sharding.shard_for_tournament("T1", 4))
+        self.assertEqual(sharding.shard_for_tournament(u"caf\xe9", 4), sharding.shard_for_tournament("caf\xc3\xa9", 4))
+
+    def test_games_are_found_by_id(self):
+        for shard in range(3):
+            game_id = uuid.uuid1(sharding.game_id_node(shard)).hex
+            self.assertEqual(sharding.shard_for_game(game_id, 3), shard)
+
+    def test_ids_not_made_by_a_shard(self):
+        self.assertIsNone(sharding.shard_for_game(uuid.uuid1(0x123456789abc).hex, 3))
+        self.assertIsNone(sharding.shard_for_game(uuid.uuid1(sharding.game_id_node(3)).hex, 3))
+        self.assertIsNone(sharding.shard_for_game("nosuchgame", 3))
+        self.assertIsNone(sharding.shard_for_game("z" * 32, 3))
+
+    def test_single_shard_has_every_game(self):
+        self.assertEqual(sharding.shard_for_game(uuid.uuid1(0x123456789abc).hex, 1), 0)
+        self.assertEqual(sharding.shard_for_game("nosuchgame", 1), 0)